@@ -0,0 +1,75 @@
+"""
+Compares reading measure coordinates from the JSON column with reading the packed
+float32 column, for a listing / re-scoring sized batch of rows.
+
+json:   json.loads of the stored text, then the per-point dict walk into 28 floats
+        (or coordinates_array(), which also validates into a float64 array)
+packed: np.frombuffer over the 112-byte value (one view per row)
+matrix: np.frombuffer over all rows joined, i.e. one (n, 28) array for a whole chunk
+
+Usage:
+    python benchmarks/coordinates_benchmark.py [--rows 100000]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+logging.disable(logging.ERROR)
+
+from lib.coordinates import PACKED_DTYPE, N_VALUES, coordinates_array, pack_coordinates, unpack_coordinates  # noqa: E402
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 2000, size=(args.rows, 14, 2)).round(2)
+    stored_json = [json.dumps([{"x": x, "y": y} for x, y in row]) for row in points.tolist()]
+    stored_packed = [pack_coordinates(json.loads(text)) for text in stored_json]
+
+    def from_json():
+        out = []
+        for text in stored_json:
+            flat = []
+            for point in json.loads(text):
+                flat.append(float(point['x']))
+                flat.append(float(point['y']))
+            out.append(flat)
+        return out
+
+    def from_packed():
+        return [unpack_coordinates(packed) for packed in stored_packed]
+
+    def as_matrix():
+        return np.frombuffer(b''.join(stored_packed), dtype=PACKED_DTYPE).reshape(-1, N_VALUES)
+
+    def validate_json():
+        return [coordinates_array(json.loads(text)) for text in stored_json]
+
+    print(f"{'read path':<24} {'rows/s':>12}")
+    for name, fn in (("json + dict walk", from_json), ("json + coordinates_array", validate_json),
+                     ("packed view", from_packed), ("packed chunk matrix", as_matrix)):
+        _, elapsed = timed(fn)
+        print(f"{name:<24} {args.rows / elapsed:>12.0f}")
+
+    error = np.abs(np.asarray(from_json()) - as_matrix()).max()
+    print(f"max float32 rounding error: {error:.2g}")
+    print(f"stored bytes per row: json {np.mean([len(t) for t in stored_json]):.0f}, packed {len(stored_packed[0])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Wall time of transcoding the five pictures of a new horse (profile plus four limbs),
+one after another in the request thread versus together in the shared encode pool.
+
+Five different photo-like JPEGs (default 4032x3024, a phone photo) are each turned into
+what gets stored: the profile's WEBP and its variants (lib.media.encoding.encode_upload).
+Storage writes and the database are left out; they are the same in every case.
+
+serial:     the five encodes one after another in this thread (before)
+threads:    five threads of this process; Pillow holds the GIL for part of the work
+processes:  lib.workers.ProcessPool with --processes workers (after); 'cold' includes
+            starting the fork server and workers, as on the first upload after a deploy
+
+The speed-up is bounded by the CPU cores available to this process (printed first).
+
+Usage:
+    python benchmarks/horse_upload_benchmark.py [--width 4032 --height 3024] [--processes 4] [--rounds 3]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+logging.disable(logging.ERROR)
+
+from lib.media.encoding import encode_upload  # noqa: E402
+from lib.media.profiles import DEFAULT_ENCODING_PROFILES  # noqa: E402
+from lib.workers import ProcessPool  # noqa: E402
+
+PICTURES = ('profile', 'limb', 'limb', 'limb', 'limb')
+MAX_PIXELS = 10 ** 9
+
+
+def make_photos(folder, width, height):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    paths = []
+    for i in range(len(PICTURES)):
+        pixels = np.stack([x / width * 160 + 40, y / height * 120 + 60, (x + y) / (width + height) * 90 + 80], axis=-1)
+        for _ in range(12):
+            cx, cy, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(height / 20, height / 4)
+            pixels[(x - cx) ** 2 + (y - cy) ** 2 < r * r] = rng.uniform(20, 230, size=3)
+        pixels += rng.normal(0, 8, size=pixels.shape)
+        path = os.path.join(folder, f"picture_{i}.jpg")
+        Image.fromarray(pixels.clip(0, 255).astype(np.uint8), 'RGB').save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def jobs(paths):
+    return [(path, DEFAULT_ENCODING_PROFILES[kind], MAX_PIXELS) for path, kind in zip(paths, PICTURES)]
+
+
+def run_serial(paths):
+    return [encode_upload(*job) for job in jobs(paths)]
+
+
+def run_threads(paths):
+    with ThreadPoolExecutor(max_workers=len(PICTURES)) as executor:
+        return [f.result() for f in [executor.submit(encode_upload, *job) for job in jobs(paths)]]
+
+
+def run_pool(pool, paths):
+    return [f.result() for f in [pool.submit(encode_upload, *job) for job in jobs(paths)]]
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    results = fn(*args)
+    return time.perf_counter() - started, sum(len(r.data) for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3, help="Runs per case; the fastest is reported")
+    args = parser.parse_args()
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    pool = ProcessPool('benchmark-encode', 'BENCHMARK', processes=args.processes, preload=['lib.media.encoding'])
+    with tempfile.TemporaryDirectory() as folder:
+        paths = make_photos(folder, args.width, args.height)
+        print(f"{len(paths)} pictures of {args.width}x{args.height}; {cores} CPU cores available")
+        print(f"{'case':<24} {'wall time':>10} {'stored':>9}")
+
+        cold, size = timed(run_pool, pool, paths)
+        cases = [("serial (before)", run_serial, ()), (f"threads x{len(PICTURES)}", run_threads, ()),
+                 (f"processes x{args.processes} (after)", run_pool, (pool,))]
+        for name, fn, extra in cases:
+            best = min(timed(fn, *extra, paths)[0] for _ in range(args.rounds))
+            print(f"{name:<24} {best:>9.2f}s {size / 1024:>6.0f} KB")
+        print(f"{'processes, cold start':<24} {cold:>9.2f}s")
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Peak memory per picture upload, before and after draft/reduce decoding.
+
+Each case runs in a fresh process and reports the growth of its peak RSS over the
+process's own baseline (interpreter + Pillow loaded), so cases do not inherit each
+other's heap. The sample is a generated photo-like JPEG (default 8000x6000, 48 MP).
+
+before:  Image.open() + full decode, WEBP original, 512/128 variants from the full bitmap
+after:   lib.media.images.load_image() at --max-dimension, then the same variants
+variant: backfilling one 128 px variant from a stored original, full decode vs draft
+pdf:     CBC image -> PDF, full decode vs load_image() at CBC_IMAGE_MAX_DIMENSION
+
+Usage:
+    python benchmarks/image_decode_benchmark.py [--width 8000 --height 6000] [--max-dimension 2048]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+logging.disable(logging.ERROR)
+
+from lib.media.images import load_image  # noqa: E402
+from lib.media.profiles import EncodingProfile  # noqa: E402
+from lib.media.storage import LocalFileStorage, media_storage  # noqa: E402
+from lib.media.variants import save_variants  # noqa: E402
+
+
+# The encoding the pictures had when this benchmark was written; only decoding is compared here
+PROFILE = EncodingProfile('benchmark', None, 85, 4, True, False)
+
+
+def peak_rss_mb():
+    # VmHWM is per address space, so it starts over in each spawned process (ru_maxrss
+    # can carry over the parent's peak through fork/exec)
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KiB on Linux
+
+
+def case_before(path, out_dir, max_dimension):
+    with Image.open(path) as img:
+        img.load()
+        img.save(os.path.join(out_dir, 'before.webp'), "WEBP", quality=85)
+        save_variants(img, '', 'before.webp', PROFILE)
+
+
+def case_after(path, out_dir, max_dimension):
+    with load_image(path, max_size=max_dimension, max_pixels=10 ** 9) as img:
+        img.save(os.path.join(out_dir, 'after.webp'), "WEBP", quality=85)
+        save_variants(img, '', 'after.webp', PROFILE)
+
+
+def case_variant_before(path, out_dir, max_dimension):
+    with Image.open(path) as img:
+        img.load()
+        save_variants(img, '', 'variant_before.webp', PROFILE, sizes=(128,))
+
+
+def case_variant_after(path, out_dir, max_dimension):
+    with load_image(path, max_size=128, max_pixels=10 ** 9) as img:
+        save_variants(img, '', 'variant_after.webp', PROFILE, sizes=(128,))
+
+
+def case_pdf_before(path, out_dir, max_dimension):
+    with Image.open(path) as img:
+        img.save(os.path.join(out_dir, 'before.pdf'), "PDF", resolution=100.0, save_all=True)
+
+
+def case_pdf_after(path, out_dir, max_dimension):
+    with load_image(path, max_size=3508, max_pixels=10 ** 9) as img:
+        img.save(os.path.join(out_dir, 'after.pdf'), "PDF", resolution=100.0, save_all=True)
+
+
+CASES = (
+    ("upload: before", case_before), ("upload: after", case_after),
+    ("variant 128: before", case_variant_before), ("variant 128: after", case_variant_after),
+    ("cbc pdf: before", case_pdf_before), ("cbc pdf: after", case_pdf_after),
+)
+
+
+def run_case(fn, path, out_dir, max_dimension, queue):
+    media_storage.backend = LocalFileStorage(out_dir)
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    fn(path, out_dir, max_dimension)
+    queue.put((peak_rss_mb() - baseline, time.perf_counter() - started))
+
+
+def make_sample(path, width, height):
+    rng = np.random.default_rng(0)
+    # Smooth gradients plus noise: compresses like a photo rather than like a flat colour
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([(x * 255 // width), (y * 255 // height), ((x + y) * 255 // (width + height))], axis=-1)
+    noise = rng.integers(0, 24, size=(height, width, 3))
+    Image.fromarray((base + noise).clip(0, 255).astype(np.uint8), 'RGB').save(path, "JPEG", quality=90)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=8000)
+    parser.add_argument('--height', type=int, default=6000)
+    parser.add_argument('--max-dimension', type=int, default=2048)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, 'sample.jpg')
+        make_sample(path, args.width, args.height)
+        print(f"sample: {args.width}x{args.height} JPEG, {os.path.getsize(path) / 1e6:.1f} MB; "
+              f"full RGB bitmap {args.width * args.height * 3 / 1e6:.0f} MB")
+        print(f"{'case':<22} {'peak RSS growth':>16} {'time':>9}")
+        for name, fn in CASES:
+            queue = context.Queue()
+            process = context.Process(target=run_case, args=(fn, path, out_dir, args.max_dimension, queue))
+            process.start()
+            growth, elapsed = queue.get()
+            process.join()
+            print(f"{name:<22} {growth:>13.0f} MB {elapsed:>8.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Encode time, output size and quality (PSNR, SSIM) of WEBP encoding settings, to pick
+the encoding profiles in lib/media/profiles.py with data.
+
+Each picture of the corpus is decoded once per max dimension, as an upload is
+(lib.media.images.load_image, then upright from its EXIF orientation); that bitmap is
+the reference the encoded WEBP is compared against, so the numbers measure the
+encoding alone, not the downscale. Without --corpus, a few generated photo-like
+pictures are used; point it at a folder of real horse/limb/measure photos instead.
+
+Rows:
+  before <kind>   the settings used before profiles existed (q100 / q85, default method, 2048 px)
+  profile <kind>  the current profile of each kind (MEDIA_ENCODING_PROFILES is not read)
+  q<Q> m<M>       every --qualities x --methods combination at --max-dimension
+  lossless m<M>   with --lossless
+
+SSIM is computed on luma with a 7x7 uniform window; PSNR on RGB.
+
+Usage:
+    python benchmarks/image_encode_benchmark.py [--corpus photos/] [--max-dimension 2048]
+        [--qualities 70,80,85,90,100] [--methods 4,6] [--lossless] [--repeat 3]
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+logging.disable(logging.ERROR)
+
+from lib.media.images import load_image  # noqa: E402
+from lib.media.profiles import DEFAULT_ENCODING_PROFILES, EncodingProfile, encode_webp, prepare_image  # noqa: E402
+
+CORPUS_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.bmp')
+
+
+def candidate_settings(args):
+    # Pillow encodes with method=4 when none is given
+    settings = [
+        ("before profile/limb", EncodingProfile('before', 2048, 100, 4, True, False)),
+        ("before measure", EncodingProfile('before', 2048, 85, 4, True, False)),
+    ]
+    settings += [(f"profile {name}", profile) for name, profile in DEFAULT_ENCODING_PROFILES.items()]
+    for method in args.methods:
+        settings += [(f"q{quality} m{method}", EncodingProfile('grid', args.max_dimension, quality, method, True, False))
+                     for quality in args.qualities]
+        if args.lossless:
+            settings.append((f"lossless m{method}", EncodingProfile('grid', args.max_dimension, 75, method, True, True)))
+    return settings
+
+
+def luma(pixels):
+    return pixels[..., 0] * 0.299 + pixels[..., 1] * 0.587 + pixels[..., 2] * 0.114
+
+
+def window_mean(a, size):
+    # Means over every size x size window, from an integral image
+    integral = np.pad(a, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    sums = integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+    return sums / (size * size)
+
+
+def ssim(reference, encoded, window=7):
+    x, y = luma(reference), luma(encoded)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mean_x, mean_y = window_mean(x, window), window_mean(y, window)
+    var_x = window_mean(x * x, window) - mean_x ** 2
+    var_y = window_mean(y * y, window) - mean_y ** 2
+    cov = window_mean(x * y, window) - mean_x * mean_y
+    ssim_map = ((2 * mean_x * mean_y + c1) * (2 * cov + c2)) / ((mean_x ** 2 + mean_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+def psnr(reference, encoded):
+    mse = float(np.mean((reference - encoded) ** 2))
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def reference_image(path, max_dimension):
+    img = prepare_image(load_image(path, max_size=max_dimension, max_pixels=10 ** 9))
+    if img.mode not in ('RGB', 'RGBA'):
+        converted = img.convert('RGB')
+        img.close()
+        img = converted
+    return img
+
+
+def measure(img, profile, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = encode_webp(img, profile)
+        times.append(time.perf_counter() - started)
+    with Image.open(io.BytesIO(data)) as decoded:
+        encoded = np.asarray(decoded.convert('RGB'), dtype=np.float64)
+    reference = np.asarray(img.convert('RGB'), dtype=np.float64)
+    return min(times), len(data), psnr(reference, encoded), ssim(reference, encoded)
+
+
+def make_corpus(folder, count, width, height):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        # Smooth lighting, a few large shapes with edges and some texture: closer to a photo than noise alone
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        pixels = np.stack([x / width * 160 + 40, y / height * 120 + 60, (x + y) / (width + height) * 90 + 80], axis=-1)
+        for _ in range(12):
+            cx, cy, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(height / 20, height / 4)
+            pixels[(x - cx) ** 2 + (y - cy) ** 2 < r * r] = rng.uniform(20, 230, size=3)
+        pixels += rng.normal(0, 6 + 4 * i, size=pixels.shape)
+        path = os.path.join(folder, f"sample_{i}.jpg")
+        Image.fromarray(pixels.clip(0, 255).astype(np.uint8), 'RGB').save(path, "JPEG", quality=92)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help="Folder of sample photos (default: generated pictures)")
+    parser.add_argument('--samples', type=int, default=3, help="Generated pictures without --corpus")
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    parser.add_argument('--max-dimension', type=int, default=2048)
+    parser.add_argument('--qualities', type=lambda s: [int(q) for q in s.split(',')], default=[70, 80, 85, 90, 100])
+    parser.add_argument('--methods', type=lambda s: [int(m) for m in s.split(',')], default=[4, 6])
+    parser.add_argument('--lossless', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3, help="Encodes per picture; the fastest is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        if args.corpus:
+            paths = sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus)
+                           if name.lower().endswith(CORPUS_EXTENSIONS))
+        else:
+            paths = make_corpus(folder, args.samples, args.width, args.height)
+        if not paths:
+            parser.error(f"No pictures in {args.corpus}")
+        print(f"corpus: {len(paths)} pictures ({'generated' if not args.corpus else args.corpus})")
+        print(f"{'settings':<22} {'encode':>9} {'size':>9} {'bits/px':>8} {'PSNR':>7} {'SSIM':>7}")
+
+        references = {}
+        for label, profile in candidate_settings(args):
+            results = []
+            for path in paths:
+                key = (path, profile.max_dimension)
+                if key not in references:
+                    references[key] = reference_image(path, profile.max_dimension)
+                img = references[key]
+                elapsed, size, psnr_db, ssim_index = measure(img, profile, args.repeat)
+                results.append((elapsed, size, size * 8 / (img.width * img.height), psnr_db, ssim_index))
+            elapsed, size, bpp, psnr_db, ssim_index = np.mean(results, axis=0)
+            print(f"{label:<22} {elapsed * 1000:>6.0f} ms {size / 1024:>6.0f} KB {bpp:>8.2f} {psnr_db:>7.2f} {ssim_index:>7.4f}")
+        for img in references.values():
+            img.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Compares the 'http' and 'local' prediction backends on the same model.
+
+A small scikit-learn model is trained on synthetic coordinates and saved with
+joblib. A stub prediction service (in this process, on a local port) loads that
+file and answers /predict and /predict_batch, so both backends score with the
+exact same model. The benchmark reports per-measure latency for one-at-a-time
+scoring, throughput for batched scoring, and the largest difference between the
+two backends' outputs (expected: 0.0).
+
+Usage:
+    python benchmarks/prediction_backend_benchmark.py [--rows 2000] [--model forest|ridge]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+logging.disable(logging.ERROR)
+
+from lib.prediction.client import prediction_client  # noqa: E402
+from lib.prediction.dispatcher import prediction_dispatcher  # noqa: E402
+from lib.prediction.engine import HttpPredictionBackend, LocalModelBackend  # noqa: E402
+
+
+def train_model(kind, path):
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.linear_model import Ridge
+
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 1000, size=(5000, 28))
+    y = np.column_stack([X[:, ::2].mean(axis=1) / 120.0, 250 + X[:, 1::2].mean(axis=1) / 2.0])
+    model = RandomForestRegressor(n_estimators=50, max_depth=10, n_jobs=1, random_state=0) if kind == 'forest' else Ridge()
+    model.fit(X, y)
+    joblib.dump(model, path)
+
+
+def make_service(model_path):
+    scorer = LocalModelBackend(model_path)
+
+    class StubService(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if self.path == '/predict_batch':
+                result = {"predictions": scorer.predict_many([item["values"] for item in body["batch"]])}
+            else:
+                result = scorer.predict(body["values"])
+            payload = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubService)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000, help="Measures scored in the batched runs.")
+    parser.add_argument('--single', type=int, default=200, help="Measures scored one at a time.")
+    parser.add_argument('--model', choices=('forest', 'ridge'), default='forest')
+    args = parser.parse_args()
+
+    rows = np.random.default_rng(1).uniform(0, 1000, size=(args.rows, 28)).tolist()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, 'model.joblib')
+        train_model(args.model, model_path)
+        server = make_service(model_path)
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        prediction_client.configure(pool_size=8, hedge_after_ms=0)
+        prediction_dispatcher.configure(predict_url=f"{base_url}/predict", batch_url=f"{base_url}/predict_batch",
+                                        max_batch_size=256, linger_ms=2)
+
+        backends = {"http": HttpPredictionBackend(), "local": LocalModelBackend(model_path)}
+        backends["local"].load()
+        results = {}
+        print(f"{'backend':<8} {'single ms/measure':>18} {'batched measures/s':>19}")
+        for name, backend in backends.items():
+            backend.predict(rows[0])  # warm up connections / model
+            _, single_elapsed = timed(lambda: [backend.predict(r) for r in rows[:args.single]])
+            results[name], batch_elapsed = timed(lambda: backend.predict_many(rows))
+            print(f"{name:<8} {single_elapsed / args.single * 1000:>18.3f} {args.rows / batch_elapsed:>19.0f}")
+
+        http = np.array([[r['bcs'], r['bw']] for r in results['http']])
+        local = np.array([[r['bcs'], r['bw']] for r in results['local']])
+        print(f"max |http - local| over {args.rows} measures: {np.abs(http - local).max():.3g}")
+
+        prediction_dispatcher.shutdown()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Throughput of the prediction path used by POST /measure, with and without
+micro-batching, at 1, 8 and 64 concurrent callers.
+
+A stub predictor is started on a local port. It sleeps for a fixed latency per
+HTTP call (not per item), which is how a model server behaves when scoring a
+small batch costs about the same as scoring one row. Each caller thread runs
+forward_coordinates(), the function POST /measure uses to score coordinates.
+
+Modes:
+  unbatched     one call per request (batch size 1, 64 calls in flight)
+  batched       micro-batching against a predictor with /predict_batch
+  default       the default settings (batch size 32, 4 batches in flight, client
+                pool 16) against a predictor that only serves /predict, like the
+                current prediction service: the dispatcher falls back to direct calls
+
+Usage:
+    python benchmarks/prediction_dispatcher_benchmark.py [--latency-ms 20] [--requests 256]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+logging.disable(logging.ERROR)
+
+from lib.prediction.cache import prediction_cache  # noqa: E402
+from lib.prediction.client import prediction_client  # noqa: E402
+from lib.prediction.dispatcher import prediction_dispatcher  # noqa: E402
+from lib.routes.measures_routes import forward_coordinates  # noqa: E402
+
+
+def _coordinates(n):
+    # Distinct per request so the prediction cache does not short-circuit the dispatcher.
+    return [{"x": 10.0 + i + n, "y": 20.0 + 2 * i} for i in range(14)]
+
+
+class StubServer(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def _score(values):
+    return {"bcs": round(sum(values[::2]) % 9, 3), "bw": round(300 + sum(values[1::2]), 3)}
+
+
+class StubPredictor(BaseHTTPRequestHandler):
+    latency = 0.02
+    batch_endpoint = True
+    calls = 0
+    calls_lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path == '/predict_batch' and not self.batch_endpoint:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        time.sleep(self.latency)
+        with StubPredictor.calls_lock:
+            StubPredictor.calls += 1
+        if self.path == '/predict_batch':
+            result = {"predictions": [_score(item["values"]) for item in body["batch"]]}
+        else:
+            result = _score(body["values"])
+        payload = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(concurrency, total_requests):
+    StubPredictor.calls = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda n: forward_coordinates(_coordinates(n)), range(total_requests)))
+    elapsed = time.perf_counter() - started
+    errors = sum(1 for r in results if r.get('error'))
+    return total_requests / elapsed, StubPredictor.calls, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=20, help="Stub predictor latency per HTTP call.")
+    parser.add_argument('--requests', type=int, default=256, help="Measures scored per run.")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--linger-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    StubPredictor.latency = args.latency_ms / 1000.0
+    server = StubServer(('127.0.0.1', 0), StubPredictor)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    # mode -> (dispatcher settings, client pool size, stub serves /predict_batch)
+    modes = {
+        "unbatched": (dict(max_batch_size=1, linger_ms=0, max_in_flight=64), 64, True),
+        "batched": (dict(max_batch_size=args.batch_size, linger_ms=args.linger_ms, max_in_flight=4), 64, True),
+        "default": (dict(max_batch_size=32, linger_ms=5, max_in_flight=4), 16, False),
+    }
+    print(f"{'mode':<10} {'callers':>7} {'req/s':>10} {'HTTP calls':>11} {'errors':>7}")
+    for concurrency in (1, 8, 64):
+        for mode, (settings, pool_size, batch_endpoint) in modes.items():
+            prediction_cache.clear()
+            StubPredictor.batch_endpoint = batch_endpoint
+            prediction_client.configure(pool_size=pool_size)
+            prediction_dispatcher.configure(predict_url=f"{base_url}/predict",
+                                            batch_url=f"{base_url}/predict_batch", **settings)
+            throughput, calls, errors = run(concurrency, args.requests)
+            print(f"{mode:<10} {concurrency:>7} {throughput:>10.1f} {calls:>11} {errors:>7}")
+
+    prediction_dispatcher.shutdown()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Checks lib.media.storage.S3Storage against a stand-in for the bucket, without a server.
+
+The backend gets a real boto3 S3 client whose calls are answered by botocore's Stubber:
+each expected call is queued with the exact parameters S3Storage must send and the
+response S3 would give. A call with other parameters, or one that was not expected,
+fails the check. The pre-signed POST is built locally by boto3, so its policy document is
+decoded and its conditions are checked directly.
+
+Covered: save (with the immutable Cache-Control for content-addressed names), exists and
+open (including the missing-object mapping to False / FileNotFoundError), list (the key
+prefix is stripped and only direct children are returned), delete, public and pre-signed
+GET URLs, and presigned_upload.
+
+Against a real MinIO instead of the stand-in:
+    python benchmarks/s3_storage_check.py --endpoint-url http://localhost:9000 --bucket test \
+        --access-key minioadmin --secret-key minioadmin
+
+Usage:
+    python benchmarks/s3_storage_check.py
+"""
+import argparse
+import base64
+import datetime
+import io
+import json
+import logging
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+logging.disable(logging.ERROR)
+
+from botocore.exceptions import ClientError  # noqa: E402
+from botocore.response import StreamingBody  # noqa: E402
+from botocore.stub import Stubber  # noqa: E402
+
+from lib.media.storage import IMMUTABLE_CACHE_CONTROL, S3Storage  # noqa: E402
+
+BLOB_NAME = 'ab' * 32 + '.webp'  # content-addressed (lib/media/blobs.py)
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    print(f"ok  {message}")
+
+
+def raises(error_type, fn, *args):
+    try:
+        fn(*args)
+    except error_type:
+        return True
+    return False
+
+
+def check_presigned_upload(storage, key):
+    form = storage.presigned_upload(key, 'image/jpeg', 5 * 1024 * 1024, 600)
+    policy = json.loads(base64.b64decode(form['fields']['policy']))
+    conditions = policy['conditions']
+    check(form['fields']['key'] == storage.object_key(key), "presigned_upload: the form targets the prefixed key")
+    check(form['fields']['Content-Type'] == 'image/jpeg', "presigned_upload: the form sets Content-Type")
+    check({'bucket': storage.bucket} in conditions and {'key': storage.object_key(key)} in conditions,
+          "presigned_upload: the policy pins the bucket and key")
+    check({'Content-Type': 'image/jpeg'} in conditions, "presigned_upload: the policy pins Content-Type")
+    check(['content-length-range', 1, 5 * 1024 * 1024] in conditions, "presigned_upload: the policy limits the size")
+    expires = datetime.datetime.strptime(policy['expiration'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
+    remaining = (expires - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    check(0 < remaining <= 600, "presigned_upload: the policy expires after expires_in")
+
+
+def check_urls(storage):
+    url = storage.url('measures/a.webp')
+    check(storage.bucket in url and storage.object_key('measures/a.webp') in url and 'Signature' in url,
+          "url: pre-signed GET URL without MEDIA_S3_PUBLIC_URL")
+    public = S3Storage(storage.bucket, prefix=storage.prefix, public_url='https://cdn.example.com/')
+    check(public.url('measures/a.webp') == f"https://cdn.example.com/{storage.object_key('measures/a.webp')}",
+          "url: MEDIA_S3_PUBLIC_URL + prefixed key")
+
+
+def run_stubbed():
+    storage = S3Storage('iequus-media', prefix='/tenant/', endpoint_url='http://s3.invalid', region='us-east-1',
+                        access_key='test', secret_key='test')
+    client = storage.client
+    stubber = Stubber(client)
+    bucket = storage.bucket
+
+    stubber.add_response('put_object', {}, {'Bucket': bucket, 'Key': f'tenant/horses/{BLOB_NAME}', 'Body': b'webp',
+                                            'ContentType': 'image/webp', 'CacheControl': IMMUTABLE_CACHE_CONTROL})
+    stubber.add_response('put_object', {}, {'Bucket': bucket, 'Key': 'tenant/appointments/cbc/r.pdf', 'Body': b'%PDF',
+                                            'ContentType': 'application/pdf'})
+    stubber.add_response('head_object', {'ContentLength': 4}, {'Bucket': bucket, 'Key': f'tenant/horses/{BLOB_NAME}'})
+    stubber.add_client_error('head_object', service_error_code='404', http_status_code=404,
+                             expected_params={'Bucket': bucket, 'Key': 'tenant/horses/missing.webp'})
+    stubber.add_client_error('head_object', service_error_code='AccessDenied', http_status_code=403,
+                             expected_params={'Bucket': bucket, 'Key': 'tenant/horses/private.webp'})
+    # download_fileobj (open) asks for the size first, then gets the object
+    stubber.add_response('head_object', {'ContentLength': 4, 'ETag': '"e"'}, {'Bucket': bucket, 'Key': f'tenant/horses/{BLOB_NAME}'})
+    stubber.add_response('get_object', {'Body': StreamingBody(io.BytesIO(b'webp'), 4), 'ContentLength': 4},
+                         {'Bucket': bucket, 'Key': f'tenant/horses/{BLOB_NAME}'})
+    stubber.add_client_error('head_object', service_error_code='404', http_status_code=404,
+                             expected_params={'Bucket': bucket, 'Key': 'tenant/horses/missing.webp'})
+    modified = datetime.datetime(2026, 1, 2, tzinfo=datetime.timezone.utc)
+    stubber.add_response('list_objects_v2', {
+        'Contents': [{'Key': 'tenant/horses/a.webp', 'Size': 10, 'LastModified': modified},
+                     {'Key': 'tenant/horses/b.webp', 'Size': 20, 'LastModified': modified}],
+        'CommonPrefixes': [{'Prefix': 'tenant/horses/old/'}],
+        'IsTruncated': True, 'NextContinuationToken': 'page2',
+    }, {'Bucket': bucket, 'Prefix': 'tenant/horses/', 'Delimiter': '/'})
+    stubber.add_response('list_objects_v2', {
+        'Contents': [{'Key': 'tenant/horses/c.webp', 'Size': 30, 'LastModified': modified}], 'IsTruncated': False,
+    }, {'Bucket': bucket, 'Prefix': 'tenant/horses/', 'Delimiter': '/', 'ContinuationToken': 'page2'})
+    stubber.add_response('delete_object', {}, {'Bucket': bucket, 'Key': f'tenant/horses/{BLOB_NAME}'})
+
+    with stubber:
+        storage.save(f'horses/{BLOB_NAME}', b'webp', 'image/webp')
+        storage.save('appointments/cbc/r.pdf', b'%PDF', 'application/pdf')
+        print("ok  save: prefixed key, Content-Type, immutable Cache-Control only for content-addressed names")
+        check(storage.exists(f'horses/{BLOB_NAME}') is True, "exists: True for a stored object")
+        check(storage.exists('horses/missing.webp') is False, "exists: a 404 is False")
+        check(raises(ClientError, storage.exists, 'horses/private.webp'), "exists: other errors are raised")
+        with storage.open(f'horses/{BLOB_NAME}') as f:
+            check(f.read() == b'webp', "open: the object's bytes, from the start")
+        check(raises(FileNotFoundError, storage.open, 'horses/missing.webp'), "open: a missing object raises FileNotFoundError")
+        listed = list(storage.list('horses'))
+        check([item.key for item in listed] == ['horses/a.webp', 'horses/b.webp', 'horses/c.webp'],
+              "list: every page, prefix stripped, sub-prefixes left out")
+        check(listed[0].size == 10 and listed[0].modified == modified.timestamp(), "list: size and modification time")
+        check(storage.delete(f'horses/{BLOB_NAME}') is True, "delete: removes the prefixed key")
+        stubber.assert_no_pending_responses()
+
+    check_urls(storage)
+    check_presigned_upload(storage, 'uploads/direct/x.jpg')
+
+
+def run_live(args):
+    """The same round trip against a real S3-compatible server (e.g. MinIO)."""
+    storage = S3Storage(args.bucket, prefix=f"s3-check-{uuid.uuid4().hex[:8]}", endpoint_url=args.endpoint_url,
+                        region=args.region, access_key=args.access_key, secret_key=args.secret_key)
+    storage.save(f'horses/{BLOB_NAME}', b'webp', 'image/webp')
+    storage.save('horses/sub/nested.webp', b'x', 'image/webp')
+    try:
+        check(storage.exists(f'horses/{BLOB_NAME}') and not storage.exists('horses/missing.webp'), "exists")
+        with storage.open(f'horses/{BLOB_NAME}') as f:
+            check(f.read() == b'webp', "open")
+        check(raises(FileNotFoundError, storage.open, 'horses/missing.webp'), "open: a missing object raises FileNotFoundError")
+        check([item.key for item in storage.list('horses')] == [f'horses/{BLOB_NAME}'], "list")
+    finally:
+        storage.delete(f'horses/{BLOB_NAME}')
+        storage.delete('horses/sub/nested.webp')
+    check(not storage.exists(f'horses/{BLOB_NAME}'), "delete")
+    check_presigned_upload(storage, 'uploads/direct/x.jpg')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url', help="A real S3-compatible server instead of the stand-in.")
+    parser.add_argument('--bucket', default='iequus-media')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--access-key')
+    parser.add_argument('--secret-key')
+    args = parser.parse_args()
+    if args.endpoint_url:
+        run_live(args)
+    else:
+        run_stubbed()
+    print("S3Storage checks passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Throughput, latency and accuracy of the X-ray landmark detector (lib/xray/detector.py).
+
+The radiographs are generated from the reference X-ray (lib/static/xray/XRay_Random.png):
+each is the reference rotated, scaled, shifted and sometimes mirrored by a known random
+transform, with noise and a brightness change, saved as a JPEG. The same transform
+applied to the reference landmarks gives the true positions, so the landmark error is
+measured in pixels of the generated image.
+
+Rows:
+  batch <n>      run_detection_batch on n radiographs in this process: time per image
+  dispatcher     --clients threads each calling DetectionDispatcher.detect() in a loop
+                 (the path a request takes): requests/s, p50/p95 latency, mean batch size
+  accuracy       median and 90th percentile landmark error, and the mean confidence
+
+Usage:
+    python benchmarks/xray_detector_benchmark.py [--samples 32] [--clients 8] [--processes 1]
+        [--batch-sizes 1,4,8,16] [--max-dimension 512] [--backend reference]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+logging.disable(logging.ERROR)
+
+from lib.xray.detector import run_detection_batch  # noqa: E402
+from lib.xray.dispatcher import DetectionDispatcher  # noqa: E402
+from lib.xray.references import ReferenceAsset, landmarks_response  # noqa: E402
+
+XRAY_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib', 'static', 'xray'))
+REFERENCE_NAME = 'XRay_Random.png'
+MAX_PIXELS = 10 ** 9
+
+
+def load_reference():
+    path = os.path.join(XRAY_FOLDER, REFERENCE_NAME)
+    with open(os.path.splitext(path)[0] + '.landmarks.json', encoding='utf-8') as f:
+        landmarks = json.load(f)
+    with Image.open(path) as img:
+        width, height = img.size
+    signature = (os.stat(path).st_mtime_ns, os.stat(path).st_size)
+    asset = ReferenceAsset(REFERENCE_NAME, f'xray/{REFERENCE_NAME}', path, width, height, None,
+                           landmarks_response(landmarks), (signature, None))
+    return asset, landmarks
+
+
+def make_radiographs(folder, reference_path, landmarks, count):
+    """JPEGs of the reference under random similarity transforms, with the true landmark positions."""
+    rng = np.random.default_rng(0)
+    with Image.open(reference_path) as img:
+        source = img.convert('L')
+    points = np.array([[point['x'], point['y']] for point in landmarks], dtype=np.float64)
+    samples = []
+    for i in range(count):
+        angle = np.radians(rng.uniform(-20, 20))
+        scale = rng.uniform(0.6, 1.6)
+        mirror = -1.0 if rng.random() < 0.25 else 1.0
+        width, height = int(source.width * rng.uniform(1.1, 1.5) * scale), int(source.height * rng.uniform(1.1, 1.5) * scale)
+        # Forward map (source -> sample): centre, mirror, rotate, scale, move to a random spot
+        linear = scale * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]) @ np.diag([mirror, 1.0])
+        centre = np.array([source.width, source.height]) / 2
+        target = np.array([width, height]) / 2 + rng.uniform(-0.1, 0.1, size=2) * [width, height]
+        offset = target - linear @ centre
+        inverse = np.linalg.inv(linear)
+        inverse_offset = -inverse @ offset
+        sample = source.transform((width, height), Image.AFFINE,
+                                  (*inverse[0], inverse_offset[0], *inverse[1], inverse_offset[1]), Image.BILINEAR)
+        pixels = np.asarray(sample, dtype=np.float32) * rng.uniform(0.8, 1.1) + rng.normal(0, 6, size=(height, width))
+        path = os.path.join(folder, f"xray_{i}.jpg")
+        Image.fromarray(pixels.clip(0, 255).astype(np.uint8), 'L').save(path, "JPEG", quality=90)
+        samples.append((path, points @ linear.T + offset))
+    return samples
+
+
+def landmark_errors(result, truth, labels):
+    found = {point['label']: (point['x'], point['y']) for point in result['landmarks']}
+    return [float(np.hypot(*(np.array(found[label]) - point))) for label, point in zip(labels, truth) if label in found]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=32)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--batch-sizes', type=lambda s: [int(n) for n in s.split(',')], default=[1, 4, 8, 16])
+    parser.add_argument('--max-dimension', type=int, default=512)
+    parser.add_argument('--backend', default='reference')
+    args = parser.parse_args()
+
+    asset, landmarks = load_reference()
+    labels = [point['label'] for point in landmarks]
+    reference = (asset.path, asset.signature, landmarks)
+    with tempfile.TemporaryDirectory() as folder:
+        samples = make_radiographs(folder, asset.path, landmarks, args.samples)
+        paths = [path for path, _ in samples]
+        print(f"{len(samples)} radiographs from {REFERENCE_NAME} ({asset.width}x{asset.height}), "
+              f"backend '{args.backend}', detection at {args.max_dimension}px")
+
+        run_detection_batch(args.backend, paths[:1], reference, args.max_dimension, MAX_PIXELS)  # warm up
+        print(f"{'case':<14} {'per image':>10}")
+        results = None
+        for size in args.batch_sizes:
+            started = time.perf_counter()
+            outcomes = []
+            for start in range(0, len(paths), size):
+                outcomes += run_detection_batch(args.backend, paths[start:start + size], reference, args.max_dimension, MAX_PIXELS)
+            elapsed = time.perf_counter() - started
+            results = results or outcomes
+            print(f"{f'batch {size}':<14} {elapsed / len(paths) * 1000:>7.1f} ms")
+
+        dispatcher = DetectionDispatcher()
+        dispatcher.backend, dispatcher.max_dimension = args.backend, args.max_dimension
+        dispatcher.max_pending = max(dispatcher.max_pending, args.clients)
+        dispatcher.pool.processes = args.processes
+        dispatcher.detect(paths[0], asset)  # starts the worker processes
+        latencies = []
+        lock = threading.Lock()
+
+        def client(offset):
+            for path in paths[offset::args.clients]:
+                started = time.perf_counter()
+                dispatcher.detect(path, asset)
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+        before = dispatcher.stats()
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stats = dispatcher.stats()
+        dispatcher.shutdown()
+        batches = stats['batches'] - before['batches']
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"dispatcher: {args.clients} clients, {args.processes} processes: {len(latencies) / elapsed:.1f} req/s, "
+              f"p50 {p50:.0f} ms, p95 {p95:.0f} ms, {len(latencies) / max(1, batches):.1f} per batch")
+
+        errors, confidences = [], []
+        for (status, result), (_, truth) in zip(results, samples):
+            if status == 'ok':
+                errors += landmark_errors(result, truth, labels)
+                confidences.append(result['confidence'])
+        median, p90 = np.percentile(errors, [50, 90])
+        print(f"accuracy: median error {median:.1f} px, p90 {p90:.1f} px, mean confidence {np.mean(confidences):.2f}")
+
+
+if __name__ == '__main__':
+    main()
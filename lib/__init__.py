@@ -1,4 +1,5 @@
 from datetime import timedelta
+import json
 import os
 from flask import Flask
 from dotenv import load_dotenv
@@ -6,7 +7,21 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
+from lib.commands import gc_media_command, rescore_measures_command
+from lib.media.serving import media_server
+from lib.media.storage import media_storage
+from lib.media.streaming import UploadRequest
+from lib.media.uploads import encode_pool, transcode_pool
 from lib.models import db
+from lib.prediction.cache import prediction_cache
+from lib.prediction.client import prediction_client
+from lib.prediction.dispatcher import prediction_dispatcher
+from lib.prediction.engine import prediction_engine
+from lib.trends import trend_cache
+from lib.xray.cache import xray_cache
+from lib.xray.dispatcher import xray_detector
+from lib.xray.references import xray_references
+from lib.workers import measure_scoring_pool
 from lib.routes.clients_routes import clients_bp
 from lib.routes.horses_routes import horses_bp
 from lib.routes.veterinarians_routes import veterinarians_bp
@@ -15,6 +30,8 @@ from lib.routes.measures_routes import measures_bp
 from lib.routes.xray_routes import xray_bp
 from lib.routes.login_routes import login_bp
 from lib.routes.hospitals_routes import hospitals_bp
+from lib.routes.metrics_routes import metrics_bp
+from lib.routes.media_routes import media_bp
 
 load_dotenv()
 
@@ -22,6 +39,7 @@ bcrypt = Bcrypt()
 
 def create_app():
     app = Flask(__name__)
+    app.request_class = UploadRequest
 
     # Initialize Bcrypt with the app
     bcrypt.init_app(app)
@@ -41,9 +59,129 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
     app.config['JWT_ALGORITHM'] = 'HS256'
 
+    # Configuração do serviço de previsão (BW/BCS)
+    # 'http' usa o serviço externo; 'local' carrega o modelo serializado em PREDICTION_MODEL_PATH em cada worker
+    app.config['PREDICTION_BACKEND'] = os.getenv("PREDICTION_BACKEND", "http")
+    app.config['PREDICTION_MODEL_PATH'] = os.getenv("PREDICTION_MODEL_PATH")
+    app.config['PREDICTION_MODEL_OUTPUTS'] = os.getenv("PREDICTION_MODEL_OUTPUTS", "bcs,bw")
+    #PREDICTION_API_URL = "http://iequus_predict:9091/predict" #Docker container
+    app.config['PREDICTION_API_URL'] = os.getenv("PREDICTION_API_URL", "http://localhost:9091/predict")
+    app.config['PREDICTION_BATCH_API_URL'] = os.getenv("PREDICTION_BATCH_API_URL", "http://localhost:9091/predict_batch") # vazio = sem batching (um pedido por previsão)
+    #PREDICTION_HEALTH_URL = "http://iequus_predict:9091/health" #Docker container
+    app.config['PREDICTION_HEALTH_URL'] = os.getenv("PREDICTION_HEALTH_URL", "http://localhost:9091/health")
+    app.config['PREDICTION_CONNECT_TIMEOUT'] = float(os.getenv("PREDICTION_CONNECT_TIMEOUT", 2))
+    app.config['PREDICTION_READ_TIMEOUT'] = float(os.getenv("PREDICTION_READ_TIMEOUT", 10))
+    app.config['PREDICTION_POOL_SIZE'] = int(os.getenv("PREDICTION_POOL_SIZE", 16))
+    app.config['PREDICTION_BREAKER_FAILURES'] = int(os.getenv("PREDICTION_BREAKER_FAILURES", 5))
+    app.config['PREDICTION_BREAKER_RESET_SECONDS'] = float(os.getenv("PREDICTION_BREAKER_RESET_SECONDS", 30))
+    app.config['PREDICTION_HEDGE_AFTER_MS'] = float(os.getenv("PREDICTION_HEDGE_AFTER_MS", 0)) # 0 = sem hedging
+    app.config['PREDICTION_BATCH_MAX_SIZE'] = int(os.getenv("PREDICTION_BATCH_MAX_SIZE", 32))
+    app.config['PREDICTION_BATCH_LINGER_MS'] = float(os.getenv("PREDICTION_BATCH_LINGER_MS", 5))
+    app.config['PREDICTION_BATCH_MAX_IN_FLIGHT'] = int(os.getenv("PREDICTION_BATCH_MAX_IN_FLIGHT", 4))
+    app.config['PREDICTION_MODEL_VERSION'] = os.getenv("PREDICTION_MODEL_VERSION", "1")
+    app.config['PREDICTION_CACHE_ENABLED'] = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+    app.config['PREDICTION_CACHE_MAX_ENTRIES'] = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", 4096))
+    app.config['PREDICTION_CACHE_TTL_SECONDS'] = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", 3600))
+    # POST /measure?async=true (ou MEASURE_ASYNC_SCORING=true) responde 202 e calcula a previsão em background
+    app.config['MEASURE_ASYNC_SCORING'] = os.getenv("MEASURE_ASYNC_SCORING", "false").lower() == "true"
+    app.config['PREDICTION_ASYNC_WORKERS'] = int(os.getenv("PREDICTION_ASYNC_WORKERS", 4))
+    app.config['PREDICTION_ASYNC_MAX_PENDING'] = int(os.getenv("PREDICTION_ASYNC_MAX_PENDING", 256))
+    # POST /measures/bulk (NDJSON): máximo de registos por pedido e tamanho dos lotes de INSERT
+    app.config['MEASURES_BULK_MAX_RECORDS'] = int(os.getenv("MEASURES_BULK_MAX_RECORDS", 5000))
+    app.config['MEASURES_BULK_INSERT_BATCH'] = int(os.getenv("MEASURES_BULK_INSERT_BATCH", 500))
+    # GET /horse/<id>/trends: pontos por série (LTTB), janela da média móvel e cache por cavalo
+    app.config['TRENDS_DEFAULT_MAX_POINTS'] = int(os.getenv("TRENDS_DEFAULT_MAX_POINTS", 200))
+    app.config['TRENDS_ROLLING_WINDOW'] = int(os.getenv("TRENDS_ROLLING_WINDOW", 5))
+    app.config['TRENDS_CACHE_MAX_HORSES'] = int(os.getenv("TRENDS_CACHE_MAX_HORSES", 1024))
+    app.config['TRENDS_CACHE_TTL_SECONDS'] = float(os.getenv("TRENDS_CACHE_TTL_SECONDS", 300))
+    app.config['TRENDS_CACHE_MAX_PARAMS_PER_HORSE'] = int(os.getenv("TRENDS_CACHE_MAX_PARAMS_PER_HORSE", 4)) # combinações (window, maxPoints) por cavalo
+    # Paginação por cursor nas listagens (?limit=&cursor=); sem 'limit' a resposta é a lista completa
+    app.config['PAGINATION_DEFAULT_LIMIT'] = int(os.getenv("PAGINATION_DEFAULT_LIMIT", 50))
+    app.config['PAGINATION_MAX_LIMIT'] = int(os.getenv("PAGINATION_MAX_LIMIT", 500))
+    # Imagens enviadas: gravadas em MEDIA_SPOOL_FOLDER e convertidas para WEBP em background (estado em /media/uploads/<id>)
+    app.config['MEDIA_SPOOL_FOLDER'] = os.getenv("MEDIA_SPOOL_FOLDER") # None = pasta temporária do sistema
+    app.config['MEDIA_ASYNC_TRANSCODE'] = os.getenv("MEDIA_ASYNC_TRANSCODE", "true").lower() == "true"
+    app.config['MEDIA_TRANSCODE_WORKERS'] = int(os.getenv("MEDIA_TRANSCODE_WORKERS", 2))
+    app.config['MEDIA_TRANSCODE_MAX_PENDING'] = int(os.getenv("MEDIA_TRANSCODE_MAX_PENDING", 64))
+    # Processos partilhados que descodificam/codificam as imagens (várias imagens do mesmo pedido em paralelo)
+    app.config['MEDIA_ENCODE_PROCESSES'] = int(os.getenv("MEDIA_ENCODE_PROCESSES", min(4, os.cpu_count() or 1))) # 0 = na própria thread
+    # Descodificação de imagens: limite de píxeis (verificado no cabeçalho)
+    app.config['MEDIA_MAX_IMAGE_PIXELS'] = int(os.getenv("MEDIA_MAX_IMAGE_PIXELS", 50_000_000))
+    # Perfis de codificação WEBP por tipo de imagem (profile, limb, measure): só os campos a alterar, em JSON
+    # ex.: {"limb": {"quality": 90, "method": 6}, "profile": {"max_dimension": 800}} (ver lib/media/profiles.py)
+    app.config['MEDIA_ENCODING_PROFILES'] = json.loads(os.getenv("MEDIA_ENCODING_PROFILES") or "{}")
+    app.config['CBC_IMAGE_MAX_DIMENSION'] = int(os.getenv("CBC_IMAGE_MAX_DIMENSION", 3508)) # A4 a 300 dpi
+    # Limites de tamanho dos pedidos (bytes), por rota; MAX_CONTENT_LENGTH vale para as restantes
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_CONTENT_LENGTH", 16 * 1024 * 1024))
+    app.config['MAX_FORM_MEMORY_SIZE'] = int(os.getenv("MAX_FORM_MEMORY_SIZE", 1024 * 1024)) # campos de texto do formulário
+    app.config['XRAY_UPLOAD_MAX_BYTES'] = int(os.getenv("XRAY_UPLOAD_MAX_BYTES", 50 * 1024 * 1024))
+    app.config['CBC_UPLOAD_MAX_BYTES'] = int(os.getenv("CBC_UPLOAD_MAX_BYTES", 25 * 1024 * 1024))
+    app.config['HORSE_UPLOAD_MAX_BYTES'] = int(os.getenv("HORSE_UPLOAD_MAX_BYTES", 100 * 1024 * 1024)) # até 5 fotografias
+    app.config['MEASURE_UPLOAD_MAX_BYTES'] = int(os.getenv("MEASURE_UPLOAD_MAX_BYTES", 25 * 1024 * 1024))
+    app.config['MEASURES_BULK_MAX_BYTES'] = int(os.getenv("MEASURES_BULK_MAX_BYTES", 32 * 1024 * 1024))
+    # Ficheiros enviados acima deste tamanho são escritos em disco (UPLOAD_TEMP_FOLDER) durante o parsing
+    app.config['UPLOAD_SPOOL_THRESHOLD'] = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", 512 * 1024))
+    app.config['UPLOAD_TEMP_FOLDER'] = os.getenv("UPLOAD_TEMP_FOLDER") # None = pasta temporária do sistema
+    # Ficheiros em /static (imagens, raios-X, PDFs): ETag forte, 304/206 e Cache-Control por tipo
+    # (imagens com nome = hash do conteúdo são sempre 'immutable')
+    app.config['MEDIA_CACHE_CONTROL_IMAGE'] = os.getenv("MEDIA_CACHE_CONTROL_IMAGE", "public, max-age=3600")
+    app.config['MEDIA_CACHE_CONTROL_PDF'] = os.getenv("MEDIA_CACHE_CONTROL_PDF", "private, no-cache") # revalidado com o ETag
+    app.config['MEDIA_CACHE_CONTROL_DEFAULT'] = os.getenv("MEDIA_CACHE_CONTROL_DEFAULT", "no-cache")
+    app.config['MEDIA_ETAG_CACHE_MAX_ENTRIES'] = int(os.getenv("MEDIA_ETAG_CACHE_MAX_ENTRIES", 4096))
+    # 'x-accel-redirect' (nginx) ou 'x-sendfile' (Apache/lighttpd): o proxy envia o ficheiro em vez do worker
+    # Para nginx: location MEDIA_ACCEL_REDIRECT_PREFIX { internal; alias <pasta lib/static>/; }
+    app.config['MEDIA_SEND_FILE_OFFLOAD'] = os.getenv("MEDIA_SEND_FILE_OFFLOAD") # None = enviado pelo Flask
+    app.config['MEDIA_ACCEL_REDIRECT_PREFIX'] = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "/_static/")
+    # Raios-X de referência (lib/static/xray): carregados no arranque com dimensões, ETag e marcos anatómicos
+    # ('<nome>.landmarks.json'); a pasta é verificada de N em N segundos para recarregar ficheiros alterados
+    app.config['XRAY_REFERENCE_IMAGE'] = os.getenv("XRAY_REFERENCE_IMAGE", "XRay_Random.png")
+    app.config['XRAY_REFERENCE_RELOAD_SECONDS'] = float(os.getenv("XRAY_REFERENCE_RELOAD_SECONDS", 30)) # 0 = só no arranque
+    # Deteção de marcos anatómicos no raio-X enviado: 'reference' (numpy, determinístico), 'modulo:fabrica' ou 'none'
+    # Corre em processos próprios; os pedidos esperam numa fila limitada e são agrupados em lotes
+    app.config['XRAY_DETECTOR_BACKEND'] = os.getenv("XRAY_DETECTOR_BACKEND", "reference")
+    app.config['XRAY_DETECTOR_VERSION'] = os.getenv("XRAY_DETECTOR_VERSION", "1") # mudar ao trocar o modelo: invalida a cache
+    app.config['XRAY_DETECT_MAX_DIMENSION'] = int(os.getenv("XRAY_DETECT_MAX_DIMENSION", 512)) # lado maior analisado, em píxeis
+    app.config['XRAY_DETECT_PROCESSES'] = int(os.getenv("XRAY_DETECT_PROCESSES", 1)) # 0 = na thread do dispatcher
+    app.config['XRAY_DETECT_MAX_PENDING'] = int(os.getenv("XRAY_DETECT_MAX_PENDING", 32)) # acima disto: 503
+    app.config['XRAY_DETECT_BATCH_MAX_SIZE'] = int(os.getenv("XRAY_DETECT_BATCH_MAX_SIZE", 8))
+    app.config['XRAY_DETECT_BATCH_LINGER_MS'] = float(os.getenv("XRAY_DETECT_BATCH_LINGER_MS", 10))
+    app.config['XRAY_DETECT_TIMEOUT_SECONDS'] = float(os.getenv("XRAY_DETECT_TIMEOUT_SECONDS", 30))
+    # Cache dos resultados por hash SHA-256 do raio-X enviado (+ versão do detetor e ETag da referência):
+    # memória (LRU) e, com XRAY_CACHE_FOLDER, um ficheiro JSON por resultado, partilhado entre workers
+    app.config['XRAY_CACHE_ENABLED'] = os.getenv("XRAY_CACHE_ENABLED", "true").lower() == "true"
+    app.config['XRAY_CACHE_MAX_ENTRIES'] = int(os.getenv("XRAY_CACHE_MAX_ENTRIES", 1024))
+    app.config['XRAY_CACHE_FOLDER'] = os.getenv("XRAY_CACHE_FOLDER") # None = só em memória
+    app.config['XRAY_CACHE_DISK_MAX_ENTRIES'] = int(os.getenv("XRAY_CACHE_DISK_MAX_ENTRIES", 50000))
+    # Onde ficam as imagens e PDFs: 'local' (lib/static, um só servidor) ou 's3' (S3/MinIO, requer boto3)
+    app.config['MEDIA_STORAGE_BACKEND'] = os.getenv("MEDIA_STORAGE_BACKEND", "local")
+    app.config['MEDIA_S3_BUCKET'] = os.getenv("MEDIA_S3_BUCKET")
+    app.config['MEDIA_S3_PREFIX'] = os.getenv("MEDIA_S3_PREFIX", "")
+    app.config['MEDIA_S3_ENDPOINT_URL'] = os.getenv("MEDIA_S3_ENDPOINT_URL") # ex.: http://localhost:9000 (MinIO); None = AWS
+    app.config['MEDIA_S3_REGION'] = os.getenv("MEDIA_S3_REGION")
+    app.config['MEDIA_S3_ACCESS_KEY'] = os.getenv("MEDIA_S3_ACCESS_KEY")
+    app.config['MEDIA_S3_SECRET_KEY'] = os.getenv("MEDIA_S3_SECRET_KEY")
+    app.config['MEDIA_S3_PUBLIC_URL'] = os.getenv("MEDIA_S3_PUBLIC_URL") # bucket público/CDN; None = URLs pré-assinados
+    app.config['MEDIA_S3_URL_EXPIRES_SECONDS'] = int(os.getenv("MEDIA_S3_URL_EXPIRES_SECONDS", 3600))
+    # Uploads diretos para o bucket (POST /media/uploads): tamanho máximo e validade do formulário pré-assinado
+    app.config['MEDIA_DIRECT_UPLOAD_MAX_BYTES'] = int(os.getenv("MEDIA_DIRECT_UPLOAD_MAX_BYTES", 25 * 1024 * 1024))
+    app.config['MEDIA_DIRECT_UPLOAD_EXPIRES_SECONDS'] = int(os.getenv("MEDIA_DIRECT_UPLOAD_EXPIRES_SECONDS", 900))
+
     # Inicializar banco de dados
     db.init_app(app)
     migrate = Migrate(app, db)
+    prediction_client.init_app(app)
+    prediction_dispatcher.init_app(app)
+    prediction_engine.init_app(app)
+    prediction_cache.init_app(app)
+    measure_scoring_pool.init_app(app)
+    trend_cache.init_app(app)
+    media_storage.init_app(app)
+    transcode_pool.init_app(app)
+    encode_pool.init_app(app)
+    media_server.init_app(app)
+    xray_references.init_app(app)
+    xray_detector.init_app(app)
+    xray_cache.init_app(app)
     
     # Registrar blueprints
     app.register_blueprint(clients_bp)
@@ -54,6 +192,11 @@ def create_app():
     app.register_blueprint(xray_bp)
     app.register_blueprint(login_bp)
     app.register_blueprint(hospitals_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(media_bp)
+
+    app.cli.add_command(rescore_measures_command)
+    app.cli.add_command(gc_media_command)
 
     # Inicializar JWT
 
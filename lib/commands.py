@@ -0,0 +1,229 @@
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, or_, update
+
+from lib.coordinates import pack_coordinates, unpack_coordinates
+from lib.media.gc import (delete_blob_rows, expire_direct_uploads, find_orphans, media_areas, referenced_direct_uploads,
+                          referenced_filenames, remove_scratch, scratch_orphans, stale_pending_uploads, still_unreferenced)
+from lib.media.storage import media_storage, storage_key
+from lib.media.uploads import DIRECT_UPLOAD_PREFIX, process_media_upload
+from lib.models import Horse, MediaUpload, Measure, Veterinarian, db
+from lib.routes.measures_routes import _prediction_fields, forward_coordinates_many
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _stale_measures_query(model_version, pending_cutoff, hospital_id=None, veterinarian_id=None, horse_id=None):
+    """
+    Measures with coordinates whose prediction was not produced by `model_version`. Rows
+    still 'pending' are left to the background pool unless they were queued before
+    `pending_cutoff` (the job was lost, e.g. to a restart) or have no queue time.
+    """
+    query = db.session.query(Measure.id, Measure.coordinatesPacked)\
+                      .filter(Measure.coordinates.isnot(None))\
+                      .filter(or_(Measure.modelVersion.is_(None), Measure.modelVersion != model_version))\
+                      .filter(or_(Measure.predictionStatus.is_(None), Measure.predictionStatus != 'pending',
+                                  Measure.predictionQueuedAt.is_(None), Measure.predictionQueuedAt < pending_cutoff))
+    if horse_id is not None:
+        query = query.filter(Measure.horseId == horse_id)
+    if veterinarian_id is not None:
+        query = query.filter(Measure.horseId.in_(
+            db.session.query(Horse.id).filter(Horse.veterinarianId == veterinarian_id)))
+    if hospital_id is not None:
+        query = query.filter(Measure.horseId.in_(
+            db.session.query(Horse.id).join(Veterinarian, Horse.veterinarianId == Veterinarian.id)
+                                      .filter(Veterinarian.hospitalId == hospital_id)))
+    return query
+
+
+@click.command('rescore-measures')
+@click.option('--hospital-id', type=int, default=None, help="Only measures of horses from this hospital.")
+@click.option('--veterinarian-id', type=int, default=None, help="Only measures of this veterinarian's horses.")
+@click.option('--horse-id', type=int, default=None, help="Only measures of this horse.")
+@click.option('--chunk-size', type=int, default=500, show_default=True, help="Measures read, scored and written per round trip.")
+@click.option('--after-id', type=int, default=0, show_default=True, help="Resume after this measure id (printed as the checkpoint).")
+@click.option('--limit', type=int, default=None, help="Stop after this many measures.")
+@click.option('--pending-grace-minutes', type=float, default=30.0, show_default=True,
+              help="Also re-score measures left 'pending' by the background pool for longer than this.")
+@click.option('--dry-run', is_flag=True, help="Only count the stale measures.")
+@with_appcontext
+def rescore_measures_command(hospital_id, veterinarian_id, horse_id, chunk_size, after_id, limit, pending_grace_minutes,
+                             dry_run):
+    """
+    Re-scores measures whose prediction came from an older model (modelVersion differs
+    from PREDICTION_MODEL_VERSION, or was never recorded), and measures whose background
+    scoring job was lost (still 'pending' after --pending-grace-minutes).
+
+    Measures are read in id order, one chunk at a time (only id and packed coordinates), scored
+    with one batched backend call per chunk and written back with one bulk UPDATE and a
+    commit per chunk. Re-scored rows stop matching the stale filter, so an interrupted
+    run can simply be started again; --after-id skips straight to the last checkpoint.
+    A measure that fails to score keeps its previous values and is retried by the next run.
+
+        flask --app app rescore-measures --hospital-id 3
+    """
+    model_version = str(current_app.config.get('PREDICTION_MODEL_VERSION', '1'))
+    chunk_size = max(1, chunk_size)
+    pending_cutoff = datetime.utcnow() - timedelta(minutes=pending_grace_minutes)
+    query = _stale_measures_query(model_version, pending_cutoff, hospital_id, veterinarian_id, horse_id)
+
+    total = query.filter(Measure.id > after_id).count()
+    if limit is not None:
+        total = min(total, limit)
+    click.echo(f"{total} measures to re-score with model version {model_version}.")
+    if dry_run or total == 0:
+        return
+
+    last_id = after_id
+    rescored = failed = skipped = 0
+    started = time.monotonic()
+    with click.progressbar(length=total, label="Re-scoring measures") as progress:
+        while rescored + failed + skipped < total:
+            # Keyset chunks: each round trip is a short, indexed query, and nothing stays open across commits.
+            chunk = query.filter(Measure.id > last_id)\
+                         .order_by(Measure.id)\
+                         .limit(min(chunk_size, total - rescored - failed - skipped))\
+                         .all()
+            if not chunk:
+                break
+
+            # Packed rows are scored straight from the float32 view; only rows never packed parse their JSON
+            legacy_ids = [measure_id for measure_id, packed in chunk if packed is None]
+            legacy = dict(db.session.query(Measure.id, Measure.coordinates).filter(Measure.id.in_(legacy_ids)).all()) if legacy_ids else {}
+            scorable = []
+            for measure_id, packed in chunk:
+                coordinates = unpack_coordinates(packed) if packed is not None else legacy.get(measure_id)
+                if coordinates is None or len(coordinates) == 0:
+                    skipped += 1  # JSON null / empty list stored as coordinates
+                    continue
+                scorable.append((measure_id, coordinates))
+
+            results = forward_coordinates_many([coordinates for _, coordinates in scorable])
+            updates = []
+            for (measure_id, coordinates), result in zip(scorable, results):
+                if result.get('error'):
+                    failed += 1
+                    logger.warning(f"Re-scoring measure {measure_id} failed: {result['error']}")
+                    continue
+                fields = _prediction_fields(result)
+                if measure_id in legacy:
+                    fields['coordinatesPacked'] = pack_coordinates(coordinates)  # backfill
+                updates.append({'id': measure_id, **fields})
+
+            if updates:
+                db.session.execute(update(Measure), updates)
+            db.session.commit()
+            db.session.expunge_all()
+
+            rescored += len(updates)
+            last_id = chunk[-1][0]
+            progress.update(len(chunk))
+
+    elapsed = time.monotonic() - started
+    click.echo(f"Re-scored {rescored} measures, {failed} failed, {skipped} without coordinates, in {elapsed:.1f}s "
+               f"({(rescored + failed + skipped) / elapsed if elapsed else 0:.0f}/s). Checkpoint: --after-id {last_id}")
+
+
+@click.command('gc-media')
+@click.option('--grace-hours', type=float, default=24.0, show_default=True,
+              help="Keep unreferenced files modified more recently than this (uploads still being processed).")
+@click.option('--chunk-size', type=int, default=1000, show_default=True, help="Rows per streamed read and per re-check/delete batch.")
+@click.option('--dry-run', is_flag=True, help="Only report what would be removed.")
+@click.option('--verbose', is_flag=True, help="List every file removed (or that would be).")
+@with_appcontext
+def gc_media_command(grace_hours, chunk_size, dry_run, verbose):
+    """
+    Removes stored media no row references: pictures and variants left by failed commits,
+    replaced or shared blobs nobody uses any more, pictures of cascade-deleted measures,
+    CBC PDFs of deleted appointments, abandoned direct uploads, plus local scratch
+    (spool files, CBC conversion folders) left by crashes. Uploads still pending after the
+    grace period lost their transcoding job (e.g. to a restart); they are processed here,
+    or marked failed when their spooled file is gone.
+
+    Each media folder (or bucket prefix) is listed once and checked against the set of
+    referenced filenames, streamed from Horses, Measures and Appointments in one query
+    per folder, so the run time is linear in the number of files. Orphans are re-checked
+    against the database in batches right before they are deleted.
+
+        flask --app app gc-media --dry-run --verbose
+    """
+    grace_seconds = grace_hours * 3600
+    cutoff = time.time() - grace_seconds
+    chunk_size = max(1, chunk_size)
+    started = time.monotonic()
+    action = "would remove" if dry_run else "removed"
+
+    expired = expire_direct_uploads(grace_seconds, dry_run=dry_run)
+    if expired:
+        click.echo(f"{'Would cancel' if dry_run else 'Cancelled'} {expired} direct uploads that were never completed.")
+
+    stale = stale_pending_uploads(grace_seconds)
+    if stale and not dry_run:
+        for upload_id in stale:
+            process_media_upload(upload_id)
+        statuses = defaultdict(int)
+        for start in range(0, len(stale), chunk_size):
+            for status, count in db.session.query(MediaUpload.status, func.count())\
+                                           .filter(MediaUpload.id.in_(stale[start:start + chunk_size]))\
+                                           .group_by(MediaUpload.status):
+                statuses[status] += count
+        click.echo(f"Processed {len(stale)} uploads left pending: {statuses.get('ready', 0)} ready, "
+                   f"{statuses.get('failed', 0)} failed.")
+    elif stale:
+        click.echo(f"Would process {len(stale)} uploads left pending.")
+
+    areas = media_areas()
+    areas[DIRECT_UPLOAD_PREFIX] = ([], None)
+    total_files = total_bytes = failed = 0
+    for prefix, (columns, kind_name) in sorted(areas.items()):
+        if prefix == DIRECT_UPLOAD_PREFIX:
+            referenced = referenced_direct_uploads()
+        else:
+            referenced = referenced_filenames(columns, chunk_size)
+        counts = {"scanned": 0, "recent": 0}
+        orphans = find_orphans(prefix, referenced, cutoff, counts)
+        if columns and orphans:
+            orphans = {name: orphans[name] for name in still_unreferenced(columns, orphans, chunk_size)}
+
+        removed = []
+        for name, stored in orphans.items():
+            if verbose:
+                click.echo(f"  {stored.key} ({stored.size} bytes, modified {datetime.fromtimestamp(stored.modified):%Y-%m-%d %H:%M})")
+            if dry_run:
+                removed.append(name)
+                continue
+            try:
+                media_storage.delete(stored.key)
+                removed.append(name)
+            except Exception as e:
+                failed += 1
+                logger.error(f"Could not delete orphaned media {stored.key}: {e}")
+        if kind_name and removed and not dry_run:
+            delete_blob_rows(kind_name, removed, chunk_size)
+
+        removed_bytes = sum(orphans[name].size for name in removed)
+        total_files += len(removed)
+        total_bytes += removed_bytes
+        click.echo(f"{storage_key(prefix, '')}: {counts['scanned']} files, {len(referenced)} referenced, "
+                   f"{action} {len(removed)} ({removed_bytes / 1e6:.1f} MB), kept {counts['recent']} recent")
+
+    scratch = 0
+    for path, size in scratch_orphans(cutoff):
+        if verbose:
+            click.echo(f"  {path}")
+        if not dry_run:
+            remove_scratch(path)
+        scratch += 1
+        total_bytes += size
+    click.echo(f"scratch: {action} {scratch} spool files / CBC conversion folders")
+
+    elapsed = time.monotonic() - started
+    click.echo(f"{'Dry run: would remove' if dry_run else 'Removed'} {total_files + scratch} files "
+               f"({total_bytes / 1e6:.1f} MB) in {elapsed:.1f}s" + (f"; {failed} could not be deleted" if failed else "") + ".")
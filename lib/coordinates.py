@@ -0,0 +1,86 @@
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+N_POINTS = 14
+N_VALUES = N_POINTS * 2  # x1, y1, ..., x14, y14
+PACKED_DTYPE = np.dtype('<f4')  # little-endian float32, independent of the server's byte order
+PACKED_SIZE = N_VALUES * PACKED_DTYPE.itemsize  # 112 bytes
+
+_point_xy = itemgetter('x', 'y')
+
+
+def coordinates_array(coordinates):
+    """
+    Validates and flattens [{'x': x1, 'y': y1}, ..., {'x': x14, 'y': y14}] in one step
+    into a float64 array of 28 values, the values the client sent. Values outside the
+    float32 range stored in Measure.coordinatesPacked are rejected.
+    Raises ValueError with a client-facing message.
+    """
+    if not isinstance(coordinates, list):
+        raise ValueError("Coordinates must be a list of objects with 'x' and 'y'.")
+    try:
+        values = np.fromiter(chain.from_iterable(map(_point_xy, coordinates)), dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(_describe_bad_point(coordinates))
+
+    if values.size != N_VALUES:
+        raise ValueError(f"Expected {N_VALUES} coordinate values ({N_POINTS} pairs), "
+                         f"but received {values.size} from {len(coordinates)} points.")
+    invalid = ~(np.abs(values) <= np.finfo(PACKED_DTYPE).max)  # also true for inf and NaN
+    if invalid.any():
+        bad = int(np.flatnonzero(invalid)[0]) // 2
+        raise ValueError(f"Invalid coordinate value for point {bad}: {coordinates[bad]}.")
+    return values
+
+
+def _describe_bad_point(coordinates):
+    # Only reached on invalid input, so the per-point walk is fine here
+    for i, point in enumerate(coordinates):
+        if not isinstance(point, dict) or 'x' not in point or 'y' not in point:
+            return f"Malformed coordinate entry at index {i}: {point}. Expected dict with 'x' and 'y'."
+        try:
+            float(point['x'])
+            float(point['y'])
+        except (ValueError, TypeError) as e:
+            return f"Invalid coordinate value for point {i}: {point}. Error: {e}"
+    return "Invalid coordinates."
+
+
+def coordinates_values(values):
+    """
+    The 28 values of a coordinates_array() or unpack_coordinates() array as plain floats
+    for the predictor. float32 values are given as their shortest decimal form (512.3,
+    not 512.2999877929688), which is the value the client sent whenever it had at most
+    7 significant digits.
+    """
+    if values.dtype == PACKED_DTYPE:
+        return [float(str(value)) for value in values]
+    return values.tolist()
+
+
+def pack_coordinates(coordinates):
+    """Returns the 112-byte packed form of valid coordinates, or None (missing or invalid)."""
+    if not coordinates:
+        return None
+    try:
+        return coordinates_array(coordinates).astype(PACKED_DTYPE).tobytes()
+    except ValueError:
+        return None
+
+
+def unpack_coordinates(packed):
+    """Read-only float32 view over a packed value (no copy, no per-point objects), or None."""
+    if packed is None:
+        return None
+    if len(packed) != PACKED_SIZE:
+        raise ValueError(f"Packed coordinates must be {PACKED_SIZE} bytes, got {len(packed)}.")
+    return np.frombuffer(packed, dtype=PACKED_DTYPE)
+
+
+def coordinates_changed(old_packed, new_packed):
+    """Compares two packed coordinate values as arrays."""
+    if old_packed is None or new_packed is None:
+        return old_packed is not new_packed
+    return not np.array_equal(unpack_coordinates(old_packed), unpack_coordinates(new_packed))
@@ -0,0 +1,43 @@
+from flask import request
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import BadRequest
+
+
+class FieldSet:
+    """
+    Sparse fieldsets for a JSON representation of a model.
+
+    `fields` maps each response key to (columns it needs, render function). parse() reads
+    the comma-separated 'fields' query arg, load_options() turns the chosen keys into a
+    load_only() option so unrequested columns are never SELECTed, and serialize() builds
+    the response dict from those keys only. `always` keys (the id) are always included.
+    """
+
+    def __init__(self, fields, always=()):
+        self.fields = fields
+        self.always = tuple(always)
+
+    def parse(self, default=None):
+        """Returns the response keys to include: ?fields=..., else `default` (all keys when None)."""
+        value = request.args.get('fields')
+        if not value:
+            keys = list(default) if default is not None else list(self.fields)
+        else:
+            keys = [key.strip() for key in value.split(',') if key.strip()]
+            unknown = [key for key in keys if key not in self.fields]
+            if unknown:
+                raise BadRequest(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(self.fields)}.")
+        return [key for key in self.always if key not in keys] + keys
+
+    def load_options(self, keys, *extra_columns):
+        """load_only() for the columns behind `keys`, plus `extra_columns` (e.g. the ordering columns)."""
+        columns = {}  # column.key -> column; `in` on column attributes would build SQL expressions
+        for key in keys:
+            for column in self.fields[key][0]:
+                columns.setdefault(column.key, column)
+        for column in extra_columns:
+            columns.setdefault(column.key, column)
+        return [load_only(*columns.values())]
+
+    def serialize(self, obj, keys):
+        return {key: self.fields[key][1](obj) for key in keys}
@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import os
+
+from sqlalchemy.exc import IntegrityError
+
+from lib.media.storage import CONTENT_ADDRESSED_NAME, media_storage, storage_key
+from lib.media.variants import variant_filename
+from lib.models import MediaBlob, db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def is_content_addressed(filename):
+    """True for MediaBlob files, which may be shared between rows and are never overwritten."""
+    return bool(filename) and CONTENT_ADDRESSED_NAME.match(os.path.basename(filename)) is not None
+
+
+def find_blob(kind, source_hash, encoding):
+    """An existing blob encoded from the same upload with the same settings (whose file still exists), or None."""
+    if not source_hash:
+        return None
+    blob = MediaBlob.query.filter_by(kind=kind.name, sourceHash=source_hash, encoding=encoding).first()
+    if blob is not None and media_storage.exists(storage_key(kind.prefix, blob.filename)):
+        return blob
+    return None
+
+
+def store_encoded(kind, encoded, path, source_hash, encoding):
+    """
+    Stores an encoded upload (lib/media/encoding.py) under the hash of its bytes, with its
+    variants: the encoded WEBP, or the spooled file at `path` itself (streamed, its hash is
+    the source hash) when it was kept as it is. Identical output is stored once: an
+    existing file is left as is. If a write fails, the files already written are deleted
+    before the error is raised. Commits the MediaBlob row and returns it.
+    """
+    if encoded.data is None:
+        content_hash, byte_size = source_hash, os.path.getsize(path)
+    else:
+        content_hash, byte_size = hashlib.sha256(encoded.data).hexdigest(), len(encoded.data)
+    filename = f"{content_hash}.webp"
+
+    blob = MediaBlob.query.filter_by(kind=kind.name, contentHash=content_hash).first()
+    key = storage_key(kind.prefix, filename)
+    if blob is None or not media_storage.exists(key):
+        written = []
+        try:
+            for size, data in encoded.variants.items():
+                variant_key = storage_key(kind.prefix, variant_filename(filename, size))
+                media_storage.save(variant_key, data, 'image/webp')
+                written.append(variant_key)
+            # The original last: a blob file that exists always has its variants
+            if encoded.data is None:
+                media_storage.save_file(key, path, 'image/webp')
+            else:
+                media_storage.save(key, encoded.data, 'image/webp')
+        except Exception:
+            for written_key in written:
+                try:
+                    media_storage.delete(written_key)
+                except Exception as e:
+                    logger.error(f"Error deleting partial output {written_key}: {e}")
+            raise
+    return _add_blob(kind, blob, content_hash, source_hash, encoding, byte_size, encoded.size)
+
+
+def _add_blob(kind, blob, content_hash, source_hash, encoding, byte_size, size):
+    if blob is None:
+        blob = MediaBlob(kind=kind.name, contentHash=content_hash, sourceHash=source_hash, encoding=encoding,
+                         byteSize=byte_size, width=size[0], height=size[1])
+        db.session.add(blob)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Stored concurrently by another worker
+            db.session.rollback()
+            blob = MediaBlob.query.filter_by(kind=kind.name, contentHash=content_hash).one()
+    else:
+        logger.info(f"Upload matches stored {kind.name} blob {blob.filename}; reusing it.")
+    return blob
+
@@ -0,0 +1,34 @@
+import logging
+from collections import namedtuple
+
+from lib.media.images import load_image, open_image
+from lib.media.profiles import encode_webp, prepare_image, reencode_reason
+from lib.media.variants import VARIANT_SIZES, encode_variants
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# What encode_upload() made of one upload:
+# - data: the WEBP to store, or None when the upload itself is stored as it is
+# - size: (width, height) of the stored picture
+# - variants: {variant size: WEBP bytes}
+# - reason: why the upload was re-encoded (None when it was not)
+EncodedUpload = namedtuple('EncodedUpload', ['data', 'size', 'variants', 'reason'])
+
+
+def encode_upload(path, profile, max_pixels):
+    """
+    Decodes and encodes a spooled upload under `profile`: the picture to store and its
+    variants. All CPU work of a picture upload, and nothing else: it runs in the encode
+    pool's worker processes, without an app context, on picklable arguments and results.
+    """
+    with open_image(path, max_pixels=max_pixels) as header:
+        reason = reencode_reason(header, path, profile)
+        size = header.size
+    if reason is None:
+        # Stored as it is; only the variants are encoded, from a decode at the largest variant size
+        with load_image(path, max_size=max(VARIANT_SIZES), max_pixels=max_pixels) as img:
+            return EncodedUpload(None, size, encode_variants(img, profile), None)
+    with load_image(path, max_size=profile.max_dimension, max_pixels=max_pixels) as img:
+        prepare_image(img)
+        return EncodedUpload(encode_webp(img, profile), img.size, encode_variants(img, profile), reason)
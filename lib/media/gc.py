@@ -0,0 +1,160 @@
+import logging
+import os
+import re
+import shutil
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from lib.media.storage import CONTENT_ADDRESSED_NAME, media_storage
+from lib.media.uploads import MEDIA_FIELDS, MEDIA_KINDS, OWNER_MODELS, spool_folder
+from lib.media.variants import VARIANT_SIZES
+from lib.models import Appointment, MediaBlob, MediaUpload, db
+from lib.routes.appointments_routes import CBC_PREFIX, cbc_scratch_folder
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VARIANT_NAME = re.compile(r'^(?P<stem>.+)_w(?P<size>\d+)(?P<ext>\.[^.]+)$')
+UNFINISHED_UPLOADS = ('pending', 'uploading')
+
+
+def media_areas():
+    """
+    Storage key prefix -> (columns holding the filenames stored under it, media kind name or None).
+    Built from the registered picture columns, plus the CBC PDFs.
+    """
+    columns = defaultdict(list)
+    kinds = {}
+    for (owner_type, field), kind_name in MEDIA_FIELDS.items():
+        prefix = MEDIA_KINDS[kind_name].prefix
+        columns[prefix].append(getattr(OWNER_MODELS[owner_type], field))
+        kinds[prefix] = kind_name
+    columns[CBC_PREFIX].append(Appointment.CBCpath)
+    return {prefix: (prefix_columns, kinds.get(prefix)) for prefix, prefix_columns in columns.items()}
+
+
+def original_name(filename):
+    """'ab12_w128.webp' -> 'ab12.webp': a variant is kept as long as its original is referenced."""
+    match = VARIANT_NAME.match(filename)
+    if match and int(match.group('size')) in VARIANT_SIZES:
+        return match.group('stem') + match.group('ext')
+    return filename
+
+
+def referenced_filenames(columns, chunk_size=1000):
+    """Every non-null value of `columns` (of one table), read in one streamed query."""
+    names = set()
+    query = db.session.query(*columns).execution_options(yield_per=chunk_size)
+    for row in query:
+        names.update(value for value in row if value)
+    return names
+
+
+def still_unreferenced(columns, filenames, chunk_size=1000):
+    """
+    The subset of `filenames` that no row references now (directly or through their
+    original). Run on the orphans just before deleting them, so a picture that got
+    referenced after the full scan (e.g. an old blob reused by an identical upload) is kept.
+    """
+    originals = list({original_name(name) for name in filenames})
+    referenced = set()
+    for start in range(0, len(originals), chunk_size):
+        chunk = originals[start:start + chunk_size]
+        for column in columns:
+            referenced.update(value for (value,) in db.session.query(column).filter(column.in_(chunk)))
+    return {name for name in filenames if original_name(name) not in referenced}
+
+
+def find_orphans(prefix, referenced, cutoff, counts):
+    """
+    One pass over the files under `prefix`: returns {filename: StoredFile} of those
+    referenced by no row (neither themselves nor, for variants, their original) and last
+    modified before `cutoff`. Counts 'scanned' files and 'recent' unreferenced ones kept.
+    """
+    orphans = {}
+    for stored in media_storage.list(prefix):
+        counts["scanned"] += 1
+        name = stored.key.rsplit('/', 1)[-1]
+        if name in referenced or original_name(name) in referenced:
+            continue
+        if stored.modified > cutoff:
+            counts["recent"] += 1
+            continue
+        orphans[name] = stored
+    return orphans
+
+
+def expire_direct_uploads(grace_seconds, dry_run=False):
+    """Cancels direct uploads the client never completed; their objects become orphans. Returns the count."""
+    query = MediaUpload.query.filter(MediaUpload.status == 'uploading',
+                                     MediaUpload.createdAt < datetime.utcnow() - timedelta(seconds=grace_seconds))
+    if dry_run:
+        return query.count()
+    expired = query.update({'status': 'cancelled', 'error': 'Upload was never completed.',
+                            'finishedAt': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return expired
+
+
+def stale_pending_uploads(grace_seconds):
+    """
+    Ids of uploads still 'pending' after the grace period: their transcoding job was lost
+    (queued in a worker that restarted), and nothing else would ever process them.
+    """
+    return [upload_id for (upload_id,) in db.session.query(MediaUpload.id)
+                                                   .filter(MediaUpload.status == 'pending',
+                                                           MediaUpload.createdAt < datetime.utcnow() - timedelta(seconds=grace_seconds))
+                                                   .order_by(MediaUpload.id)]
+
+
+def referenced_direct_uploads():
+    """Filenames (under DIRECT_UPLOAD_PREFIX) of the objects of unfinished direct uploads."""
+    return {key.rsplit('/', 1)[-1] for (key,) in db.session.query(MediaUpload.sourceKey)
+                                                       .filter(MediaUpload.sourceKey.isnot(None),
+                                                               MediaUpload.status.in_(UNFINISHED_UPLOADS))}
+
+
+def delete_blob_rows(kind_name, filenames, chunk_size=1000):
+    """Drops the MediaBlob rows of deleted blob files, so they are not looked up again."""
+    hashes = [name[:-len('.webp')] for name in filenames
+              if CONTENT_ADDRESSED_NAME.match(name) and original_name(name) == name]
+    deleted = 0
+    for start in range(0, len(hashes), chunk_size):
+        deleted += MediaBlob.query.filter(MediaBlob.kind == kind_name,
+                                          MediaBlob.contentHash.in_(hashes[start:start + chunk_size]))\
+                                  .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def scratch_orphans(cutoff):
+    """
+    Local scratch left by crashed requests or workers: spool files of uploads that are no
+    longer pending, and CBC conversion folders (only inside the app's own cbc_scratch_folder()).
+    Yields (path, size) older than `cutoff`.
+    """
+    folder = spool_folder()
+    spooled = {path for (path,) in db.session.query(MediaUpload.spoolPath)
+                                            .filter(MediaUpload.spoolPath.isnot(None),
+                                                    MediaUpload.status == 'pending')}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and entry.path not in spooled:
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < cutoff:
+                    yield entry.path, stat.st_size
+
+    with os.scandir(cbc_scratch_folder()) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                yield entry.path, 0
+
+
+def remove_scratch(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,98 @@
+import logging
+import math
+import struct
+
+from flask import current_app
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PIXELS = 50_000_000  # a 48-megapixel phone photo still fits
+ACCEPTED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF', 'BMP', 'TIFF')
+
+
+class ImageTooLarge(ValueError):
+    """Raised before decoding an image whose pixel count is over MEDIA_MAX_IMAGE_PIXELS."""
+
+
+def max_image_pixels():
+    if current_app:
+        return int(current_app.config.get('MEDIA_MAX_IMAGE_PIXELS', DEFAULT_MAX_PIXELS))
+    return DEFAULT_MAX_PIXELS
+
+
+def check_pixel_limit(img, max_pixels=None):
+    """Rejects an opened (not yet decoded) image by the dimensions in its header."""
+    max_pixels = max_pixels or max_image_pixels()
+    if img.width * img.height > max_pixels:
+        raise ImageTooLarge(f"Image is {img.width}x{img.height} pixels; at most {max_pixels} pixels are accepted.")
+
+
+def open_image(source, formats=ACCEPTED_FORMATS, max_pixels=None):
+    """
+    Opens an image file or stream without decoding it and checks its pixel count.
+    Raises ImageTooLarge, or ValueError for anything that is not an accepted image
+    (FileNotFoundError passes through).
+    """
+    try:
+        img = Image.open(source, formats=formats)
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Invalid image: {e}")
+    try:
+        check_pixel_limit(img, max_pixels)
+    except ImageTooLarge:
+        img.close()
+        raise
+    return img
+
+
+def read_dimensions(source):
+    """(width, height) from the image header only."""
+    with open_image(source) as img:
+        return img.size
+
+
+def load_image(source, max_size=None, max_pixels=None):
+    """
+    Opens and decodes an image, at most `max_size` pixels on its longest side.
+    JPEGs are decoded directly at the nearest DCT scale (1/2, 1/4, 1/8) that is still
+    at least the target size (draft mode), so a 48 MP photo needed at 512 px never exists
+    as a full-size bitmap; other formats are decoded, then reduced by an integer factor
+    before the final resample. Multi-frame images are decoded as they are.
+    The caller closes the returned image.
+    """
+    img = open_image(source, max_pixels=max_pixels)
+    try:
+        if max_size and max(img.size) > max_size and getattr(img, 'n_frames', 1) == 1:
+            scale = max_size / max(img.size)
+            img.draft(None, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+            img.thumbnail((max_size, max_size), Image.LANCZOS, reducing_gap=3.0)
+        img.load()
+    except Exception:
+        img.close()
+        raise
+    return img
+
+
+def webp_bitstream(path):
+    """
+    'lossy' (VP8) or 'lossless' (VP8L) from the chunk headers of a WEBP file, or None when
+    there is no image chunk. Only the chunk headers are read.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WEBP':
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            fourcc, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if fourcc == b'VP8 ':
+                return 'lossy'
+            if fourcc == b'VP8L':
+                return 'lossless'
+            f.seek(size + (size & 1), 1)  # chunks are padded to an even size
@@ -0,0 +1,121 @@
+import io
+import logging
+import os
+from collections import namedtuple
+
+from flask import current_app
+from PIL import ImageOps
+
+from lib.media.images import webp_bitstream
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How the pictures of one kind are stored as WEBP:
+# - max_dimension: longest side, in pixels, of the stored original
+# - quality: lossy quality 0-100 (with lossless, the compression effort instead)
+# - method: encoder effort 0 (fast) - 6 (slowest, smallest files)
+# - strip_metadata: drop EXIF (GPS position, camera, ...) and XMP; the ICC colour profile is always kept
+# - lossless: store the original losslessly (variants are still lossy, at `quality`)
+# - max_bits_per_pixel: a WEBP upload that already fits the profile (size, lossy/lossless,
+#   metadata) and is at most this dense is stored byte-for-byte instead of re-encoded;
+#   None always re-encodes. The density stands in for the quality, which WEBP files do not record.
+EncodingProfile = namedtuple('EncodingProfile', ['name', 'max_dimension', 'quality', 'method', 'strip_metadata', 'lossless',
+                                                 'max_bits_per_pixel'], defaults=(None,))
+
+# Picked with benchmarks/image_encode_benchmark.py: on photos, q80-85 at method 4 keeps SSIM
+# at 0.97-0.98 in under half the bytes of q100, and encodes faster; method 6 saves another 2-3%
+# for about 2.5x the time. Limb pictures are looked at closely, so they keep the most detail;
+# profile pictures are only shown small. The pass-through densities are about what q90 gives
+# on the same photos, so a client WEBP a little better than the profile is still kept as is.
+DEFAULT_ENCODING_PROFILES = {
+    'profile': EncodingProfile('profile', 1024, 80, 4, True, False, 2.0),
+    'limb': EncodingProfile('limb', 2048, 85, 4, True, False, 2.5),
+    'measure': EncodingProfile('measure', 2048, 82, 4, True, False, 2.2),
+}
+FALLBACK_PROFILE = EncodingProfile('default', 2048, 85, 4, True, False)
+
+ORIENTATION_TAG = 0x0112
+
+
+def encoding_profile(kind_name):
+    """
+    The profile of a media kind: its default, with the fields set in
+    MEDIA_ENCODING_PROFILES[kind_name] (e.g. {"limb": {"quality": 90, "method": 6}}) replaced.
+    """
+    profile = DEFAULT_ENCODING_PROFILES.get(kind_name, FALLBACK_PROFILE._replace(name=kind_name))
+    overrides = (current_app.config.get('MEDIA_ENCODING_PROFILES') or {}).get(kind_name) if current_app else None
+    if overrides:
+        unknown = set(overrides) - set(EncodingProfile._fields) - {'name'}
+        if unknown:
+            raise ValueError(f"Unknown encoding profile fields for '{kind_name}': {', '.join(sorted(unknown))}.")
+        profile = profile._replace(**overrides)
+    return profile
+
+
+def encoding_name(profile):
+    """
+    Identifies the encoder settings, e.g. 'webp-q80-m4-1024px-strip-pt2.0', so a stored blob
+    is only reused for an upload when they match (MediaBlob.encoding).
+    """
+    mode = 'll' if profile.lossless else 'q'
+    return f"webp-{mode}{profile.quality}-m{profile.method}-{profile.max_dimension}px" \
+           f"{'-strip' if profile.strip_metadata else ''}" \
+           f"{f'-pt{profile.max_bits_per_pixel}' if profile.max_bits_per_pixel else ''}"
+
+
+def reencode_reason(img, path, profile):
+    """
+    Why an opened (not decoded) upload has to be re-encoded under `profile`, or None when
+    its file can be stored as it is: a still WEBP within the profile's max dimension, of
+    the profile's kind (lossy or lossless), upright, without metadata the profile strips,
+    and no denser than max_bits_per_pixel.
+    """
+    if not profile.max_bits_per_pixel:
+        return "pass-through disabled"
+    if img.format != 'WEBP':
+        return f"{img.format} upload"
+    if getattr(img, 'n_frames', 1) > 1:
+        return "animated"
+    if max(img.size) > profile.max_dimension:
+        return f"{img.width}x{img.height} is over {profile.max_dimension}px"
+    if (webp_bitstream(path) == 'lossless') != bool(profile.lossless):
+        return "lossy/lossless mismatch"
+    if profile.strip_metadata and (img.info.get('exif') or img.info.get('xmp')):
+        return "has metadata to strip"
+    if img.getexif().get(ORIENTATION_TAG, 1) != 1:
+        return "not upright"
+    bits_per_pixel = os.path.getsize(path) * 8 / (img.width * img.height)
+    if bits_per_pixel > profile.max_bits_per_pixel:
+        return f"{bits_per_pixel:.2f} bits/pixel is over {profile.max_bits_per_pixel}"
+    return None
+
+
+def prepare_image(img):
+    """
+    Rotates a decoded photo upright from its EXIF orientation (in place), so the stored
+    pixels no longer depend on a tag that stripping the metadata would lose.
+    """
+    ImageOps.exif_transpose(img, in_place=True)
+    return img
+
+
+def webp_options(img, profile, variant=False):
+    """Pillow save() arguments for one picture under `profile`; variants are always lossy."""
+    options = {"quality": profile.quality, "method": profile.method,
+               "lossless": profile.lossless and not variant}
+    if img.info.get('icc_profile'):
+        options["icc_profile"] = img.info['icc_profile']
+    if not profile.strip_metadata:
+        if img.info.get('exif'):
+            options["exif"] = img.info['exif']
+        if img.info.get('xmp'):
+            options["xmp"] = img.info['xmp']
+    return options
+
+
+def encode_webp(img, profile, variant=False):
+    """Encodes a decoded picture as WEBP bytes under `profile`."""
+    buffer = io.BytesIO()
+    img.save(buffer, "WEBP", **webp_options(img, profile, variant))
+    return buffer.getvalue()
@@ -0,0 +1,160 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+from flask import current_app, request, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+from lib.media.storage import CONTENT_ADDRESSED_NAME, IMMUTABLE_CACHE_CONTROL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# MEDIA_SEND_FILE_OFFLOAD -> header the front proxy reads to send the file itself
+OFFLOAD_HEADERS = {
+    'x-sendfile': 'X-Sendfile',              # Apache mod_xsendfile, lighttpd: absolute path
+    'x-accel-redirect': 'X-Accel-Redirect',  # nginx: URI of an internal location
+}
+
+
+class MediaServer:
+    """
+    Serves the files under the static folder (pictures, X-rays, CBC PDFs) in place of
+    Flask's static view, so url_for('static', ...) URLs keep working:
+
+    - strong ETags from the file contents: the hash in the name of content-addressed
+      files, otherwise a SHA-256 computed once per (path, mtime, size) and kept in an
+      LRU, so a replaced file gets a new ETag and an unchanged one is never re-read;
+    - If-None-Match / If-Modified-Since answered with 304, and byte ranges (206,
+      If-Range) for partial downloads of large PDFs;
+    - Cache-Control per media type (MEDIA_CACHE_CONTROL_*); content-addressed files
+      are immutable;
+    - optionally, the transfer itself is left to the front proxy (X-Sendfile or
+      X-Accel-Redirect): the worker only answers the conditional part and sends headers.
+    """
+
+    def __init__(self, app=None):
+        self.static_folder = None
+        self.offload = None
+        self.accel_redirect_prefix = '/_static/'
+        self.cache_control = {}
+        self.max_etags = 4096
+        self._lock = threading.Lock()
+        self._etags = OrderedDict()  # path -> (mtime_ns, size, etag)
+        self._counters = {"requests": 0, "not_modified": 0, "partial": 0, "offloaded": 0, "etags_computed": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        offload = (app.config.get('MEDIA_SEND_FILE_OFFLOAD') or '').lower() or None
+        if offload is not None and offload not in OFFLOAD_HEADERS:
+            raise ValueError(f"MEDIA_SEND_FILE_OFFLOAD must be one of {', '.join(OFFLOAD_HEADERS)} (got '{offload}').")
+        self.offload = offload
+        self.accel_redirect_prefix = app.config.get('MEDIA_ACCEL_REDIRECT_PREFIX', self.accel_redirect_prefix).rstrip('/') + '/'
+        self.cache_control = {
+            'image': app.config.get('MEDIA_CACHE_CONTROL_IMAGE'),
+            'pdf': app.config.get('MEDIA_CACHE_CONTROL_PDF'),
+            'default': app.config.get('MEDIA_CACHE_CONTROL_DEFAULT'),
+        }
+        self.max_etags = max(1, int(app.config.get('MEDIA_ETAG_CACHE_MAX_ENTRIES', self.max_etags)))
+        self.static_folder = app.static_folder
+        with self._lock:
+            self._etags.clear()
+        if app.static_folder is not None:
+            app.view_functions['static'] = self.send_static
+        app.extensions['media_server'] = self
+
+    def send_static(self, filename):
+        path = safe_join(self.static_folder, filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        stat = os.stat(path)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        etag = self.etag(path, stat)
+
+        if self.offload:
+            response = self._offload_response(path, filename, mimetype, stat, etag)
+        else:
+            response = send_file(path, mimetype=mimetype, etag=etag, last_modified=stat.st_mtime, conditional=True)
+
+        cache_control = self.cache_control_for(filename, mimetype)
+        if cache_control:
+            response.headers['Cache-Control'] = cache_control
+            response.headers.pop('Expires', None)
+
+        with self._lock:
+            self._counters["requests"] += 1
+            if response.status_code == 304:
+                self._counters["not_modified"] += 1
+            elif response.status_code == 206:
+                self._counters["partial"] += 1
+            elif self.offload and response.status_code == 200:
+                self._counters["offloaded"] += 1
+        return response
+
+    def _offload_response(self, path, filename, mimetype, stat, etag):
+        header = OFFLOAD_HEADERS[self.offload]
+        response = current_app.response_class(mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response.headers[header] = path if self.offload == 'x-sendfile' \
+            else self.accel_redirect_prefix + quote(filename.replace(os.sep, '/'))
+        # No accept_ranges: the proxy answers Range requests on the file it sends
+        response = response.make_conditional(request)
+        if response.status_code != 200:
+            response.headers.pop(header, None)
+        return response
+
+    def etag(self, path, stat):
+        name = os.path.basename(path)
+        if CONTENT_ADDRESSED_NAME.match(name):
+            return os.path.splitext(name)[0]
+
+        with self._lock:
+            entry = self._etags.get(path)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self._etags.move_to_end(path)
+                return entry[2]
+
+        with open(path, 'rb') as f:
+            etag = hashlib.file_digest(f, 'sha256').hexdigest()
+
+        with self._lock:
+            self._counters["etags_computed"] += 1
+            self._etags[path] = (stat.st_mtime_ns, stat.st_size, etag)
+            self._etags.move_to_end(path)
+            while len(self._etags) > self.max_etags:
+                self._etags.popitem(last=False)
+        return etag
+
+    def prime_etag(self, path, mtime_ns, size, etag):
+        """Records an ETag computed elsewhere (e.g. the X-ray reference registry) so it is not hashed again."""
+        with self._lock:
+            self._etags[path] = (mtime_ns, size, etag)
+            self._etags.move_to_end(path)
+            while len(self._etags) > self.max_etags:
+                self._etags.popitem(last=False)
+
+    def cache_control_for(self, filename, mimetype):
+        if CONTENT_ADDRESSED_NAME.match(os.path.basename(filename)):
+            return IMMUTABLE_CACHE_CONTROL
+        if mimetype.startswith('image/'):
+            return self.cache_control['image'] or self.cache_control['default']
+        if mimetype == 'application/pdf':
+            return self.cache_control['pdf'] or self.cache_control['default']
+        return self.cache_control['default']
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["etags_cached"] = len(self._etags)
+        stats["offload"] = self.offload
+        return stats
+
+
+media_server = MediaServer()
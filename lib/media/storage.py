@@ -0,0 +1,296 @@
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import namedtuple
+
+from flask import url_for
+from werkzeug.security import safe_join
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# '<sha256>.webp' and its variants '<sha256>_w128.webp', ... (MediaBlob files, see lib/media/blobs.py)
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}(_w\d+)?\.webp$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Objects read back from a remote store (to decode them) stay in memory up to this size
+DOWNLOAD_SPOOL_SIZE = 8 * 1024 * 1024
+
+# A stored file as listed by MediaStorage.list(): its key, size in bytes and modification time (epoch seconds)
+StoredFile = namedtuple('StoredFile', ['key', 'size', 'modified'])
+
+
+class DirectUploadsUnsupported(NotImplementedError):
+    """The configured storage backend cannot hand out pre-signed upload URLs."""
+
+
+def storage_key(prefix, filename):
+    """'measures', 'ab12.webp' -> 'measures/ab12.webp'. Keys are '/'-separated paths under the media root."""
+    return posixpath.join(prefix, filename)
+
+
+class LocalFileStorage:
+    """
+    Files under the static folder, served by the app (lib/media/serving.py) under
+    /static/<key>. Writes go to a temporary file next to the target and are renamed
+    into place, so a reader never sees half a file.
+    """
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ValueError(f"Invalid storage key '{key}'.")
+        return path
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def save(self, key, data, content_type=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def save_file(self, key, source_path, content_type=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open(self, key):
+        """Binary file object of a stored file (the caller closes it). Raises FileNotFoundError."""
+        return open(self.path(key), 'rb')
+
+    def delete(self, key):
+        """Returns False when there was nothing to delete."""
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self, prefix):
+        try:
+            with os.scandir(self.path(prefix)) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        yield StoredFile(storage_key(prefix, entry.name), stat.st_size, stat.st_mtime)
+        except FileNotFoundError:
+            return
+
+    def url(self, key):
+        return url_for('static', filename=key, _external=True)
+
+    def presigned_upload(self, key, content_type, max_bytes, expires_in):
+        raise DirectUploadsUnsupported("Direct uploads need the 's3' media storage backend.")
+
+
+class S3Storage:
+    """
+    Objects in an S3-compatible bucket (AWS S3, MinIO, ...), under an optional key prefix.
+    URLs point at the bucket: MEDIA_S3_PUBLIC_URL (a public bucket or CDN) when set,
+    otherwise pre-signed GET URLs. Clients can upload straight to the bucket with a
+    pre-signed POST (presigned_upload), so the bytes never go through the app.
+    boto3 is only needed, and only imported, when this backend is configured.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 public_url=None, url_expires_in=3600):
+        if not bucket:
+            raise RuntimeError("MEDIA_S3_BUCKET is not set; cannot use the s3 media storage backend.")
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.url_expires_in = url_expires_in
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3  # optional dependency, only for this backend
+                    self._client = boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region,
+                                                aws_access_key_id=self.access_key,
+                                                aws_secret_access_key=self.secret_key)
+                    logger.info(f"S3 media storage: bucket '{self.bucket}' at {self.endpoint_url or 'AWS'}")
+        return self._client
+
+    def object_key(self, key):
+        return posixpath.join(self.prefix, key) if self.prefix else key
+
+    def _put_args(self, key, content_type):
+        args = {}
+        if content_type:
+            args['ContentType'] = content_type
+        if CONTENT_ADDRESSED_NAME.match(posixpath.basename(key)):
+            args['CacheControl'] = IMMUTABLE_CACHE_CONTROL
+        return args
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if self._is_not_found(e):
+                return False
+            raise
+
+    @staticmethod
+    def _is_not_found(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def save(self, key, data, content_type=None):
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data,
+                               **self._put_args(key, content_type))
+
+    def save_file(self, key, source_path, content_type=None):
+        self.client.upload_file(source_path, self.bucket, self.object_key(key),
+                                ExtraArgs=self._put_args(key, content_type))
+
+    def open(self, key):
+        """Downloads an object into a seekable temporary file (the caller closes it). Raises FileNotFoundError."""
+        from botocore.exceptions import ClientError
+        spool = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+        try:
+            self.client.download_fileobj(self.bucket, self.object_key(key), spool)
+            spool.seek(0)
+        except ClientError as e:
+            spool.close()
+            if self._is_not_found(e):
+                raise FileNotFoundError(f"No object '{self.object_key(key)}' in bucket '{self.bucket}'.")
+            raise
+        except Exception:
+            spool.close()
+            raise
+        return spool
+
+    def delete(self, key):
+        # S3 deletes are idempotent: a missing object is not an error
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        return True
+
+    def list(self, prefix):
+        object_prefix = self.object_key(prefix).rstrip('/') + '/'
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix, Delimiter='/'):
+            for item in page.get('Contents', []):
+                yield StoredFile(item['Key'][strip:], item['Size'], item['LastModified'].timestamp())
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url}/{self.object_key(key)}"
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self.object_key(key)},
+                                                  ExpiresIn=self.url_expires_in)
+
+    def presigned_upload(self, key, content_type, max_bytes, expires_in):
+        """A pre-signed POST form for one object: {'url', 'fields'}; the client adds its file as the last field."""
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket, Key=self.object_key(key),
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_bytes]],
+            ExpiresIn=expires_in)
+
+
+class MediaStorage:
+    """
+    Front for the configured media storage (MEDIA_STORAGE_BACKEND = 'local' or 's3').
+    Stored media are addressed by key, e.g. 'measures/<file>' or 'appointments/cbc/<file>';
+    the database keeps only the filename.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend_name = str(app.config.get('MEDIA_STORAGE_BACKEND', 'local')).lower()
+        if backend_name == 'local':
+            self.backend = LocalFileStorage(app.static_folder)
+        elif backend_name == 's3':
+            self.backend = S3Storage(app.config.get('MEDIA_S3_BUCKET'),
+                                     prefix=app.config.get('MEDIA_S3_PREFIX') or '',
+                                     endpoint_url=app.config.get('MEDIA_S3_ENDPOINT_URL'),
+                                     region=app.config.get('MEDIA_S3_REGION'),
+                                     access_key=app.config.get('MEDIA_S3_ACCESS_KEY'),
+                                     secret_key=app.config.get('MEDIA_S3_SECRET_KEY'),
+                                     public_url=app.config.get('MEDIA_S3_PUBLIC_URL'),
+                                     url_expires_in=int(app.config.get('MEDIA_S3_URL_EXPIRES_SECONDS', 3600)))
+        else:
+            raise ValueError(f"Unknown MEDIA_STORAGE_BACKEND '{backend_name}'. Use 'local' or 's3'.")
+        app.extensions['media_storage'] = self
+        logger.info(f"Media storage backend: {self.backend.name}")
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    @property
+    def is_remote(self):
+        """True when each exists()/open() is a network round trip (any backend but 'local')."""
+        return self.backend.name != 'local'
+
+    def exists(self, key):
+        return self.backend.exists(key)
+
+    def save(self, key, data, content_type=None):
+        """Stores bytes under `key`, replacing any existing file."""
+        self.backend.save(key, data, content_type)
+
+    def save_file(self, key, source_path, content_type=None):
+        """Stores a local file under `key`; the local file is left in place."""
+        self.backend.save_file(key, source_path, content_type)
+
+    def open(self, key):
+        return self.backend.open(key)
+
+    def delete(self, key):
+        return self.backend.delete(key)
+
+    def list(self, prefix):
+        """Yields a StoredFile per file directly under `prefix` (not in sub-prefixes), in no particular order."""
+        return self.backend.list(prefix)
+
+    def url(self, key):
+        return self.backend.url(key)
+
+    def presigned_upload(self, key, content_type, max_bytes, expires_in):
+        """Raises DirectUploadsUnsupported unless the backend is 's3'."""
+        return self.backend.presigned_upload(key, content_type, max_bytes, expires_in)
+
+
+media_storage = MediaStorage()
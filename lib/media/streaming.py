@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import tempfile
+
+from flask import Request, current_app
+from PIL import Image
+
+from lib.media.images import ImageTooLarge, check_pixel_limit
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Leading bytes of the image formats accepted for upload -> Pillow format name
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+)
+SIGNATURE_SIZE = 16
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def upload_limit(config_key):
+    """
+    Declares the request size limit of a view, read from `config_key` (bytes) instead of
+    MAX_CONTENT_LENGTH. Put it under @jwt_required() so the limit is copied to its wrapper.
+    """
+    def decorator(view):
+        view.upload_limit_key = config_key
+        return view
+    return decorator
+
+
+class UploadRequest(Request):
+    """
+    Request class with per-view size limits (see upload_limit) and a configurable spool
+    threshold: multipart file parts above UPLOAD_SPOOL_THRESHOLD bytes are written to a
+    temporary file in UPLOAD_TEMP_FOLDER while the body is parsed, instead of being kept
+    in memory. Bodies over the limit are rejected with 413 before they are read, and
+    chunked bodies are cut off once they pass it. Each file part is hashed (SHA-256) as it
+    is written, so upload_sha256() costs nothing more once the form is parsed.
+    """
+
+    @property
+    def max_content_length(self):
+        if not current_app:
+            return None
+        key = None
+        if self.url_rule is not None:
+            key = getattr(current_app.view_functions.get(self.url_rule.endpoint), 'upload_limit_key', None)
+        if key and current_app.config.get(key):
+            return int(current_app.config[key])
+        return current_app.config.get('MAX_CONTENT_LENGTH')
+
+    @property
+    def max_form_memory_size(self):
+        # Non-file form fields are always held in memory
+        return current_app.config.get('MAX_FORM_MEMORY_SIZE') if current_app else None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        threshold = int(current_app.config.get('UPLOAD_SPOOL_THRESHOLD', 512 * 1024)) if current_app else 512 * 1024
+        folder = current_app.config.get('UPLOAD_TEMP_FOLDER') if current_app else None
+        return HashingSpooledFile(max_size=threshold, mode='rb+', dir=folder)
+
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """SpooledTemporaryFile that keeps the SHA-256 of everything written to it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def write(self, s):
+        self.sha256.update(s)
+        return super().write(s)
+
+
+def upload_sha256(stream):
+    """
+    SHA-256 hex of an uploaded file's bytes: the hash taken while the request body was
+    parsed (UploadRequest), or else one pass over the stream, which is then rewound.
+    """
+    hasher = getattr(stream, 'sha256', None)
+    if hasher is not None:
+        return hasher.hexdigest()
+    start = stream.tell()
+    hasher = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    stream.seek(start)
+    return hasher.hexdigest()
+
+
+def sniff_image_format(header):
+    """Pillow format name of an accepted image type from its leading bytes, or None."""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def open_upload_image(stream):
+    """
+    Opens an uploaded image in place: checks its signature, then hands the same stream to
+    Pillow restricted to that one format, so nothing is copied and no other image plugin
+    ever parses the upload. Only the header is read until the caller loads or verifies.
+    Raises ImageTooLarge (over the pixel limit), or ValueError for anything that is not
+    an accepted image.
+    """
+    start = stream.tell()
+    image_format = sniff_image_format(stream.read(SIGNATURE_SIZE))
+    stream.seek(start)
+    if image_format is None:
+        raise ValueError("Unsupported or invalid image file.")
+    try:
+        img = Image.open(stream, formats=[image_format])
+    except Exception as e:
+        raise ValueError(f"Invalid {image_format} image: {e}")
+    try:
+        check_pixel_limit(img)
+    except ImageTooLarge:
+        img.close()
+        raise
+    return img
+
+
+def verify_upload_image(stream):
+    """
+    One pass over an uploaded image: signature, header and Pillow's integrity check,
+    without decoding the pixels. Rewinds the stream and returns the Pillow format name.
+    Raises ValueError.
+    """
+    start = stream.tell()
+    try:
+        with open_upload_image(stream) as img:
+            image_format = img.format
+            img.verify()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Corrupted image file: {e}")
+    finally:
+        stream.seek(start)
+    return image_format
+
@@ -0,0 +1,324 @@
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+
+from lib.media.blobs import find_blob, is_content_addressed, store_encoded
+from lib.media.encoding import encode_upload
+from lib.media.images import max_image_pixels
+from lib.media.profiles import encoding_name, encoding_profile
+from lib.media.storage import media_storage, storage_key
+from lib.media.streaming import SIGNATURE_SIZE, sniff_image_format
+from lib.media.variants import delete_variants
+from lib.models import Horse, MediaUpload, Measure, db
+from lib.workers import AppContextPool, PoolFull, ProcessPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OWNER_MODELS = {'horse': Horse, 'measure': Measure}
+
+# A kind of stored picture: the storage key prefix of its WEBPs and how its URL is built.
+# How it is encoded is its encoding profile (lib/media/profiles.py), looked up by name.
+MediaKind = namedtuple('MediaKind', ['name', 'prefix', 'url'])
+MEDIA_KINDS = {}
+# (ownerType, column) -> kind name, for the picture columns clients may upload to directly
+MEDIA_FIELDS = {}
+
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+# Direct uploads land under this key prefix until they are transcoded
+DIRECT_UPLOAD_PREFIX = 'uploads'
+DIRECT_UPLOAD_TYPES = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp',
+                       'image/gif': '.gif', 'image/bmp': '.bmp', 'image/tiff': '.tiff'}
+
+transcode_pool = AppContextPool('media-transcode', 'MEDIA_TRANSCODE', workers=2, max_pending=64)
+# Decoding and encoding run here, off the GIL of the web and transcode threads
+encode_pool = ProcessPool('media-encode', 'MEDIA_ENCODE', preload=['lib.media.encoding'])
+
+
+def register_media_kind(name, prefix, url):
+    """Called by the route modules that own the pictures."""
+    MEDIA_KINDS[name] = MediaKind(name, prefix, url)
+
+
+def register_media_field(owner_type, field, kind):
+    """Declares a picture column of an owner model, stored as `kind`."""
+    MEDIA_FIELDS[(owner_type, field)] = kind
+
+
+def spool_folder():
+    folder = current_app.config.get('MEDIA_SPOOL_FOLDER') or os.path.join(tempfile.gettempdir(), 'iequus_uploads')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def spool_upload(image_file):
+    """
+    Streams an uploaded file to the spool folder in one pass: the first chunk's signature
+    is checked before anything is written, and the bytes are hashed on the way. Nothing
+    is decoded here, so an invalid upload is still rejected within the request at no cost.
+    Returns (spool path, sha256 hex) or raises ValueError.
+    """
+    if not image_file or not image_file.filename:
+        raise ValueError("Missing image file or filename.")
+    return _spool_stream(image_file.stream, image_file.filename)
+
+
+def _spool_stream(stream, name):
+    chunks = iter(lambda: stream.read(SPOOL_CHUNK_SIZE), b'')
+    first_chunk = next(chunks, b'')
+    image_format = sniff_image_format(first_chunk[:SIGNATURE_SIZE])
+    if image_format is None:
+        logger.warning(f"Rejected upload '{name}': not an accepted image type.")
+        raise ValueError("Could not process image. Invalid image format?")
+
+    spool_path = os.path.join(spool_folder(), f"{uuid.uuid4().hex}.upload")
+    hasher = hashlib.sha256(first_chunk)
+    try:
+        with open(spool_path, 'wb') as spool:
+            spool.write(first_chunk)
+            for chunk in chunks:
+                hasher.update(chunk)
+                spool.write(chunk)
+    except Exception:
+        _remove_file(spool_path)
+        raise
+    logger.info(f"Spooled {image_format} upload '{name}' to {spool_path}")
+    return spool_path, hasher.hexdigest()
+
+
+def queue_media_upload(image_file, owner_type, owner_id, field, kind):
+    """
+    Spools `image_file` and adds a pending MediaUpload for the `field` column of the owner
+    row to the session; the caller commits it with the rest of the request, then calls
+    start_media_uploads(). Earlier pending uploads of the same picture are cancelled.
+    Raises ValueError for an invalid image.
+    """
+    spool_path, source_hash = spool_upload(image_file)
+    cancel_media_uploads(owner_type, owner_id, field)
+    upload = MediaUpload(ownerType=owner_type, ownerId=owner_id, field=field, kind=kind,
+                         spoolPath=spool_path, sourceHash=source_hash, status='pending')
+    db.session.add(upload)
+    return upload
+
+
+def cancel_media_uploads(owner_type, owner_id, field=None, except_id=None):
+    """
+    Cancels unfinished uploads of an owner (one picture when `field` is given), e.g. when
+    the picture is removed. Direct uploads the client has not completed are cancelled too.
+    """
+    query = MediaUpload.query.filter(MediaUpload.ownerType == owner_type, MediaUpload.ownerId == owner_id,
+                                     MediaUpload.status.in_(('pending', 'uploading')))
+    if field is not None:
+        query = query.filter(MediaUpload.field == field)
+    if except_id is not None:
+        query = query.filter(MediaUpload.id != except_id)
+    return query.update({'status': 'cancelled', 'finishedAt': datetime.utcnow()}, synchronize_session=False)
+
+
+def create_direct_upload(owner_type, owner_id, field, content_type):
+    """
+    Adds an 'uploading' MediaUpload whose source the client sends straight to storage,
+    and returns (upload, pre-signed form). The caller commits it; once the client has
+    uploaded, complete_direct_upload() queues it like any other upload.
+    Raises ValueError, or DirectUploadsUnsupported when the storage backend is local.
+    """
+    kind = MEDIA_FIELDS.get((owner_type, field))
+    if kind is None:
+        raise ValueError(f"'{field}' is not a picture of a {owner_type}.")
+    extension = DIRECT_UPLOAD_TYPES.get(content_type)
+    if extension is None:
+        raise ValueError(f"'contentType' must be one of: {', '.join(DIRECT_UPLOAD_TYPES)}.")
+
+    source_key = storage_key(DIRECT_UPLOAD_PREFIX, f"{uuid.uuid4().hex}{extension}")
+    expires_in = int(current_app.config.get('MEDIA_DIRECT_UPLOAD_EXPIRES_SECONDS', 900))
+    form = media_storage.presigned_upload(source_key, content_type,
+                                          int(current_app.config.get('MEDIA_DIRECT_UPLOAD_MAX_BYTES', 25 * 1024 * 1024)),
+                                          expires_in)
+    upload = MediaUpload(ownerType=owner_type, ownerId=owner_id, field=field, kind=kind,
+                         sourceKey=source_key, status='uploading')
+    db.session.add(upload)
+    return upload, {"url": form["url"], "fields": form["fields"], "expiresIn": expires_in}
+
+
+def complete_direct_upload(upload):
+    """
+    Marks a direct upload as received: checks its object exists, cancels earlier uploads
+    of the same picture and makes it pending. The caller commits, then calls
+    start_media_uploads(). Raises ValueError.
+    """
+    if upload.status != 'uploading':
+        raise ValueError(f"Upload {upload.id} is '{upload.status}', not awaiting its file.")
+    if not media_storage.exists(upload.sourceKey):
+        raise ValueError(f"The file of upload {upload.id} has not been uploaded yet.")
+    cancel_media_uploads(upload.ownerType, upload.ownerId, upload.field, except_id=upload.id)
+    upload.status = 'pending'
+    return upload
+
+
+def discard_media_uploads(uploads):
+    """Removes the spool files of uploads that were never committed (the request failed)."""
+    for upload in uploads:
+        _remove_file(upload.spoolPath)
+
+
+def start_media_uploads(uploads):
+    """
+    Transcodes committed uploads in the background pool, or inline when MEDIA_ASYNC_TRANSCODE
+    is off or the pool is full. Inline uploads (e.g. the five pictures of a new horse) are
+    all sent to the encode processes first, so they are encoded at the same time, then
+    stored one by one. Returns the uploads, refreshed when they were processed inline.
+    """
+    uploads = list(uploads)
+    inline = []
+    for upload in uploads:
+        if current_app.config.get('MEDIA_ASYNC_TRANSCODE', True):
+            try:
+                transcode_pool.submit(process_media_upload, upload.id)
+                continue
+            except PoolFull as e:
+                logger.warning(f"{e} Transcoding upload {upload.id} inline.")
+        inline.append(upload)
+    encodings = {upload.id: _start_encoding(upload) for upload in inline}
+    for upload in inline:
+        process_media_upload(upload.id, encodings[upload.id])
+        db.session.refresh(upload)
+    return uploads
+
+
+def _start_encoding(upload):
+    """Sends a spooled upload to the encode pool, unless an identical upload is already stored."""
+    kind = MEDIA_KINDS[upload.kind]
+    profile = encoding_profile(kind.name)
+    if not upload.spoolPath or find_blob(kind, upload.sourceHash, encoding_name(profile)) is not None:
+        return None
+    return encode_pool.submit(encode_upload, upload.spoolPath, profile, max_image_pixels())
+
+
+def store_upload(kind, spool_path, source_hash, encoding_job=None):
+    """
+    Returns the MediaBlob for a spooled upload: an identical earlier upload's, the upload
+    itself when it already meets the kind's encoding profile (only its header is read to
+    decide), or a newly encoded one. The decoding and encoding run in the encode pool;
+    `encoding_job` is the pool's future when the upload was already sent there.
+    """
+    profile = encoding_profile(kind.name)
+    encoding = encoding_name(profile)
+    blob = find_blob(kind, source_hash, encoding)
+    if blob is not None:
+        if encoding_job is not None:
+            encoding_job.cancel()
+        logger.info(f"Upload {source_hash[:12]} already stored as {blob.filename}; skipping transcoding.")
+        return blob
+    if encoding_job is None:
+        encoding_job = encode_pool.submit(encode_upload, spool_path, profile, max_image_pixels())
+    encoded = encoding_job.result()
+    if encoded.reason is None:
+        logger.info(f"Upload {source_hash[:12]} already meets the {profile.name} profile; storing it as is.")
+    else:
+        logger.info(f"Re-encoded upload {source_hash[:12]} ({encoded.reason}).")
+    return store_encoded(kind, encoded, spool_path, source_hash, encoding)
+
+
+def process_media_upload(upload_id, encoding_job=None):
+    """
+    Stores one pending upload as a content-addressed blob and switches the owner's column
+    to it. The switch happens in one transaction that first claims the upload
+    (pending -> ready), so an upload cancelled or replaced meanwhile never overwrites a
+    newer picture. Blobs are shared and immutable, so the previous picture is left for
+    the media GC; only a legacy (per-row) file is deleted after the switch.
+    """
+    upload = MediaUpload.query.get(upload_id)
+    if upload is None or upload.status != 'pending':
+        logger.info(f"Media upload {upload_id} is no longer pending; skipping.")
+        if encoding_job is not None:
+            encoding_job.cancel()
+        if upload is not None:
+            _remove_file(upload.spoolPath)
+        return
+
+    kind = MEDIA_KINDS[upload.kind]
+    model = OWNER_MODELS[upload.ownerType]
+    column = getattr(model, upload.field)
+    owner_type, owner_id, field = upload.ownerType, upload.ownerId, upload.field
+    spool_path, source_hash, source_key = upload.spoolPath, upload.sourceHash, upload.sourceKey
+
+    try:
+        if source_key is not None:
+            # Direct upload: fetched from storage into the spool, hashed on the way
+            with media_storage.open(source_key) as source:
+                spool_path, source_hash = _spool_stream(source, source_key)
+        filename = store_upload(kind, spool_path, source_hash, encoding_job).filename
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Failed to transcode media upload {upload_id} ({kind.name} of {owner_type} {owner_id}).")
+        MediaUpload.query.filter_by(id=upload_id, status='pending')\
+                         .update({'status': 'failed', 'error': f"Could not process image: {e}"[:255],
+                                  'finishedAt': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        _remove_file(spool_path)
+        _remove_stored(source_key)
+        return
+
+    claimed = MediaUpload.query.filter_by(id=upload_id, status='pending')\
+                               .update({'status': 'ready', 'spoolPath': None, 'sourceKey': None,
+                                        'sourceHash': source_hash, 'filename': filename,
+                                        'finishedAt': datetime.utcnow()}, synchronize_session=False)
+    old_filename = None
+    if claimed:
+        old_filename = db.session.query(column).filter(model.id == owner_id).scalar()
+        switched = db.session.query(model).filter(model.id == owner_id)\
+                                          .update({field: filename}, synchronize_session=False)
+        if not switched:
+            # The owner was deleted while the upload was pending
+            MediaUpload.query.filter_by(id=upload_id).update({'status': 'cancelled'}, synchronize_session=False)
+            claimed = False
+    db.session.commit()
+    _remove_file(spool_path)
+    _remove_stored(source_key)
+
+    if not claimed:
+        logger.info(f"Media upload {upload_id} was cancelled while transcoding; {filename} is left for the media GC.")
+        return
+    if old_filename and old_filename != filename and not is_content_addressed(old_filename):
+        _remove_stored(storage_key(kind.prefix, old_filename))
+        delete_variants(kind.prefix, old_filename)
+    logger.info(f"Media upload {upload_id} ready: {owner_type} {owner_id}.{field} = {filename}")
+
+
+def media_upload_status(upload):
+    """Client-facing state of an upload; 'url' is set once the picture is ready."""
+    kind = MEDIA_KINDS.get(upload.kind)
+    return {
+        "id": upload.id,
+        "status": upload.status,
+        "field": upload.field,
+        "url": kind.url(upload.filename) if kind and upload.status == 'ready' else None,
+        "error": upload.error
+    }
+
+
+def _remove_stored(key):
+    if not key:
+        return
+    try:
+        media_storage.delete(key)
+    except Exception as e:
+        logger.error(f"Error deleting stored file {key}: {e}")
+
+
+def _remove_file(path):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Error deleting file {path}: {e}")
@@ -0,0 +1,86 @@
+import logging
+import os
+
+from flask import request
+from PIL import Image
+from werkzeug.exceptions import BadRequest
+
+from lib.media.images import load_image
+from lib.media.profiles import encode_webp
+from lib.media.storage import media_storage, storage_key
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Longest side, in pixels, of the downscaled copies stored next to every picture
+VARIANT_SIZES = (512, 128)
+
+
+def variant_filename(filename, size):
+    """'3_profile_ab12.webp' -> '3_profile_ab12_w128.webp'"""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}_w{size}{ext}"
+
+
+def requested_variant_size():
+    """
+    Reads the 'imageSize' query arg: one of VARIANT_SIZES, or 'original' (the default).
+    Returns the size, or None for the original. Raises BadRequest.
+    """
+    value = request.args.get('imageSize')
+    if not value or value == 'original':
+        return None
+    try:
+        size = int(value)
+    except ValueError:
+        size = None
+    if size not in VARIANT_SIZES:
+        raise BadRequest(f"'imageSize' must be one of: {', '.join(str(s) for s in sorted(VARIANT_SIZES))}, original.")
+    return size
+
+
+def encode_variants(img, profile, sizes=VARIANT_SIZES):
+    """
+    Encodes the downscaled copies of an already opened picture: {size: WEBP bytes}. Largest
+    first, each one resized from the previous so a large photo is only scaled down once at
+    full size. Pictures smaller than a size are encoded as they are for that size.
+    """
+    variants = {}
+    current = img
+    for size in sorted(sizes, reverse=True):
+        if max(current.size) > size:
+            current = current.copy()
+            current.thumbnail((size, size), Image.LANCZOS)
+        variants[size] = encode_webp(current, profile, variant=True)
+    return variants
+
+
+def save_variants(img, prefix, filename, profile, sizes=VARIANT_SIZES):
+    """Encodes and stores the downscaled copies of an already opened picture."""
+    for size, data in encode_variants(img, profile, sizes).items():
+        media_storage.save(storage_key(prefix, variant_filename(filename, size)), data, 'image/webp')
+
+
+def ensure_variant(prefix, filename, size, profile):
+    """
+    Returns the variant's filename, generating it from the original when it is missing
+    (pictures stored before variants existed). Raises FileNotFoundError without an original.
+    """
+    name = variant_filename(filename, size)
+    if media_storage.exists(storage_key(prefix, name)):
+        return name
+    # Decoded directly at (about) the variant size, not at full resolution
+    with media_storage.open(storage_key(prefix, filename)) as original, load_image(original, max_size=size) as img:
+        save_variants(img, prefix, filename, profile, sizes=(size,))
+    logger.info(f"Backfilled {size}px variant of {prefix}/{filename}")
+    return name
+
+
+def delete_variants(prefix, filename):
+    for size in VARIANT_SIZES:
+        key = storage_key(prefix, variant_filename(filename, size))
+        try:
+            media_storage.delete(key)
+        except Exception as e:
+            logger.error(f"Error deleting image variant {key}: {e}")
+
@@ -1,8 +1,11 @@
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.mysql import JSON, LONGTEXT
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 
+from lib.coordinates import PACKED_SIZE, coordinates_array, pack_coordinates, unpack_coordinates
+
 bcrypt = Bcrypt()
 db = SQLAlchemy()
 
@@ -54,6 +57,8 @@ class Veterinarian(db.Model):
 
 class Horse(db.Model):
     __tablename__ = 'Horses'
+    # Keyset pagination / ordered listings (see lib/pagination.py)
+    __table_args__ = (db.Index('ix_horses_name_id', 'name', 'idHorse'),)
 
     id = db.Column('idHorse', db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
@@ -72,6 +77,8 @@ class Horse(db.Model):
 
 class Appointment(db.Model):
     __tablename__ = 'Appointments'
+    # Keyset pagination / ordered listings (see lib/pagination.py)
+    __table_args__ = (db.Index('ix_appointments_vet_date_id', 'veterinarianId', 'date', 'idAppointment'),)
 
     id = db.Column('idAppointment', db.Integer, primary_key=True, autoincrement=True)
     horseId = db.Column(db.Integer, db.ForeignKey('Horses.idHorse'), nullable=False)
@@ -85,7 +92,8 @@ class Appointment(db.Model):
     muscleTensionStiffness = db.Column(db.String(255), nullable=True)
     muscleTensionR = db.Column(db.String(255), nullable=True)
     CBCpath = db.Column(db.String(255), nullable=True)
-    comment = db.Column(LONGTEXT, nullable=True)
+    # LONGTEXT: deferred, only SELECTed when accessed or requested with load_only()/undefer()
+    comment = deferred(db.Column(LONGTEXT, nullable=True))
     date = db.Column(db.DateTime, nullable=False, server_default=func.now())
     ECGtime = db.Column(db.Integer, nullable=True)
 
@@ -94,6 +102,8 @@ class Appointment(db.Model):
 
 class Client(db.Model):
     __tablename__ = 'Clients'
+    # Keyset pagination / ordered listings (see lib/pagination.py)
+    __table_args__ = (db.Index('ix_clients_name_id', 'name', 'idClient'),)
 
     id = db.Column('idClient', db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
@@ -114,16 +124,91 @@ class ClientHorse(db.Model):
 
 class Measure(db.Model):
     __tablename__ = 'Measures'
+    # Per-horse listings, trends and keyset pagination (see lib/pagination.py)
+    __table_args__ = (db.Index('ix_measures_horse_date_id', 'horseId', 'date', 'idMeasure'),)
 
     id = db.Column('idMeasure', db.Integer, primary_key=True, autoincrement=True)
     userBW = db.Column(db.Integer, nullable=True)
     algorithmBW = db.Column(db.Integer, nullable=True)
     userBCS = db.Column(db.Integer, nullable=True)
     algorithmBCS = db.Column(db.Integer, nullable=True)
+    # 'pending' while scored in the background, then 'done' or 'failed'; NULL when never scored
+    predictionStatus = db.Column(db.String(20), nullable=True)
+    predictionError = db.Column(db.String(255), nullable=True)
+    # When the row was left 'pending' for the background pool; rescore-measures retries it after a grace period
+    predictionQueuedAt = db.Column(db.DateTime, nullable=True)
+    # PREDICTION_MODEL_VERSION that produced algorithmBW/algorithmBCS; NULL when not scored (or scoring failed)
+    modelVersion = db.Column(db.String(50), nullable=True)
     date = db.Column(db.DateTime, nullable=False)
-    coordinates = db.Column(JSON, nullable=True)
+    # Deferred like Appointment.comment; list/detail endpoints load it only when it is in ?fields=
+    coordinates = deferred(db.Column(JSON, nullable=True))
+    # The same 14 points as 28 little-endian float32 values; NULL when coordinates are missing or invalid
+    coordinatesPacked = db.Column(db.BINARY(PACKED_SIZE), nullable=True)
     picturePath = db.Column(db.String(255), nullable=True)
     favorite = db.Column(db.Boolean, nullable=True)
     horseId = db.Column(db.Integer, db.ForeignKey('Horses.idHorse'), nullable=False)
     veterinarianId = db.Column(db.Integer, db.ForeignKey('Veterinarians.idVeterinarian'), nullable=True)
-    appointmentId = db.Column(db.Integer, db.ForeignKey('Appointments.idAppointment'), nullable=True)
\ No newline at end of file
+    appointmentId = db.Column(db.Integer, db.ForeignKey('Appointments.idAppointment'), nullable=True)
+
+    def set_coordinates(self, coordinates):
+        self.coordinates = coordinates
+        self.coordinatesPacked = pack_coordinates(coordinates)
+
+    @property
+    def coordinatesArray(self):
+        """The 28 coordinate values: a float32 view over the packed column when present, else parsed from the JSON."""
+        if self.coordinatesPacked is not None:
+            return unpack_coordinates(self.coordinatesPacked)
+        try:
+            return coordinates_array(self.coordinates) if self.coordinates else None
+        except ValueError:
+            return None
+
+class MediaUpload(db.Model):
+    __tablename__ = 'MediaUploads'
+    # Pending uploads of one picture slot (see lib/media/uploads.py)
+    __table_args__ = (db.Index('ix_media_uploads_owner_field', 'ownerType', 'ownerId', 'field'),)
+
+    id = db.Column('idMediaUpload', db.Integer, primary_key=True, autoincrement=True)
+    # The row that receives the picture: ownerType 'horse' or 'measure', and the filename column on it
+    ownerType = db.Column(db.String(20), nullable=False)
+    ownerId = db.Column(db.Integer, nullable=False)
+    field = db.Column(db.String(50), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    spoolPath = db.Column(db.String(255), nullable=True)
+    # Storage key of the original when the client uploaded it directly to storage (pre-signed URL)
+    sourceKey = db.Column(db.String(255), nullable=True)
+    # sha256 of the uploaded bytes, to reuse an existing MediaBlob of the same upload
+    sourceHash = db.Column(db.String(64), nullable=True)
+    # The stored file once ready (a MediaBlob filename)
+    filename = db.Column(db.String(255), nullable=True)
+    # 'pending' until transcoded, then 'ready'; 'failed', or 'cancelled' when replaced/removed first.
+    # Direct uploads are 'uploading' until the client reports its file as sent
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    error = db.Column(db.String(255), nullable=True)
+    createdAt = db.Column(db.DateTime, nullable=False, server_default=func.now())
+    finishedAt = db.Column(db.DateTime, nullable=True)
+
+
+
+class MediaBlob(db.Model):
+    __tablename__ = 'MediaBlobs'
+    # One stored file per content; identical uploads are found again by their source hash
+    __table_args__ = (db.UniqueConstraint('kind', 'contentHash', name='uq_media_blobs_kind_content'),
+                      db.Index('ix_media_blobs_kind_source', 'kind', 'sourceHash', 'encoding'))
+
+    id = db.Column('idMediaBlob', db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), nullable=False)
+    # sha256 of the stored WEBP; the file is '<contentHash>.webp' and never changes
+    contentHash = db.Column(db.String(64), nullable=False)
+    sourceHash = db.Column(db.String(64), nullable=True)
+    # Encoder settings that produced the file from the source, e.g. 'webp-q85'
+    encoding = db.Column(db.String(50), nullable=False)
+    byteSize = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    createdAt = db.Column(db.DateTime, nullable=False, server_default=func.now())
+
+    @property
+    def filename(self):
+        return f"{self.contentHash}.webp"
@@ -0,0 +1,88 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, or_
+from werkzeug.exceptions import BadRequest
+
+PageRequest = namedtuple('PageRequest', ['limit', 'cursor'])
+
+
+def page_request():
+    """
+    Reads the 'limit' and 'cursor' query args. Returns None when neither is given, so the
+    endpoint keeps its unpaginated response for older clients. Raises BadRequest.
+    """
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    if limit is None and not cursor:
+        return None
+
+    max_limit = int(current_app.config.get('PAGINATION_MAX_LIMIT', 500))
+    if limit is None:
+        limit = min(int(current_app.config.get('PAGINATION_DEFAULT_LIMIT', 50)), max_limit)
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise BadRequest("'limit' must be an integer.")
+        if not 1 <= limit <= max_limit:
+            raise BadRequest(f"'limit' must be between 1 and {max_limit}.")
+    return PageRequest(limit, cursor or None)
+
+
+def paginate(query, order_by, page, scope):
+    """
+    Keyset pagination. `order_by` is a list of (column attribute, descending) pairs whose
+    last column is unique (the primary key), e.g. [(Measure.date, True), (Measure.id, True)].
+    Returns (rows, next_cursor); next_cursor is None on the last page. `scope` names the
+    listing, so a cursor from one endpoint is rejected by another.
+    """
+    if page.cursor:
+        position = _decode_cursor(page.cursor, order_by, scope)
+        query = query.filter(_after(order_by, position))
+    query = query.order_by(*(column.desc() if descending else column.asc() for column, descending in order_by))
+
+    rows = query.limit(page.limit + 1).all()
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    return rows, _encode_cursor([getattr(rows[-1], column.key) for column, _ in order_by], scope)
+
+
+def page_response(items, next_cursor):
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _after(order_by, position):
+    """(c1, c2, ...) strictly after `position` in the given order, as portable OR/AND terms."""
+    column, descending = order_by[0]
+    value = position[0]
+    beyond = column < value if descending else column > value
+    if len(order_by) == 1:
+        return beyond
+    return or_(beyond, and_(column == value, _after(order_by[1:], position[1:])))
+
+
+def _encode_cursor(values, scope):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps({"s": scope, "p": payload}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor, order_by, scope):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        payload = data["p"]
+        if data["s"] != scope or len(payload) != len(order_by):
+            raise ValueError("cursor does not belong to this listing")
+        position = []
+        for (column, _), value in zip(order_by, payload):
+            python_type = column.type.python_type
+            position.append(datetime.fromisoformat(value) if python_type is datetime else python_type(value))
+        return position
+    except (ValueError, TypeError, KeyError, AttributeError, NotImplementedError):
+        raise BadRequest("Invalid pagination cursor.")
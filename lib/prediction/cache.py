@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PredictionCache:
+    """
+    LRU + TTL cache of prediction results keyed by the normalised 28-float
+    coordinate vector and the model version.
+
+    Concurrent lookups for the same key while a prediction is in flight wait for
+    that call instead of starting their own (single-flight). Failed predictions
+    are never cached; every waiter receives the same exception.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_entries = 4096
+        self.ttl_seconds = 3600.0
+        self.model_version = "1"
+        self.precision = 4
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._in_flight = {}  # key -> Future
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the cache settings from the Flask config."""
+        self.enabled = app.config.get('PREDICTION_CACHE_ENABLED', self.enabled)
+        self.max_entries = max(1, int(app.config.get('PREDICTION_CACHE_MAX_ENTRIES', self.max_entries)))
+        self.ttl_seconds = float(app.config.get('PREDICTION_CACHE_TTL_SECONDS', self.ttl_seconds))
+        self.model_version = str(app.config.get('PREDICTION_MODEL_VERSION', self.model_version))
+        self.clear()
+        app.extensions['prediction_cache'] = self
+        logger.info(f"Prediction cache {'enabled' if self.enabled else 'disabled'}: "
+                    f"{self.max_entries} entries, TTL {self.ttl_seconds:.0f}s, model version {self.model_version}.")
+
+    def make_key(self, values):
+        """Rounds the values so float noise from the client does not defeat the cache (+ 0.0 folds -0.0)."""
+        return (self.model_version, tuple(round(float(v), self.precision) + 0.0 for v in values))
+
+    def get_or_compute(self, values, compute, cacheable=None):
+        """
+        Returns the cached result for `values`, or calls compute(values) once for all
+        concurrent callers with the same key. Only results for which cacheable(result)
+        is true (default: always) are stored.
+        """
+        if not self.enabled:
+            return compute(values)
+
+        key = self.make_key(values)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+                self._counters["expirations"] += 1
+
+            leader_future = self._in_flight.get(key)
+            if leader_future is not None:
+                self._counters["coalesced"] += 1
+            else:
+                self._counters["misses"] += 1
+                future = Future()
+                self._in_flight[key] = future
+
+        if leader_future is not None:
+            return leader_future.result()
+
+        try:
+            result = compute(values)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if cacheable is None or cacheable(result):
+                self._store(key, result)
+        future.set_result(result)
+        return result
+
+    def _store(self, key, result):
+        # Caller holds self._lock
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def get(self, values):
+        """Returns the cached result for `values`, or None. Counts as a hit or a miss."""
+        if not self.enabled:
+            return None
+        key = self.make_key(values)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, values, result):
+        """Stores a result computed outside get_or_compute() (e.g. by a batch call)."""
+        if not self.enabled:
+            return
+        key = self.make_key(values)
+        with self._lock:
+            self._store(key, result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+            stats["in_flight"] = len(self._in_flight)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = round((stats["hits"] + stats["coalesced"]) / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["model_version"] = self.model_version
+        stats["enabled"] = self.enabled
+        return stats
+
+
+prediction_cache = PredictionCache()
@@ -0,0 +1,267 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while the prediction service circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed    -> requests flow; `failure_threshold` failures in a row open the circuit.
+    open      -> requests fail fast until `reset_timeout` seconds have passed.
+    half_open -> one trial request is let through; success closes, failure re-opens.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._times_opened = 0
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = 'half_open'
+                self._trial_in_flight = False
+            if self._state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != 'closed':
+                logger.info("Prediction service circuit closed.")
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == 'half_open' or (self._state == 'closed' and self._failures >= self.failure_threshold):
+                if self._state == 'closed':
+                    self._times_opened += 1
+                    logger.error(f"Prediction service circuit opened after {self._failures} consecutive failures.")
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self._state == 'open':
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 1)
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "retry_in_seconds": retry_in,
+            }
+
+
+class PredictionClient:
+    """
+    Shared HTTP client for the prediction service: one pooled keep-alive session
+    per process, separate connect/read timeouts, a circuit breaker and optional
+    hedged requests (a second identical request is sent if the first has not
+    answered after `hedge_after` seconds; the first response wins).
+    """
+
+    def __init__(self, app=None):
+        self.connect_timeout = 2.0
+        self.read_timeout = 10.0
+        self.pool_size = 16
+        self.hedge_after = None
+        self.breaker = CircuitBreaker()
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._hedge_executor = None
+        self._pid = None
+        self._latencies = deque(maxlen=1024)
+        self._counters = {"requests": 0, "failures": 0, "short_circuited": 0, "hedges_sent": 0, "hedges_won": 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the client settings from the Flask config."""
+        self.configure(
+            connect_timeout=app.config.get('PREDICTION_CONNECT_TIMEOUT', self.connect_timeout),
+            read_timeout=app.config.get('PREDICTION_READ_TIMEOUT', self.read_timeout),
+            pool_size=app.config.get('PREDICTION_POOL_SIZE', self.pool_size),
+            hedge_after_ms=app.config.get('PREDICTION_HEDGE_AFTER_MS', 0),
+            breaker_failures=app.config.get('PREDICTION_BREAKER_FAILURES', 5),
+            breaker_reset_seconds=app.config.get('PREDICTION_BREAKER_RESET_SECONDS', 30),
+        )
+        app.extensions['prediction_client'] = self
+
+    def configure(self, connect_timeout=None, read_timeout=None, pool_size=None, hedge_after_ms=None,
+                  breaker_failures=None, breaker_reset_seconds=None):
+        """Updates settings; a hedge_after_ms of 0 disables hedging. The session is rebuilt."""
+        if connect_timeout is not None:
+            self.connect_timeout = float(connect_timeout)
+        if read_timeout is not None:
+            self.read_timeout = float(read_timeout)
+        if pool_size is not None:
+            self.pool_size = max(1, int(pool_size))
+        if hedge_after_ms is not None:
+            self.hedge_after = float(hedge_after_ms) / 1000.0 if float(hedge_after_ms) > 0 else None
+        if breaker_failures is not None or breaker_reset_seconds is not None:
+            self.breaker = CircuitBreaker(
+                failure_threshold=max(1, int(breaker_failures or self.breaker.failure_threshold)),
+                reset_timeout=float(breaker_reset_seconds if breaker_reset_seconds is not None else self.breaker.reset_timeout),
+            )
+        self._reset_session()
+        logger.info(f"Prediction client configured: timeouts {self.timeout}, pool {self.pool_size}, "
+                    f"hedging {'after %.0fms' % (self.hedge_after * 1000) if self.hedge_after else 'off'}.")
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    @property
+    def max_call_seconds(self):
+        """Upper bound for one post_json() call, including a hedge."""
+        return self.connect_timeout + self.read_timeout + (self.hedge_after or 0)
+
+    def post_json(self, url, payload):
+        """
+        POSTs `payload` as JSON and returns the response after raise_for_status().
+        Raises CircuitOpenError without a network call while the circuit is open.
+        """
+        if not self.breaker.allow_request():
+            with self._lock:
+                self._counters["short_circuited"] += 1
+            raise CircuitOpenError(f"Prediction service circuit is open; not calling {url}.")
+
+        started = time.monotonic()
+        try:
+            if self.hedge_after is None:
+                response = self._post(url, payload)
+            else:
+                response = self._hedged_post(url, payload)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            # 4XX means the request itself is bad; only server errors count against the service.
+            if e.response is not None and e.response.status_code >= 500:
+                self._record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+
+        elapsed = time.monotonic() - started
+        self.breaker.record_success()
+        with self._lock:
+            self._counters["requests"] += 1
+            self._latencies.append(elapsed)
+        return response
+
+    def get(self, url, timeout=None):
+        """Plain GET on the pooled session (used by health checks); not subject to the breaker."""
+        return self._get_session().get(url, timeout=timeout or self.timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            latencies = sorted(self._latencies)
+        if latencies:
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+            stats["latency_ms"] = {
+                "samples": len(latencies),
+                "mean": round(sum(latencies) / len(latencies) * 1000, 2),
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1] * 1000, 2),
+            }
+        else:
+            stats["latency_ms"] = None
+        stats["circuit"] = self.breaker.snapshot()
+        stats["timeouts"] = {"connect": self.connect_timeout, "read": self.read_timeout}
+        stats["hedge_after_ms"] = self.hedge_after * 1000 if self.hedge_after else None
+        return stats
+
+    def _record_failure(self):
+        self.breaker.record_failure()
+        with self._lock:
+            self._counters["failures"] += 1
+
+    def _post(self, url, payload):
+        return self._get_session().post(url, json=payload, timeout=self.timeout)
+
+    def _hedged_post(self, url, payload):
+        executor = self._get_hedge_executor()
+        primary = executor.submit(self._post, url, payload)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self._counters["hedges_sent"] += 1
+        hedge = executor.submit(self._post, url, payload)
+        pending = {primary, hedge}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    last_error = e
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self._counters["hedges_won"] += 1
+                return response
+        raise last_error
+
+    def _get_session(self):
+        if self._session is None or self._pid != os.getpid():
+            self._reset_session()
+        return self._session
+
+    def _get_hedge_executor(self):
+        self._get_session()
+        return self._hedge_executor
+
+    def _reset_session(self):
+        # Also called after a fork: pooled connections inherited from the parent must not be shared.
+        with self._lock:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            old_executor = self._hedge_executor if self._pid == os.getpid() else None
+            self._session = session
+            self._hedge_executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="prediction-hedge")
+            self._pid = os.getpid()
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+
+
+prediction_client = PredictionClient()
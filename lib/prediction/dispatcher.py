@@ -0,0 +1,264 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from lib.prediction.client import prediction_client
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PredictionDispatcher:
+    """
+    Collects concurrent prediction requests for a short linger window and sends
+    them to the prediction API as a single batched call.
+
+    A single pending request is sent to PREDICTION_API_URL with the usual
+    {"values": [...28 floats]} payload. Two or more are sent to
+    PREDICTION_BATCH_API_URL as {"batch": [{"values": [...]}, ...]}, and the
+    service is expected to answer {"predictions": [{"bcs": .., "bw": ..}, ...]}
+    in the same order. Every caller gets back its own {'bcs', 'bw'} dict.
+
+    Without a batch endpoint (PREDICTION_BATCH_API_URL empty, or the batch URL answered
+    404 or 405, which is logged once and reset by configure()) requests are not collected:
+    predict() posts to PREDICTION_API_URL from the caller's thread and submit() from a pool
+    of PREDICTION_POOL_SIZE threads, so every request has its own concurrent call as
+    without the dispatcher. A batch already collected when the 404/405 came back is sent
+    the same way.
+    """
+
+    def __init__(self, app=None):
+        self.predict_url = "http://localhost:9091/predict"
+        self.batch_url = "http://localhost:9091/predict_batch"
+        self.max_batch_size = 32
+        self.linger_seconds = 0.005
+        self.max_in_flight = 4
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._collector = None
+        self._senders = None
+        self._singles = None
+        self._pid = None
+        self._batch_unsupported = False
+        self._stats = {"requests": 0, "batches": 0, "batched_requests": 0, "largest_batch": 0, "errors": 0,
+                       "direct_requests": 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the dispatcher settings from the Flask config."""
+        self.configure(
+            predict_url=app.config.get('PREDICTION_API_URL', self.predict_url),
+            batch_url=app.config.get('PREDICTION_BATCH_API_URL', self.batch_url),
+            max_batch_size=app.config.get('PREDICTION_BATCH_MAX_SIZE', self.max_batch_size),
+            linger_ms=app.config.get('PREDICTION_BATCH_LINGER_MS', self.linger_seconds * 1000),
+            max_in_flight=app.config.get('PREDICTION_BATCH_MAX_IN_FLIGHT', self.max_in_flight),
+        )
+        app.extensions['prediction_dispatcher'] = self
+
+    def configure(self, predict_url=None, batch_url=None, max_batch_size=None, linger_ms=None,
+                  max_in_flight=None):
+        """Updates settings. Running worker threads are stopped and restarted lazily."""
+        self.shutdown()
+        if predict_url is not None:
+            self.predict_url = predict_url
+        if batch_url is not None:
+            self.batch_url = batch_url
+        if max_batch_size is not None:
+            self.max_batch_size = max(1, int(max_batch_size))
+        if linger_ms is not None:
+            self.linger_seconds = max(0.0, float(linger_ms) / 1000.0)
+        if max_in_flight is not None:
+            self.max_in_flight = max(1, int(max_in_flight))
+        self._batch_unsupported = False
+        logger.info(f"Prediction dispatcher configured: batch size {self.max_batch_size}, "
+                    f"linger {self.linger_seconds * 1000:.1f}ms, {self.max_in_flight} batches in flight.")
+
+    @property
+    def batching(self):
+        """False when there is no batch endpoint to send collected requests to."""
+        return bool(self.batch_url) and not self._batch_unsupported
+
+    def submit(self, values):
+        """Queues a list of 28 floats for prediction. Returns a Future resolving to {'bcs', 'bw'}."""
+        self._ensure_started()
+        future = Future()
+        if self.batching:
+            self._queue.put((values, future))
+        else:
+            self._send_one(values, future)
+        return future
+
+    def predict(self, values):
+        """Blocking variant of submit(). Raises the same errors as a direct requests.post would."""
+        if not self.batching:
+            return self._predict_one(values)
+        future = self.submit(values)
+        # The prediction client enforces the HTTP timeouts; this only guards against a stuck worker.
+        return future.result(timeout=prediction_client.max_call_seconds + self.linger_seconds + 5)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        stats["max_batch_size"] = self.max_batch_size
+        stats["linger_ms"] = self.linger_seconds * 1000
+        stats["batching"] = self.batching
+        return stats
+
+    def shutdown(self):
+        """Stops the collector and sender threads. Pending requests are failed."""
+        with self._lock:
+            collector, senders, singles, pending = self._collector, self._senders, self._singles, self._queue
+            self._collector = self._senders = self._singles = self._queue = None
+            self._pid = None
+        if pending is not None:
+            pending.put(None)
+        if collector is not None and collector.is_alive():
+            collector.join(timeout=1)
+        for executor in (senders, singles):
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._collector is not None and self._pid == pid:
+            return
+        with self._lock:
+            # After a fork (e.g. gunicorn workers) the parent's threads do not exist in the child.
+            if self._collector is not None and self._pid == pid:
+                return
+            self._queue = queue.Queue()
+            self._senders = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="prediction-batch")
+            self._singles = ThreadPoolExecutor(max_workers=prediction_client.pool_size, thread_name_prefix="prediction-single")
+            self._collector = threading.Thread(
+                target=self._collect, args=(self._queue, self._senders),
+                name="prediction-dispatcher", daemon=True
+            )
+            self._pid = pid
+            self._collector.start()
+
+    def _collect(self, pending, senders):
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.linger_seconds
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                senders.submit(self._send, batch)
+            except RuntimeError as e:
+                # Executor shut down while a batch was being collected.
+                for _, future in batch:
+                    future.set_exception(e)
+            if stop:
+                break
+
+        # Fail anything still queued once the dispatcher is shut down.
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("Prediction dispatcher was shut down."))
+
+    def _send(self, batch):
+        futures = [future for _, future in batch]
+        if len(batch) > 1 and not self.batching:
+            self._send_each(batch)
+            return
+        try:
+            if len(batch) == 1:
+                response = prediction_client.post_json(self.predict_url, {"values": batch[0][0]})
+                predictions = [response.json()]
+            else:
+                payload = {"batch": [{"values": values} for values, _ in batch]}
+                response = prediction_client.post_json(self.batch_url, payload)
+                predictions = response.json().get('predictions')
+                if not isinstance(predictions, list) or len(predictions) != len(batch):
+                    raise ValueError(f"Batch prediction response has {len(predictions) if isinstance(predictions, list) else 'no'} "
+                                     f"predictions for {len(batch)} requests.")
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code in (404, 405) and len(batch) > 1:
+                if not self._batch_unsupported:
+                    self._batch_unsupported = True
+                    logger.warning(f"{self.batch_url} answered {e.response.status_code}; sending one "
+                                   f"{self.predict_url} call per request from now on.")
+                self._send_each(batch)
+                return
+            self._fail(batch, e)
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            if len(batch) > 1:
+                self._stats["batched_requests"] += len(batch)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+        for future, prediction in zip(futures, predictions):
+            future.set_result(prediction)
+
+    def _send_each(self, batch):
+        """Sends a collected batch as concurrent single-prediction calls (no batch endpoint)."""
+        for values, future in batch:
+            self._send_one(values, future)
+
+    def _send_one(self, values, future):
+        try:
+            self._singles.submit(self._resolve_one, values, future)
+        except (AttributeError, RuntimeError) as e:
+            # Executor shut down (or replaced) meanwhile.
+            future.set_exception(RuntimeError(f"Prediction dispatcher was shut down: {e}"))
+
+    def _resolve_one(self, values, future):
+        try:
+            prediction = self._predict_one(values)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        future.set_result(prediction)
+
+    def _predict_one(self, values):
+        try:
+            prediction = prediction_client.post_json(self.predict_url, {"values": values}).json()
+        except Exception as e:
+            logger.error(f"Prediction failed: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["direct_requests"] += 1
+        return prediction
+
+    def _fail(self, batch, e):
+        logger.error(f"Prediction batch of {len(batch)} failed: {e}")
+        with self._lock:
+            self._stats["errors"] += len(batch)
+        for _, future in batch:
+            future.set_exception(e)
+
+
+prediction_dispatcher = PredictionDispatcher()
@@ -0,0 +1,118 @@
+import logging
+import threading
+
+import numpy as np
+
+from lib.coordinates import N_VALUES
+from lib.prediction.client import prediction_client
+from lib.prediction.dispatcher import prediction_dispatcher
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class HttpPredictionBackend:
+    """Scores through the external prediction API (dispatcher + pooled client)."""
+
+    name = 'http'
+
+    def predict(self, values):
+        return prediction_dispatcher.predict(values)
+
+    def predict_many(self, rows):
+        # Submitting everything before waiting lets the dispatcher pack the rows into batches.
+        futures = [prediction_dispatcher.submit(values) for values in rows]
+        timeout = prediction_client.max_call_seconds + prediction_dispatcher.linger_seconds + 5
+        return [future.result(timeout=timeout) for future in futures]
+
+
+class LocalModelBackend:
+    """
+    Scores in-process with the same serialized model the prediction service uses.
+
+    The model file (joblib/pickle) is loaded once per worker, on first use. It may be
+    a single estimator whose predict() returns one column per output, ordered as in
+    `outputs` (default bcs, bw), or a dict {'bcs': estimator, 'bw': estimator}.
+    Rows are scored as one float64 matrix, so a batch costs one predict() call.
+    """
+
+    name = 'local'
+
+    def __init__(self, model_path, outputs=('bcs', 'bw')):
+        self.model_path = model_path
+        self.outputs = tuple(outputs)
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if not self.model_path:
+                        raise RuntimeError("PREDICTION_MODEL_PATH is not set; cannot use the local prediction backend.")
+                    import joblib  # installed with scikit-learn
+                    self._model = joblib.load(self.model_path)
+                    logger.info(f"Loaded prediction model from {self.model_path} ({type(self._model).__name__}).")
+        return self._model
+
+    def predict(self, values):
+        return self.predict_many([values])[0]
+
+    def predict_many(self, rows):
+        matrix = np.asarray(rows, dtype=np.float64)
+        if matrix.ndim != 2 or matrix.shape[1] != N_VALUES:
+            raise ValueError(f"Expected rows of {N_VALUES} coordinate values, got array of shape {matrix.shape}.")
+        if matrix.shape[0] == 0:
+            return []
+
+        scores = self.score_matrix(matrix)
+        return [dict(zip(self.outputs, (float(v) for v in row))) for row in scores]
+
+    def score_matrix(self, matrix):
+        """Returns an (n, len(outputs)) float array for an (n, 28) input matrix."""
+        model = self.load()
+        if isinstance(model, dict):
+            return np.column_stack([np.asarray(model[name].predict(matrix), dtype=np.float64).reshape(-1)
+                                    for name in self.outputs])
+        scores = np.asarray(model.predict(matrix), dtype=np.float64)
+        if scores.ndim == 1:
+            scores = scores.reshape(-1, 1)
+        if scores.shape[1] != len(self.outputs):
+            raise ValueError(f"Model returned {scores.shape[1]} outputs, expected {len(self.outputs)} ({', '.join(self.outputs)}).")
+        return scores
+
+
+class PredictionEngine:
+    """Front for the configured prediction backend (PREDICTION_BACKEND = 'http' or 'local')."""
+
+    def __init__(self, app=None):
+        self.backend = HttpPredictionBackend()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend_name = str(app.config.get('PREDICTION_BACKEND', 'http')).lower()
+        if backend_name == 'local':
+            outputs = [name.strip() for name in str(app.config.get('PREDICTION_MODEL_OUTPUTS', 'bcs,bw')).split(',')]
+            self.backend = LocalModelBackend(app.config.get('PREDICTION_MODEL_PATH'), outputs=outputs)
+        elif backend_name == 'http':
+            self.backend = HttpPredictionBackend()
+        else:
+            raise ValueError(f"Unknown PREDICTION_BACKEND '{backend_name}'. Use 'http' or 'local'.")
+        app.extensions['prediction_engine'] = self
+        logger.info(f"Prediction backend: {self.backend.name}")
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def predict(self, values):
+        """Scores one list of 28 floats. Returns {'bcs': .., 'bw': ..}."""
+        return self.backend.predict(values)
+
+    def predict_many(self, rows):
+        """Scores many lists of 28 floats in as few model/API calls as possible, preserving order."""
+        return self.backend.predict_many(rows)
+
+
+prediction_engine = PredictionEngine()
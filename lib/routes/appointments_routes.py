@@ -1,12 +1,18 @@
 import logging
 import os
-from flask import Blueprint, request, jsonify, url_for
+import shutil
+import tempfile
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from lib.media.images import load_image
+from lib.media.storage import media_storage, storage_key
+from lib.media.streaming import upload_limit
 from lib.models import Appointment, db, Veterinarian, Horse
+from lib.fieldsets import FieldSet
+from lib.pagination import page_request, page_response, paginate
 from werkzeug.utils import secure_filename
-from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType
+from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge
 from werkzeug.datastructures import FileStorage
-from PIL import Image as PILImage
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
 import subprocess
@@ -17,16 +23,17 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-STATIC_FOLDER_REL = os.path.join('lib', 'static')
-APPOINTMENTS_FOLDER_REL = os.path.join(STATIC_FOLDER_REL, 'appointments')
-CBC_FOLDER_REL = os.path.join(APPOINTMENTS_FOLDER_REL, 'cbc')
+# Storage key prefix of the CBC PDFs (a folder under lib/static with the local storage backend)
+CBC_PREFIX = 'appointments/cbc'
+# Folder of the CBC conversion scratch folders, only ever used by this app, so the media GC
+# can sweep leftovers without touching what other programs keep in the temp folder
+CBC_SCRATCH_FOLDER = 'iequus_cbc'
 
 
-CBC_FOLDER = os.path.join(project_dir, CBC_FOLDER_REL)
-
-os.makedirs(CBC_FOLDER, exist_ok=True)
-logger.info(f"CBC Upload folder set to: {CBC_FOLDER}")
+def cbc_scratch_folder():
+    folder = os.path.join(current_app.config.get('UPLOAD_TEMP_FOLDER') or tempfile.gettempdir(), CBC_SCRATCH_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
 
 
 
@@ -56,7 +63,9 @@ def convert_to_pdf(input_path, output_path):
 
         if file_ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff']:
             logger.info("Converting image file using Pillow.")
-            with PILImage.open(input_path) as image:
+            # Pixel limit checked from the header; large scans are decoded straight at the PDF size
+            max_dimension = int(current_app.config.get('CBC_IMAGE_MAX_DIMENSION', 3508))
+            with load_image(input_path, max_size=max_dimension) as image:
 
                 if image.mode == 'RGBA' or image.mode == 'P':
                     image = image.convert('RGB')
@@ -186,16 +195,16 @@ def convert_to_pdf(input_path, output_path):
 
 def _save_and_convert_cbc(cbc_file: FileStorage, horse_id, appointment_id):
     """
-    Saves temporary file from FileStorage, converts to PDF,
-    renames to final path, and cleans up temp file.
-    Returns the final relative PDF filename or None.
+    Saves the upload into a scratch folder, converts it to PDF there,
+    stores the PDF in media storage, and cleans up the scratch folder.
+    Returns the final PDF filename or None.
     Raises:
         ValueError: If filename is invalid or saving/conversion fails.
     """
     if not cbc_file or not cbc_file.filename:
         return None
 
-    temp_path = None
+    work_dir = None
     try:
 
         original_filename = cbc_file.filename
@@ -211,10 +220,12 @@ def _save_and_convert_cbc(cbc_file: FileStorage, horse_id, appointment_id):
                  raise ValueError("Could not determine file extension for CBC file.")
 
 
+        # Converted locally (LibreOffice needs files on disk); only the PDF goes to media storage
+        work_dir = tempfile.mkdtemp(prefix='cbc_', dir=cbc_scratch_folder())
         temp_filename = f"temp_{appointment_id}{file_ext}"
-        temp_path = os.path.join(CBC_FOLDER, temp_filename)
+        temp_path = os.path.join(work_dir, temp_filename)
         final_filename = f"cbc_horse{horse_id}_appointment{appointment_id}.pdf"
-        final_pdf_path = os.path.join(CBC_FOLDER, final_filename)
+        final_pdf_path = os.path.join(work_dir, final_filename)
 
 
         logger.info(f"Saving uploaded CBC file temporarily to: {temp_path}")
@@ -224,7 +235,8 @@ def _save_and_convert_cbc(cbc_file: FileStorage, horse_id, appointment_id):
         logger.info(f"Converting temporary file '{temp_path}' to final PDF '{final_pdf_path}'")
         convert_to_pdf(temp_path, final_pdf_path)
 
-        logger.info(f"Successfully converted and saved CBC PDF to: {final_pdf_path}")
+        media_storage.save_file(storage_key(CBC_PREFIX, final_filename), final_pdf_path, 'application/pdf')
+        logger.info(f"Successfully converted and stored CBC PDF as: {storage_key(CBC_PREFIX, final_filename)}")
 
         return final_filename
 
@@ -233,46 +245,60 @@ def _save_and_convert_cbc(cbc_file: FileStorage, horse_id, appointment_id):
         raise ValueError(f"Failed to process CBC file: {str(e)}")
     finally:
 
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-                logger.info(f"Removed temporary file: {temp_path}")
-            except OSError as e:
-                logger.warning(f"Could not remove temporary file '{temp_path}': {e}")
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            logger.info(f"Removed temporary folder: {work_dir}")
 
 def _get_cbc_url(filename):
     """Generates the absolute URL for a CBC PDF file."""
     if not filename:
         return None
     try:
-
-        relative_path = os.path.join('appointments', 'cbc', filename).replace('\\', '/')
-        return url_for('static', filename=relative_path, _external=True)
+        return media_storage.url(storage_key(CBC_PREFIX, filename))
     except RuntimeError as e:
         logger.error(f"Error generating URL for CBC file {filename}: {e}")
         return None
 
+# Response keys of an appointment -> (columns they need, how they are rendered). Used with ?fields=
+APPOINTMENT_FIELDS = FieldSet({
+    "id": ((Appointment.id,), lambda appt: appt.id),
+    "horseId": ((Appointment.horseId,), lambda appt: appt.horseId),
+    "veterinarianId": ((Appointment.veterinarianId,), lambda appt: appt.veterinarianId),
+    "date": ((Appointment.date,), lambda appt: appt.date.isoformat() if appt.date else None),
+    "lamenessRightFront": ((Appointment.lamenessRightFront,), lambda appt: appt.lamenessRightFront),
+    "lamenessLeftFront": ((Appointment.lamenessLeftFront,), lambda appt: appt.lamenessLeftFront),
+    "lamenessRightHind": ((Appointment.lamenessRightHind,), lambda appt: appt.lamenessRightHind),
+    "lamenessLeftHind": ((Appointment.lamenessLeftHind,), lambda appt: appt.lamenessLeftHind),
+    "BPM": ((Appointment.BPM,), lambda appt: appt.BPM),
+    "ECGtime": ((Appointment.ECGtime,), lambda appt: appt.ECGtime),
+    "muscleTensionFrequency": ((Appointment.muscleTensionFrequency,), lambda appt: appt.muscleTensionFrequency),
+    "muscleTensionStiffness": ((Appointment.muscleTensionStiffness,), lambda appt: appt.muscleTensionStiffness),
+    "muscleTensionR": ((Appointment.muscleTensionR,), lambda appt: appt.muscleTensionR),
+    "CBCpath": ((Appointment.CBCpath,), lambda appt: _get_cbc_url(appt.CBCpath)),
+    "comment": ((Appointment.comment,), lambda appt: appt.comment),
+}, always=("id",))
+
 def _delete_cbc_pdf(filename):
     """Deletes a CBC PDF file if it exists."""
     if not filename:
         return False
+    key = storage_key(CBC_PREFIX, filename)
     try:
-        path = os.path.join(CBC_FOLDER, filename)
-        if os.path.exists(path):
-            os.remove(path)
-            logger.info(f"Deleted CBC PDF file: {path}")
+        if media_storage.delete(key):
+            logger.info(f"Deleted CBC PDF file: {key}")
             return True
         else:
-            logger.warning(f"Attempted to delete non-existent CBC PDF file: {path}")
+            logger.warning(f"Attempted to delete non-existent CBC PDF file: {key}")
             return False
-    except OSError as e:
-        logger.error(f"Error deleting CBC PDF file {path}: {e}")
+    except Exception as e:
+        logger.error(f"Error deleting CBC PDF file {key}: {e}")
         return False
 
 
 
 @appointments_bp.route('/appointment', methods=['POST'])
 @jwt_required()
+@upload_limit('CBC_UPLOAD_MAX_BYTES')
 def add_appointment():
     """
     Adds a new appointment. Expects multipart/form-data.
@@ -401,7 +427,7 @@ def add_appointment():
             }
         }), 201
 
-    except (BadRequest, NotFound, UnsupportedMediaType) as e:
+    except (BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge) as e:
         logger.warning(f"Client error adding appointment: {e}")
         return jsonify({"error": str(e)}), e.code if hasattr(e, 'code') else 400
     except Exception as e:
@@ -416,6 +442,7 @@ def add_appointment():
 def get_appointments():
     """
     Gets a list of appointments associated with the veterinarian identified by the JWT token.
+    With 'limit' (and 'cursor' from the previous page) returns {"items", "next_cursor"}.
     """
     requesting_vet_id_str = None # For logging in case of errors
     try:
@@ -434,28 +461,21 @@ def get_appointments():
             return jsonify({"error": f"Veterinarian with ID {requesting_vet_id} not found."}), 404
 
         logger.info(f"Fetching appointments for veterinarian ID: {requesting_vet_id}")
-        appointments = Appointment.query.filter_by(veterinarianId=requesting_vet_id)\
-                                        .order_by(Appointment.date.desc())\
-                                        .all()
+        fields = APPOINTMENT_FIELDS.parse()
+        query = Appointment.query.filter_by(veterinarianId=requesting_vet_id)\
+                                 .options(*APPOINTMENT_FIELDS.load_options(fields, Appointment.date))
+        page = page_request()
+        if page:
+            appointments, next_cursor = paginate(query, [(Appointment.date, True), (Appointment.id, True)], page, 'appointments')
+        else:
+            appointments = query.order_by(Appointment.date.desc()).all()
 
-        appointments_list = [{
-            "id": appt.id,
-            "horseId": appt.horseId,
-            "veterinarianId": appt.veterinarianId,
-            "date": appt.date.isoformat() if appt.date else None,
-            "lamenessRightFront": appt.lamenessRightFront,
-            "lamenessLeftFront": appt.lamenessLeftFront,
-            "lamenessRightHind": appt.lamenessRightHind,
-            "lamenessLeftHind": appt.lamenessLeftHind,
-            "BPM": appt.BPM,
-            "ECGtime": appt.ECGtime,
-            "muscleTensionFrequency": appt.muscleTensionFrequency,
-            "muscleTensionStiffness": appt.muscleTensionStiffness,
-            "muscleTensionR": appt.muscleTensionR,
-            "CBCpath": _get_cbc_url(appt.CBCpath),
-            "comment": appt.comment,
-        } for appt in appointments]
+        appointments_list = [APPOINTMENT_FIELDS.serialize(appt, fields) for appt in appointments]
+        if page:
+            return jsonify(page_response(appointments_list, next_cursor)), 200
         return jsonify(appointments_list), 200
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e: # Should be caught if Veterinarian.query.get_or_404 was used, but good to have if direct .get is used.
         logger.warning(f"Not found error in get_appointments (requester from token: {requesting_vet_id_str}): {str(e)}")
         return jsonify({"error": str(e)}), 404
@@ -496,27 +516,17 @@ def get_appointments_by_horse(horse_id):
             logger.warning(f"Veterinarian {requesting_vet_id} attempt to access appointments for horse {horse_id} without permission.")
             return jsonify({"error": "Forbidden. You do not have permission to view appointments for this horse."}), 403
 
-        appointments = Appointment.query.filter_by(horseId=horse_id).order_by(Appointment.date.desc()).all()
-
-        appointments_list = [{
-            "id": appt.id,
-            "horseId": appt.horseId,
-            "veterinarianId": appt.veterinarianId,
-            "date": appt.date.isoformat() if appt.date else None,
-            "lamenessRightFront": appt.lamenessRightFront,
-            "lamenessLeftFront": appt.lamenessLeftFront,
-            "lamenessRightHind": appt.lamenessRightHind,
-            "lamenessLeftHind": appt.lamenessLeftHind,
-            "BPM": appt.BPM,
-            "ECGtime": appt.ECGtime,
-            "muscleTensionFrequency": appt.muscleTensionFrequency,
-            "muscleTensionStiffness": appt.muscleTensionStiffness,
-            "muscleTensionR": appt.muscleTensionR,
-            "CBCpath": _get_cbc_url(appt.CBCpath),
-            "comment": appt.comment
-        } for appt in appointments]
+        fields = APPOINTMENT_FIELDS.parse()
+        appointments = Appointment.query.filter_by(horseId=horse_id)\
+                                        .options(*APPOINTMENT_FIELDS.load_options(fields))\
+                                        .order_by(Appointment.date.desc())\
+                                        .all()
+
+        appointments_list = [APPOINTMENT_FIELDS.serialize(appt, fields) for appt in appointments]
         return jsonify(appointments_list), 200
 
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e:
          logger.warning(f"Not found error in get_appointments_by_horse (horse_id: {horse_id}, requester: {requesting_vet_id_str}): {e}")
          return jsonify({"error": str(e)}), 404
@@ -547,27 +557,17 @@ def get_appointments_by_veterinarian(veterinarian_id):
             veterinarian_id,
             description=f"Veterinarian with id {veterinarian_id} not found."
         )
-        appointments = Appointment.query.filter_by(veterinarianId=target_veterinarian.id).order_by(Appointment.date.desc()).all()
-
-        appointments_list = [{
-            "id": appt.id,
-            "horseId": appt.horseId,
-            "veterinarianId": appt.veterinarianId,
-            "date": appt.date.isoformat() if appt.date else None,
-            "lamenessRightFront": appt.lamenessRightFront,
-            "lamenessLeftFront": appt.lamenessLeftFront,
-            "lamenessRightHind": appt.lamenessRightHind,
-            "lamenessLeftHind": appt.lamenessLeftHind,
-            "BPM": appt.BPM,
-            "ECGtime": appt.ECGtime,
-            "muscleTensionFrequency": appt.muscleTensionFrequency,
-            "muscleTensionStiffness": appt.muscleTensionStiffness,
-            "muscleTensionR": appt.muscleTensionR,
-            "CBCpath": _get_cbc_url(appt.CBCpath),
-            "comment": appt.comment
-        } for appt in appointments]
+        fields = APPOINTMENT_FIELDS.parse()
+        appointments = Appointment.query.filter_by(veterinarianId=target_veterinarian.id)\
+                                        .options(*APPOINTMENT_FIELDS.load_options(fields))\
+                                        .order_by(Appointment.date.desc())\
+                                        .all()
+
+        appointments_list = [APPOINTMENT_FIELDS.serialize(appt, fields) for appt in appointments]
         return jsonify(appointments_list), 200
 
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e:
          logger.warning(f"Not found error in get_appointments_by_veterinarian (vet_id: {veterinarian_id}, requester: {requesting_vet_id_str}): {e}")
          return jsonify({"error": str(e)}), 404
@@ -588,7 +588,9 @@ def get_appointment_by_id(appointment_id):
             logger.error(f"Invalid identity type in JWT token for get_appointment_by_id: {requesting_vet_id_str}")
             return jsonify({"error": "Invalid user identity in token"}), 401
 
-        appointment = Appointment.query.get_or_404(appointment_id, description=f"Appointment with id {appointment_id} not found")
+        fields = APPOINTMENT_FIELDS.parse()
+        appointment = Appointment.query.options(*APPOINTMENT_FIELDS.load_options(fields, Appointment.veterinarianId))\
+                                       .get_or_404(appointment_id, description=f"Appointment with id {appointment_id} not found")
 
         # Authorization: Check if the requesting vet is assigned to this appointment
         if appointment.veterinarianId != requesting_vet_id:
@@ -597,23 +599,9 @@ def get_appointment_by_id(appointment_id):
                 f"(owned by {appointment.veterinarianId}) without permission.")
             return jsonify({"error": "Forbidden. You can only access your own appointments."}), 403
 
-        return jsonify({
-            "id": appointment.id,
-            "horseId": appointment.horseId,
-            "veterinarianId": appointment.veterinarianId,
-            "date": appointment.date.isoformat() if appointment.date else None,
-            "lamenessRightFront": appointment.lamenessRightFront,
-            "lamenessLeftFront": appointment.lamenessLeftFront,
-            "lamenessRightHind": appointment.lamenessRightHind,
-            "lamenessLeftHind": appointment.lamenessLeftHind,
-            "BPM": appointment.BPM,
-            "ECGtime": appointment.ECGtime,
-            "muscleTensionFrequency": appointment.muscleTensionFrequency,
-            "muscleTensionStiffness": appointment.muscleTensionStiffness,
-            "muscleTensionR": appointment.muscleTensionR,
-            "CBCpath": _get_cbc_url(appointment.CBCpath),
-            "comment": appointment.comment,
-        }), 200
+        return jsonify(APPOINTMENT_FIELDS.serialize(appointment, fields)), 200
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e:
         logger.warning(f"Not found error in get_appointment_by_id (appt_id: {appointment_id}, requester: {requesting_vet_id_str}): {e}")
         return jsonify({"error": str(e)}), 404
@@ -624,6 +612,7 @@ def get_appointment_by_id(appointment_id):
 
 @appointments_bp.route('/appointment/<int:appointment_id>', methods=['PUT'])
 @jwt_required()
+@upload_limit('CBC_UPLOAD_MAX_BYTES')
 def update_appointment(appointment_id):
     """
     Updates an existing appointment identified by ID in URL.
@@ -759,7 +748,7 @@ def update_appointment(appointment_id):
              }
         }), 200
 
-    except (NotFound, BadRequest, UnsupportedMediaType) as e:
+    except (NotFound, BadRequest, UnsupportedMediaType, RequestEntityTooLarge) as e:
         # db.session.rollback() # Not strictly needed here as commit hasn't happened
         logger.warning(f"Client error updating appointment {appointment_id} (requester: {requesting_vet_id_str}): {e}")
         return jsonify({"error": str(e)}), e.code if hasattr(e, 'code') else 400
@@ -2,6 +2,8 @@ import logging
 from flask import Blueprint, request, jsonify, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from lib.models import Client, ClientHorse, Horse, db, Veterinarian
+from lib.fieldsets import FieldSet
+from lib.pagination import page_request, page_response, paginate
 import phonenumbers
 from email_validator import validate_email, EmailNotValidError
 
@@ -121,6 +123,16 @@ def add_client():
         return jsonify({"error": "An unexpected server error occurred"}), 500
 
 
+# Response keys of a client -> (columns they need, how they are rendered). Used with ?fields=
+CLIENT_FIELDS = FieldSet({
+    "idClient": ((Client.id,), lambda client: client.id),
+    "name": ((Client.name,), lambda client: client.name),
+    "email": ((Client.email,), lambda client: client.email),
+    "phoneNumber": ((Client.phoneNumber,), lambda client: client.phoneNumber),
+    "phoneCountryCode": ((Client.phoneCountryCode,), lambda client: client.phoneCountryCode),
+}, always=("idClient",))
+
+
 @clients_bp.route('/clients', methods=['GET'])
 @jwt_required()
 def get_clients():
@@ -128,6 +140,7 @@ def get_clients():
     Gets a list of clients accessible to the requesting veterinarian.
     A client is accessible if they are associated with a horse managed by the vet
     or by any vet in the vet's hospital.
+    With 'limit' (and 'cursor' from the previous page) returns {"items", "next_cursor"}.
     """
     try:
         current_user_id_str = get_jwt_identity()
@@ -155,24 +168,30 @@ def get_clients():
             own_horses_query = Horse.query.filter_by(veterinarianId=requesting_vet.id).with_entities(Horse.id)
             accessible_horse_ids.update(h[0] for h in own_horses_query.all())
 
+        fields = CLIENT_FIELDS.parse()
+        page = page_request()
         if not accessible_horse_ids:
-            return jsonify([]), 200 # No accessible horses, so no accessible clients via this logic
+            # No accessible horses, so no accessible clients via this logic
+            return jsonify(page_response([], None) if page else []), 200
 
         # Find client_ids associated with these accessible_horse_ids
         client_ids_query = db.session.query(distinct(ClientHorse.clientId)).filter(ClientHorse.horseId.in_(list(accessible_horse_ids)))
         accessible_client_ids = {c[0] for c in client_ids_query.all()}
 
-        clients = Client.query.filter(Client.id.in_(list(accessible_client_ids))).order_by(Client.name).all()
+        query = Client.query.filter(Client.id.in_(list(accessible_client_ids)))\
+                            .options(*CLIENT_FIELDS.load_options(fields, Client.name))
+        if page:
+            clients, next_cursor = paginate(query, [(Client.name, False), (Client.id, False)], page, 'clients')
+        else:
+            clients = query.order_by(Client.name).all()
         
-        clients_list = [{
-            "idClient": client.id,
-            "name": client.name,
-            "email": client.email,
-            "phoneNumber": client.phoneNumber,
-            "phoneCountryCode": client.phoneCountryCode
-        } for client in clients]
+        clients_list = [CLIENT_FIELDS.serialize(client, fields) for client in clients]
+        if page:
+            return jsonify(page_response(clients_list, next_cursor)), 200
         return jsonify(clients_list), 200
 
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.exception(f"Server error getting clients for vet {current_user_id_str}.")
         return jsonify({"error": "An unexpected server error occurred"}), 500
@@ -198,19 +217,17 @@ def get_client_by_id(client_id):
         if not requesting_vet: # Should not happen with a valid token usually
             return jsonify({"error": "Authenticated veterinarian not found"}), 404
 
-        client = Client.query.get_or_404(client_id, description=f"Client with id {client_id} not found.")
+        fields = CLIENT_FIELDS.parse()
+        client = Client.query.options(*CLIENT_FIELDS.load_options(fields))\
+                             .get_or_404(client_id, description=f"Client with id {client_id} not found.")
 
         if not _can_vet_access_client(requesting_vet, client):
             logger.warning(f"Veterinarian {requesting_vet_id} attempt to access client {client_id} without permission.")
             return jsonify({"error": f"Client with id {client_id} not found or access denied."}), 404
 
-        return jsonify({
-                "idClient": client.id,
-                "name": client.name,
-                "email": client.email,
-                "phoneNumber": client.phoneNumber,
-                "phoneCountryCode": client.phoneCountryCode
-            }), 200
+        return jsonify(CLIENT_FIELDS.serialize(client, fields)), 200
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e:
          return jsonify({"error": str(e)}), 404
     except Exception as e: # Catch any other unexpected errors
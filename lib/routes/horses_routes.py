@@ -1,13 +1,20 @@
 import logging
-import os
 from datetime import datetime
-from flask import Blueprint, request, jsonify, url_for
+from flask import Blueprint, current_app, request, jsonify, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType, Unauthorized
+from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge, Unauthorized
 
 from werkzeug.datastructures import FileStorage
+from lib.media.blobs import is_content_addressed
+from lib.media.variants import delete_variants, requested_variant_size, variant_filename
+from lib.media.storage import media_storage, storage_key
+from lib.media.streaming import upload_limit
 from lib.models import Client, ClientHorse, Horse, Veterinarian, db
-from PIL import Image
+from lib.fieldsets import FieldSet
+from lib.media.uploads import (cancel_media_uploads, discard_media_uploads, media_upload_status, queue_media_upload,
+                               register_media_field, register_media_kind, start_media_uploads)
+from lib.pagination import page_request, page_response, paginate
+from lib.trends import trend_cache
 
 from lib.routes.veterinarians_routes import _get_veterinarian_details_for_response
 
@@ -20,98 +27,120 @@ logger = logging.getLogger(__name__)
 
 
 
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-# These are paths from project_root to the actual directories where files are stored
-HORSES_LIMBS_FOLDER = os.path.join('lib','static','horses', 'horse_limbs')
-HORSES_PROFILE_FOLDER = os.path.join('lib','static','horses', 'horse_profile')
+# Storage key prefixes of the horse pictures (folders under lib/static with the local storage backend)
+HORSES_PROFILE_PREFIX = 'horses/horse_profile'
+HORSES_LIMBS_PREFIX = 'horses/horse_limbs'
 
-# Absolute paths for saving/deleting files on the server
-profile_PicturesFolder = os.path.join(project_root, HORSES_PROFILE_FOLDER)
-limbs_PicturesFolder = os.path.join(project_root, HORSES_LIMBS_FOLDER)
 
-# Base paths relative to the static folder, for URL generation
-HORSES_PROFILE_URL_BASE = os.path.join('horses', 'horse_profile')
-HORSES_LIMBS_URL_BASE = os.path.join('horses', 'horse_limbs')
 
-
-os.makedirs(profile_PicturesFolder, exist_ok=True)
-os.makedirs(limbs_PicturesFolder, exist_ok=True)
-logger.info(f"Profile pictures folder: {profile_PicturesFolder}")
-logger.info(f"Limb pictures folder: {limbs_PicturesFolder}")
-
-
-
-def _get_image_url(filename, image_type):
-    """Generates the absolute URL for a horse image."""
+def _get_image_url(filename, image_type, size=None):
+    """
+    Generates the absolute URL for a horse image, or for its downscaled variant when
+    `size` is one of VARIANT_SIZES. A variant that was never generated points to the
+    media route that creates it on first request.
+    """
     if not filename:
         return None
     try:
-        base_url_path = None
         if image_type == 'profile':
-            base_url_path = HORSES_PROFILE_URL_BASE
+            prefix = HORSES_PROFILE_PREFIX
         elif image_type == 'limb':
-            base_url_path = HORSES_LIMBS_URL_BASE
+            prefix = HORSES_LIMBS_PREFIX
         else:
             logger.warning(f"Unknown image_type '{image_type}' requested for filename '{filename}' in _get_image_url.")
             return None
-        
-        # Construct path relative to static folder (e.g., 'horses/horse_profile/image.webp')
-        static_relative_path = os.path.join(base_url_path, filename).replace('\\', '/')
-        return url_for('static', filename=static_relative_path, _external=True)
+
+        if size is not None:
+            # Blobs are always stored with their variants; only older pictures may lack them.
+            # On a remote store those always go through the media route (which generates the
+            # variant if needed and redirects) instead of one HEAD request per picture and size
+            if not is_content_addressed(filename) and (media_storage.is_remote or
+                    not media_storage.exists(storage_key(prefix, variant_filename(filename, size)))):
+                return url_for('media.get_image_variant', kind=image_type, size=size, filename=filename, _external=True)
+            filename = variant_filename(filename, size)
+
+        # Key relative to the media root (e.g., 'horses/horse_profile/image.webp')
+        return media_storage.url(storage_key(prefix, filename))
     except RuntimeError as e:
         logger.error(f"Error generating URL for {filename} (type: {image_type}): {e}")
         return None
 
 
-def _save_horse_image_from_filestorage(image_file: FileStorage, horse_id, image_type_prefix, target_folder):
+def _queue_horse_image_upload(image_file: FileStorage, horse_id, path_attr, image_kind, image_type_prefix):
     """
-    Reads image data from a FileStorage object, saves it as WEBP with a unique name.
-    Returns the generated filename or raises ValueError.
+    Spools an uploaded horse image and queues its WEBP transcoding (see lib/media/uploads.py).
+    It is stored under the hash of its content, so the current picture stays served until
+    the new one is ready. Returns the pending MediaUpload or raises ValueError.
     """
-    if not image_file or not image_file.filename:
-        raise ValueError("Missing image file or filename.")
-
     try:
-
-        unique_filename = f"{horse_id}_{image_type_prefix}.webp"
-        save_path = os.path.join(target_folder, unique_filename)
-
-
-        with Image.open(image_file.stream) as img:
-
-            img.save(save_path, "WEBP", quality=100)
-
-        logger.info(f"Saved image for horse {horse_id} to {save_path}")
-        return unique_filename
-
-    except Exception as e:
-
-        logger.exception(f"Failed to save image for horse {horse_id}, type {image_type_prefix}: {e}")
+        return queue_media_upload(image_file, 'horse', horse_id, path_attr, image_kind)
+    except ValueError as e:
+        logger.warning(f"Rejected image for horse {horse_id}, type {image_type_prefix}: {e}")
         raise ValueError(f"Could not process or save image for {image_type_prefix}. Invalid image format?")
 
 
-def _delete_horse_image(filename, target_folder):
-    """Deletes an image file if it exists."""
+def _delete_horse_image(filename, prefix):
+    """Deletes an image file if it exists. Content-addressed files may be shared and are left to the media GC."""
     if not filename:
         return False
+    if is_content_addressed(filename):
+        return True
+    key = storage_key(prefix, filename)
     try:
-        path = os.path.join(target_folder, filename)
-        if os.path.exists(path):
-            os.remove(path)
-            logger.info(f"Deleted image file: {path}")
+        delete_variants(prefix, filename)
+        if media_storage.delete(key):
+            logger.info(f"Deleted image file: {key}")
             return True
         else:
-            logger.warning(f"Attempted to delete non-existent image file: {path}")
+            logger.warning(f"Attempted to delete non-existent image file: {key}")
             return False
-    except OSError as e:
-        logger.error(f"Error deleting image file {path}: {e}")
+    except Exception as e:
+        logger.error(f"Error deleting image file {key}: {e}")
         return False
 
 
+register_media_kind('profile', HORSES_PROFILE_PREFIX, lambda filename: _get_image_url(filename, 'profile'))
+register_media_kind('limb', HORSES_LIMBS_PREFIX, lambda filename: _get_image_url(filename, 'limb'))
+register_media_field('horse', 'profilePicturePath', 'profile')
+for _limb_column in ('pictureRightFrontPath', 'pictureLeftFrontPath', 'pictureRightHindPath', 'pictureLeftHindPath'):
+    register_media_field('horse', _limb_column, 'limb')
+
+
+def _picture_uploads_response(uploads):
+    """Upload state per picture column, plus where to poll it while pending."""
+    response = {}
+    for path_attr, upload in uploads.items():
+        state = media_upload_status(upload)
+        state["statusUrl"] = url_for('media.get_media_upload_status', upload_id=upload.id, _external=True)
+        response[path_attr] = state
+    return response
+
+
+# Response keys of a horse -> (columns they need, how they are rendered). Used with ?fields=
+# Picture URLs point to the ?imageSize= variant (128, 512 or original)
+HORSE_FIELDS = FieldSet({
+    "idHorse": ((Horse.id,), lambda horse: horse.id),
+    "name": ((Horse.name,), lambda horse: horse.name),
+    "profilePicturePath": ((Horse.profilePicturePath,), lambda horse: _get_image_url(horse.profilePicturePath, 'profile', requested_variant_size())),
+    "birthDate": ((Horse.birthDate,), lambda horse: horse.birthDate.isoformat() if horse.birthDate else None),
+    "veterinarian": ((Horse.veterinarianId,), lambda horse: _get_veterinarian_details_for_response(horse.veterinarianId)),
+    "pictureRightFrontPath": ((Horse.pictureRightFrontPath,), lambda horse: _get_image_url(horse.pictureRightFrontPath, 'limb', requested_variant_size())),
+    "pictureLeftFrontPath": ((Horse.pictureLeftFrontPath,), lambda horse: _get_image_url(horse.pictureLeftFrontPath, 'limb', requested_variant_size())),
+    "pictureRightHindPath": ((Horse.pictureRightHindPath,), lambda horse: _get_image_url(horse.pictureRightHindPath, 'limb', requested_variant_size())),
+    "pictureLeftHindPath": ((Horse.pictureLeftHindPath,), lambda horse: _get_image_url(horse.pictureLeftHindPath, 'limb', requested_variant_size())),
+}, always=("idHorse",))
+# The detail endpoint has never included the owning veterinarian
+HORSE_DETAIL_FIELDS = tuple(key for key in HORSE_FIELDS.fields if key != "veterinarian")
+
+
 @horses_bp.route('/horses', methods=['GET'])
 @jwt_required()
 def get_horses():
-    """Gets a list of all horses with image URLs. (Uses JSON response)"""
+    """
+    Gets a list of all horses with image URLs. (Uses JSON response)
+    With 'limit' (and 'cursor' from the previous page) returns {"items", "next_cursor"}.
+    'imageSize=128' (or 512) returns the URLs of the downscaled pictures, e.g. for avatars.
+    """
     try:
         current_user_id = get_jwt_identity()
         try:
@@ -138,21 +167,21 @@ def get_horses():
             logger.info(f"Veterinarian {vet_id} does not belong to a hospital. Fetching only their horses.")
             query = query.filter_by(veterinarianId=vet_id)
 
-        horses = query.order_by(Horse.name).all()
-        horses_list = [{
-            "idHorse": horse.id,
-            "name": horse.name,
-            "profilePicturePath": _get_image_url(horse.profilePicturePath, 'profile'),
-            "birthDate": horse.birthDate.isoformat() if horse.birthDate else None,
-            "veterinarian": _get_veterinarian_details_for_response(horse.veterinarianId),
-            "pictureRightFrontPath": _get_image_url(horse.pictureRightFrontPath, 'limb'),
-            "pictureLeftFrontPath": _get_image_url(horse.pictureLeftFrontPath, 'limb'),
-            "pictureRightHindPath": _get_image_url(horse.pictureRightHindPath, 'limb'),
-            "pictureLeftHindPath": _get_image_url(horse.pictureLeftHindPath, 'limb')
-        } for horse in horses]
+        fields = HORSE_FIELDS.parse()
+        query = query.options(*HORSE_FIELDS.load_options(fields, Horse.name))
+        page = page_request()
+        if page:
+            horses, next_cursor = paginate(query, [(Horse.name, False), (Horse.id, False)], page, 'horses')
+        else:
+            horses = query.order_by(Horse.name).all()
+        horses_list = [HORSE_FIELDS.serialize(horse, fields) for horse in horses]
 
+        if page:
+            return jsonify(page_response(horses_list, next_cursor)), 200
         return jsonify(horses_list), 200
 
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.exception("Server error getting all horses.")
         return jsonify({"error": "An unexpected server error occurred"}), 500
@@ -176,7 +205,9 @@ def get_horse_by_id(horse_id):
             # Return 404 to obscure that the vet doesn't exist vs horse doesn't exist for this vet
             return jsonify({"error": f"Horse with id {horse_id} not found."}), 404
 
-        horse = Horse.query.get_or_404(horse_id, description=f"Horse with id {horse_id} not found.")
+        fields = HORSE_FIELDS.parse(HORSE_DETAIL_FIELDS)
+        horse = Horse.query.options(*HORSE_FIELDS.load_options(fields, Horse.veterinarianId))\
+                           .get_or_404(horse_id, description=f"Horse with id {horse_id} not found.")
 
         # Check access permissions
         can_access = False
@@ -191,16 +222,9 @@ def get_horse_by_id(horse_id):
             logger.warning(f"Veterinarian {current_vet_id} attempted to access horse {horse_id} without permission.")
             return jsonify({"error": f"404 Not Found: Horse with id {horse_id} not found."}), 404 # Obscure permission denial
 
-        return jsonify({
-            "idHorse": horse.id,
-            "name": horse.name,
-            "profilePicturePath": _get_image_url(horse.profilePicturePath, 'profile'),
-            "birthDate": horse.birthDate.isoformat() if horse.birthDate else None,
-            "pictureRightFrontPath": _get_image_url(horse.pictureRightFrontPath, 'limb'),
-            "pictureLeftFrontPath": _get_image_url(horse.pictureLeftFrontPath, 'limb'),
-            "pictureRightHindPath": _get_image_url(horse.pictureRightHindPath, 'limb'),
-            "pictureLeftHindPath": _get_image_url(horse.pictureLeftHindPath, 'limb')
-        }), 200
+        return jsonify(HORSE_FIELDS.serialize(horse, fields)), 200
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e:
 
         return jsonify({"error": str(e)}), 404
@@ -208,8 +232,60 @@ def get_horse_by_id(horse_id):
         logger.exception(f"Server error getting horse {horse_id}.")
         return jsonify({"error": "An unexpected server error occurred"}), 500
 
+@horses_bp.route('/horse/<int:horse_id>/trends', methods=['GET'])
+@jwt_required()
+def get_horse_trends(horse_id):
+    """
+    Body weight / BCS trends of a horse, computed server-side from its measures.
+    Query args: 'maxPoints' (points per series after LTTB downsampling, default
+    TRENDS_DEFAULT_MAX_POINTS) and 'window' (measures in the rolling mean, default
+    TRENDS_ROLLING_WINDOW). Returns the user and algorithm BW/BCS series with rolling
+    means and slopes, plus the user-vs-algorithm deltas.
+    """
+    try:
+        current_user_id = get_jwt_identity()
+        try:
+            current_vet_id = int(current_user_id)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid identity type in JWT token for get_horse_trends: {current_user_id}")
+            return jsonify({"error": "Invalid user identity in token"}), 401
+
+        current_veterinarian = Veterinarian.query.get(current_vet_id)
+        if not current_veterinarian:
+            logger.warning(f"Veterinarian with ID {current_vet_id} from token not found (in get_horse_trends).")
+            return jsonify({"error": f"Horse with id {horse_id} not found."}), 404
+
+        horse = Horse.query.get_or_404(horse_id, description=f"Horse with id {horse_id} not found.")
+
+        can_access = False
+        if horse.veterinarianId == current_vet_id:
+            can_access = True
+        elif current_veterinarian.hospitalId is not None:
+            if horse.veterinarian and horse.veterinarian.hospitalId == current_veterinarian.hospitalId:
+                can_access = True
+
+        if not can_access:
+            logger.warning(f"Veterinarian {current_vet_id} attempted to access trends of horse {horse_id} without permission.")
+            return jsonify({"error": f"Horse with id {horse_id} not found."}), 404 # Obscure permission denial
+
+        max_points = request.args.get('maxPoints', type=int, default=current_app.config.get('TRENDS_DEFAULT_MAX_POINTS', 200))
+        window = request.args.get('window', type=int, default=current_app.config.get('TRENDS_ROLLING_WINDOW', 5))
+        if max_points is None or not 3 <= max_points <= 5000:
+            raise BadRequest("'maxPoints' must be an integer between 3 and 5000.")
+        if window is None or not 1 <= window <= 365:
+            raise BadRequest("'window' must be an integer between 1 and 365.")
+
+        return jsonify(trend_cache.get_or_compute(horse.id, window, max_points)), 200
+
+    except (BadRequest, NotFound) as e:
+        return jsonify({"error": str(e)}), e.code
+    except Exception as e:
+        logger.exception(f"Server error getting trends for horse {horse_id}.")
+        return jsonify({"error": "An unexpected server error occurred"}), 500
+
 @horses_bp.route('/horse/<int:horse_id>', methods=['PUT'])
 @jwt_required()
+@upload_limit('HORSE_UPLOAD_MAX_BYTES')
 def update_horse(horse_id):
     """
     Handles PUT for a single horse identified by ID in URL.
@@ -281,14 +357,15 @@ def update_horse(horse_id):
 
 
         image_fields_map = {
-            'profilePicture': ('profilePicturePath', profile_PicturesFolder, 'profile'),
-            'pictureRightFront': ('pictureRightFrontPath', limbs_PicturesFolder, 'right_front'),
-            'pictureLeftFront': ('pictureLeftFrontPath', limbs_PicturesFolder, 'left_front'),
-            'pictureRightHind': ('pictureRightHindPath', limbs_PicturesFolder, 'right_hind'),
-            'pictureLeftHind': ('pictureLeftHindPath', limbs_PicturesFolder, 'left_hind'),
+            'profilePicture': ('profilePicturePath', HORSES_PROFILE_PREFIX, 'profile', 'profile'),
+            'pictureRightFront': ('pictureRightFrontPath', HORSES_LIMBS_PREFIX, 'limb', 'right_front'),
+            'pictureLeftFront': ('pictureLeftFrontPath', HORSES_LIMBS_PREFIX, 'limb', 'left_front'),
+            'pictureRightHind': ('pictureRightHindPath', HORSES_LIMBS_PREFIX, 'limb', 'right_hind'),
+            'pictureLeftHind': ('pictureLeftHindPath', HORSES_LIMBS_PREFIX, 'limb', 'left_hind'),
         }
 
-        for form_key, (path_attr, folder, type_prefix) in image_fields_map.items():
+        uploads = {}
+        for form_key, (path_attr, prefix, image_kind, type_prefix) in image_fields_map.items():
             image_file = request.files.get(form_key)
             remove_flag_key = f"remove_{form_key}"
             remove_flag = request.form.get(remove_flag_key, 'false').lower() == 'true'
@@ -296,24 +373,17 @@ def update_horse(horse_id):
 
             if image_file:
                 try:
-
-                    new_filename = _save_horse_image_from_filestorage(image_file, horse.id, type_prefix, folder)
-                    
-
-
-
-                    if old_filename and old_filename != new_filename:
-                        _delete_horse_image(old_filename, folder)
-                    
-
-                    setattr(horse, path_attr, new_filename)
+                    # The column switches to the new file (and the old one is deleted) once it is transcoded
+                    uploads[path_attr] = _queue_horse_image_upload(image_file, horse.id, path_attr, image_kind, type_prefix)
                     updated = True
                 except ValueError as e:
+                    discard_media_uploads(uploads.values())
                     raise BadRequest(str(e))
 
             elif remove_flag:
+                cancel_media_uploads('horse', horse.id, path_attr)
                 if old_filename:
-                    if _delete_horse_image(old_filename, folder):
+                    if _delete_horse_image(old_filename, prefix):
                         setattr(horse, path_attr, None)
                         updated = True
                     else:
@@ -323,10 +393,17 @@ def update_horse(horse_id):
         if not updated:
             return jsonify({"message": "No fields provided or values unchanged."}), 200
 
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            discard_media_uploads(uploads.values())
+            raise
+        start_media_uploads(uploads.values())
+        if uploads:
+            db.session.refresh(horse)
         logger.info(f"Horse {horse_id} updated.")
 
-        return jsonify({
+        response_body = {
             "idHorse": horse.id,
             "name": horse.name,
             "profilePicturePath": _get_image_url(horse.profilePicturePath, 'profile'),
@@ -335,9 +412,12 @@ def update_horse(horse_id):
             "pictureLeftFrontPath": _get_image_url(horse.pictureLeftFrontPath, 'limb'),
             "pictureRightHindPath": _get_image_url(horse.pictureRightHindPath, 'limb'),
             "pictureLeftHindPath": _get_image_url(horse.pictureLeftHindPath, 'limb')
-        }), 200
+        }
+        if uploads:
+            response_body["pictureUploads"] = _picture_uploads_response(uploads)
+        return jsonify(response_body), 200
 
-    except (NotFound, BadRequest, UnsupportedMediaType) as e:
+    except (NotFound, BadRequest, UnsupportedMediaType, RequestEntityTooLarge) as e:
          db.session.rollback()
          logger.warning(f"Client error updating horse {horse_id}: {e}")
          return jsonify({"error": str(e)}), e.code if hasattr(e, 'code') else 400
@@ -380,20 +460,22 @@ def delete_horse(horse_id):
 
 
         filenames_to_delete = [
-            (horse.profilePicturePath, profile_PicturesFolder),
-            (horse.pictureRightFrontPath, limbs_PicturesFolder),
-            (horse.pictureLeftFrontPath, limbs_PicturesFolder),
-            (horse.pictureRightHindPath, limbs_PicturesFolder),
-            (horse.pictureLeftHindPath, limbs_PicturesFolder),
+            (horse.profilePicturePath, HORSES_PROFILE_PREFIX),
+            (horse.pictureRightFrontPath, HORSES_LIMBS_PREFIX),
+            (horse.pictureLeftFrontPath, HORSES_LIMBS_PREFIX),
+            (horse.pictureRightHindPath, HORSES_LIMBS_PREFIX),
+            (horse.pictureLeftHindPath, HORSES_LIMBS_PREFIX),
         ]
 
+        cancel_media_uploads('horse', horse_id)
         db.session.delete(horse)
         db.session.commit()
+        trend_cache.invalidate(horse_id)
         logger.info(f"Horse {horse_id} deleted from database.")
 
 
-        for filename, folder in filenames_to_delete:
-            _delete_horse_image(filename, folder)
+        for filename, prefix in filenames_to_delete:
+            _delete_horse_image(filename, prefix)
 
         return jsonify({"message": "Horse deleted successfully"}), 200
 
@@ -407,6 +489,7 @@ def delete_horse(horse_id):
 
 @horses_bp.route('/horse', methods=['POST'])
 @jwt_required()
+@upload_limit('HORSE_UPLOAD_MAX_BYTES')
 def add_horse():
     """
     Adds a new horse. Expects multipart/form-data.
@@ -454,39 +537,44 @@ def add_horse():
         logger.info(f"Horse object created with temporary ID {horse.id}")
 
 
-        image_fields_to_save = {}
+        uploads = {}
         image_fields_map = {
-            'profilePicture': ('profilePicturePath', profile_PicturesFolder, 'profile'),
-            'pictureRightFront': ('pictureRightFrontPath', limbs_PicturesFolder, 'right_front'),
-            'pictureLeftFront': ('pictureLeftFrontPath', limbs_PicturesFolder, 'left_front'),
-            'pictureRightHind': ('pictureRightHindPath', limbs_PicturesFolder, 'right_hind'),
-            'pictureLeftHind': ('pictureLeftHindPath', limbs_PicturesFolder, 'left_hind'),
+            'profilePicture': ('profilePicturePath', HORSES_PROFILE_PREFIX, 'profile', 'profile'),
+            'pictureRightFront': ('pictureRightFrontPath', HORSES_LIMBS_PREFIX, 'limb', 'right_front'),
+            'pictureLeftFront': ('pictureLeftFrontPath', HORSES_LIMBS_PREFIX, 'limb', 'left_front'),
+            'pictureRightHind': ('pictureRightHindPath', HORSES_LIMBS_PREFIX, 'limb', 'right_hind'),
+            'pictureLeftHind': ('pictureLeftHindPath', HORSES_LIMBS_PREFIX, 'limb', 'left_hind'),
         }
 
-        for form_key, (path_attr, folder, type_prefix) in image_fields_map.items():
+        # The picture columns are filled in by the transcoding pool once each WEBP is ready
+        for form_key, (path_attr, prefix, image_kind, type_prefix) in image_fields_map.items():
              image_file = request.files.get(form_key)
              if image_file:
                  try:
-                     saved_filename = _save_horse_image_from_filestorage(image_file, horse.id, type_prefix, folder)
-                     image_fields_to_save[path_attr] = saved_filename
+                     uploads[path_attr] = _queue_horse_image_upload(image_file, horse.id, path_attr, image_kind, type_prefix)
                  except ValueError as e:
+                     discard_media_uploads(uploads.values())
                      db.session.rollback()
                      raise BadRequest(str(e))
                  except Exception as e:
+                     discard_media_uploads(uploads.values())
                      db.session.rollback()
                      logger.exception(f"Unexpected error saving {type_prefix} image for new horse.")
                      raise Exception(f"Failed to process {type_prefix} image.")
 
 
-        for attr, filename in image_fields_to_save.items():
-            setattr(horse, attr, filename)
-
-
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            discard_media_uploads(uploads.values())
+            raise
+        start_media_uploads(uploads.values())
+        if uploads:
+            db.session.refresh(horse)
         logger.info(f"Horse {horse.id} created and committed successfully.")
 
 
-        return jsonify({
+        response_body = {
             "idHorse": horse.id,
             "name": horse.name,
             "profilePicturePath": _get_image_url(horse.profilePicturePath, 'profile'),
@@ -497,9 +585,12 @@ def add_horse():
             "pictureLeftFrontPath": _get_image_url(horse.pictureLeftFrontPath, 'limb'),
             "pictureRightHindPath": _get_image_url(horse.pictureRightHindPath, 'limb'),
             "pictureLeftHindPath": _get_image_url(horse.pictureLeftHindPath, 'limb')
-        }), 201
+        }
+        if uploads:
+            response_body["pictureUploads"] = _picture_uploads_response(uploads)
+        return jsonify(response_body), 201
 
-    except (BadRequest, NotFound, UnsupportedMediaType) as e:
+    except (BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge) as e:
         db.session.rollback() # Rollback changes if any part of the process failed
         logger.warning(f"Client error adding horse: {e}")
         return jsonify({"error": str(e)}), e.code if hasattr(e, 'code') else 400
@@ -1,5 +1,5 @@
 from email_validator import EmailNotValidError
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from email_validator import validate_email, EmailNotValidError
 from zxcvbn import zxcvbn
 from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token
@@ -7,6 +7,7 @@ import phonenumbers
 from lib.models import Veterinarian, db, Hospital 
 from werkzeug.exceptions import NotFound, BadRequest, UnsupportedMediaType
 import requests # For calling the predict service
+from lib.prediction.client import prediction_client
 from sqlalchemy.exc import SQLAlchemyError # For DB connection errors
 
 import logging # Import standard logging
@@ -216,12 +217,12 @@ def change_password():
 
 @login_bp.route('/health')
 def health_check():
-    #predict_service_url = "http://iequus_predict:9091/health" # As defined in docker-compose and predict app - For Docker container
-    predict_service_url = "http://localhost:9091/health" # As defined in docker-compose and predict app
+    predict_service_url = current_app.config.get('PREDICTION_HEALTH_URL', "http://localhost:9091/health")
 
     status = {
         "database": "unavailable",
         "predict_service": "unavailable",
+        "predict_service_circuit": prediction_client.breaker.snapshot()["state"],
         "overall_status": "unhealthy"
     }
     http_status_code = 503  # Service Unavailable by default
@@ -240,7 +241,7 @@ def health_check():
         
     # Check predict service connectivity
     try:
-        response = requests.get(predict_service_url, timeout=5) 
+        response = prediction_client.get(predict_service_url, timeout=(prediction_client.connect_timeout, 5))
         if response.status_code == 200 and response.text.strip().upper() == "OK":
             status["predict_service"] = "ok"
             logger.debug("Health check: Predict service connection successful.")
@@ -1,183 +1,351 @@
 import logging
-import os
-import uuid
 import json
+import numpy as np
 import requests # Import the requests library
 from datetime import datetime
 
-from flask import Blueprint, jsonify, request, url_for
+from flask import Blueprint, current_app, jsonify, request, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from lib.coordinates import coordinates_array, coordinates_changed, coordinates_values, pack_coordinates
+from lib.fieldsets import FieldSet
+from lib.media.uploads import (cancel_media_uploads, discard_media_uploads, media_upload_status, queue_media_upload,
+                               register_media_field, register_media_kind, start_media_uploads)
+from lib.media.blobs import is_content_addressed
+from lib.media.storage import media_storage, storage_key
+from lib.media.variants import delete_variants, requested_variant_size, variant_filename
+from lib.media.streaming import upload_limit
 from lib.models import Appointment, Horse, Measure, Veterinarian, db
-from PIL import Image
-from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType
+from lib.pagination import page_request, page_response, paginate
+from lib.prediction.cache import prediction_cache
+from lib.prediction.engine import prediction_engine
+from lib.trends import trend_cache
+from lib.workers import PoolFull, measure_scoring_pool
+from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
 measures_bp = Blueprint('measures', __name__)
 
-# Configuration for the external prediction API
-#PREDICTION_API_URL = "http://iequus_predict:9091/predict" #Docker container
-PREDICTION_API_URL = "http://localhost:9091/predict"
-
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-STATIC_FOLDER_REL = os.path.join('lib', 'static')
-MEASURES_FOLDER_REL = os.path.join(STATIC_FOLDER_REL, 'measures')
-
-
-measures_PicturesFolder = os.path.join(project_root, MEASURES_FOLDER_REL)
+# Storage key prefix of the measure pictures (a folder under lib/static with the local storage backend)
+MEASURES_PREFIX = 'measures'
 
-os.makedirs(measures_PicturesFolder, exist_ok=True)
-logger.info(f"Measures pictures folder: {measures_PicturesFolder}")
-
-def _get_measure_image_url(filename):
-    """Generates the absolute URL for a measure image."""
+def _get_measure_image_url(filename, size=None):
+    """
+    Generates the absolute URL for a measure image, or for its downscaled variant when
+    `size` is one of VARIANT_SIZES (generated on first request when missing).
+    """
     if not filename:
         return None
     try:
-
-        relative_path = os.path.join('measures', filename).replace('\\', '/')
-        return url_for('static', filename=relative_path, _external=True)
+        if size is not None:
+            # Blobs are always stored with their variants; only older pictures may lack them.
+            # On a remote store those always go through the media route (which generates the
+            # variant if needed and redirects) instead of one HEAD request per picture and size
+            if not is_content_addressed(filename) and (media_storage.is_remote or
+                    not media_storage.exists(storage_key(MEASURES_PREFIX, variant_filename(filename, size)))):
+                return url_for('media.get_image_variant', kind='measure', size=size, filename=filename, _external=True)
+            filename = variant_filename(filename, size)
+
+        return media_storage.url(storage_key(MEASURES_PREFIX, filename))
     except RuntimeError as e:
         logger.error(f"Error generating URL for measure image {filename}: {e}")
         return None
 
 
-def _save_measure_image_from_filestorage(image_file: FileStorage, measure_id, horse_id):
+def _queue_measure_image_upload(image_file: FileStorage, measure_id, horse_id):
     """
-    Reads image data from a FileStorage object, saves it (e.g., as WEBP) with a unique name.
-    Returns the generated filename or raises ValueError.
+    Spools an uploaded measure picture and queues its WEBP transcoding, stored under the
+    hash of its content (see lib/media/uploads.py). Returns the pending MediaUpload or raises ValueError.
     """
-    if not image_file or not image_file.filename:
-        raise ValueError("Missing image file or filename.")
-
     try:
-
-        unique_filename = f"{measure_id}_measure_{horse_id}_horseId_{uuid.uuid4()}.webp"
-        save_path = os.path.join(measures_PicturesFolder, unique_filename)
-
-
-        with Image.open(image_file.stream) as img:
-
-            img.save(save_path, "WEBP", quality=85)
-
-        logger.info(f"Saved image for measure {measure_id} to {save_path}")
-        return unique_filename
-
-    except Exception as e:
-        logger.exception(f"Failed to save image for measure {measure_id}: {e}")
+        return queue_media_upload(image_file, 'measure', measure_id, 'picturePath', 'measure')
+    except ValueError as e:
+        logger.warning(f"Rejected image for measure {measure_id}: {e}")
         raise ValueError("Could not process or save measure image. Invalid format?")
 
 
 def _delete_measure_image(filename):
-    """Deletes a measure image file if it exists."""
+    """Deletes a measure image file if it exists. Content-addressed files may be shared and are left to the media GC."""
     if not filename:
         return False
+    if is_content_addressed(filename):
+        return True
+    key = storage_key(MEASURES_PREFIX, filename)
     try:
-        path = os.path.join(measures_PicturesFolder, filename)
-        if os.path.exists(path):
-            os.remove(path)
-            logger.info(f"Deleted measure image file: {path}")
+        delete_variants(MEASURES_PREFIX, filename)
+        if media_storage.delete(key):
+            logger.info(f"Deleted measure image file: {key}")
             return True
         else:
-            logger.warning(f"Attempted to delete non-existent measure image file: {path}")
+            logger.warning(f"Attempted to delete non-existent measure image file: {key}")
             return False
-    except OSError as e:
-        logger.error(f"Error deleting measure image file {path}: {e}")
+    except Exception as e:
+        logger.error(f"Error deleting measure image file {key}: {e}")
         return False
 
 
+register_media_kind('measure', MEASURES_PREFIX, _get_measure_image_url)
+register_media_field('measure', 'picturePath', 'measure')
+
+
+def _picture_upload_response(upload):
+    state = media_upload_status(upload)
+    state["statusUrl"] = url_for('media.get_media_upload_status', upload_id=upload.id, _external=True)
+    return state
+
+
+# Response keys of a measure -> (columns they need, how they are rendered). Used with ?fields=
+# picturePath points to the ?imageSize= variant (128, 512 or original)
+MEASURE_FIELDS = FieldSet({
+    'id': ((Measure.id,), lambda measure: measure.id),
+    'horseId': ((Measure.horseId,), lambda measure: measure.horseId),
+    'date': ((Measure.date,), lambda measure: measure.date.isoformat()),
+    'veterinarianId': ((Measure.veterinarianId,), lambda measure: measure.veterinarianId),
+    'appointmentId': ((Measure.appointmentId,), lambda measure: measure.appointmentId),
+    'coordinates': ((Measure.coordinates,), lambda measure: measure.coordinates),
+    'userBW': ((Measure.userBW,), lambda measure: measure.userBW),
+    'userBCS': ((Measure.userBCS,), lambda measure: measure.userBCS),
+    'algorithmBW': ((Measure.algorithmBW,), lambda measure: measure.algorithmBW),
+    'algorithmBCS': ((Measure.algorithmBCS,), lambda measure: measure.algorithmBCS),
+    'predictionStatus': ((Measure.predictionStatus,), lambda measure: measure.predictionStatus),
+    'modelVersion': ((Measure.modelVersion,), lambda measure: measure.modelVersion),
+    'favorite': ((Measure.favorite,), lambda measure: measure.favorite),
+    'picturePath': ((Measure.picturePath,), lambda measure: _get_measure_image_url(measure.picturePath, requested_variant_size())),
+}, always=('id',))
+# Keys the list endpoints return when no ?fields= is given
+MEASURE_LIST_FIELDS = ('id', 'horseId', 'date', 'veterinarianId', 'appointmentId', 'coordinates', 'userBW', 'userBCS',
+                       'algorithmBW', 'algorithmBCS', 'favorite', 'picturePath')
+
+
+def _is_complete_prediction(prediction_data):
+    return isinstance(prediction_data, dict) and prediction_data.get('bcs') is not None and prediction_data.get('bw') is not None
+
+
+def _prediction_result(prediction_data):
+    """Converts a {'bcs', 'bw'} prediction into the forward_coordinates() result format."""
+    if not _is_complete_prediction(prediction_data):
+        error_message = "Prediction API response missing 'bcs' or 'bw' key."
+        logger.error(f"{error_message} Response: {prediction_data}")
+        return {'algorithmBW': None, 'algorithmBCS': None, 'error': error_message}
+
+    try:
+        # Ensure they are floats if present
+        algo_bcs = float(prediction_data['bcs'])
+        algo_bw = float(prediction_data['bw'])
+    except (ValueError, TypeError) as e:
+        error_message = f"Error processing prediction API response: {e}"
+        logger.error(error_message)
+        return {'algorithmBW': None, 'algorithmBCS': None, 'error': error_message}
+
+    logger.info(f"Successfully received prediction from API: BCS={algo_bcs}, BW={algo_bw}")
+    return {'algorithmBW': algo_bw, 'algorithmBCS': algo_bcs}
+
+
+def _prediction_error_message(e):
+    """Describes an exception raised while calling the prediction backend."""
+    if isinstance(e, requests.exceptions.HTTPError):
+        return f"Prediction API returned an error: {e.response.status_code} - {e.response.text}"
+    if isinstance(e, requests.exceptions.RequestException): # Catches connection errors, timeouts, etc.
+        return f"Error calling prediction API: {e}"
+    if isinstance(e, (json.JSONDecodeError, ValueError)): # Error parsing JSON or converting to float
+        return f"Error processing prediction API response: {e}"
+    return f"Unexpected error during prediction API call: {e}"
+
+
 def forward_coordinates(coordinates_list_of_dicts):
     """
     Processes coordinates to get algorithm-derived body weight and body condition score
-    by calling an external prediction API.
+    using the configured prediction backend: the external prediction API (through the
+    dispatcher, which batches concurrent requests) or the in-process model.
+    Calls go through the prediction cache, so an already scored coordinate set is not scored again.
 
     Args:
         coordinates_list_of_dicts (list): A list of dictionaries,
                                           e.g., [{'x': x1, 'y': y1}, ..., {'x': x14, 'y': y14}].
-                                          Expected to contain 14 points.
+                                          Expected to contain 14 points. An array of the 28 values
+                                          (Measure.coordinatesArray) is accepted too.
     Returns:
         dict: A dictionary with 'algorithmBW' (float or None), 'algorithmBCS' (float or None),
               and optionally 'error' (str).
     """
-    logger.info(f"Attempting to process coordinates: {coordinates_list_of_dicts}")
-    algo_bw = None
-    algo_bcs = None
-    error_message = None
+    if isinstance(coordinates_list_of_dicts, np.ndarray):
+        # Already validated, e.g. Measure.coordinatesArray
+        flat_coordinates = coordinates_values(coordinates_list_of_dicts)
+    else:
+        logger.info(f"Attempting to process coordinates: {coordinates_list_of_dicts}")
 
-    if not coordinates_list_of_dicts or not isinstance(coordinates_list_of_dicts, list):
-        logger.info("No coordinates provided or not in list format.")
-        return {'algorithmBW': algo_bw, 'algorithmBCS': algo_bcs}
-
-    flat_coordinates = []
-    for i, point_dict in enumerate(coordinates_list_of_dicts):
-        if isinstance(point_dict, dict) and 'x' in point_dict and 'y' in point_dict:
-            try:
-                flat_coordinates.append(float(point_dict['x']))
-                flat_coordinates.append(float(point_dict['y']))
-            except (ValueError, TypeError) as e:
-                error_message = f"Invalid coordinate value for point {i}: {point_dict}. Error: {e}"
-                logger.error(error_message)
-                return {'algorithmBW': algo_bw, 'algorithmBCS': None, 'error': error_message}
-        else:
-            error_message = f"Malformed coordinate entry at index {i}: {point_dict}. Expected dict with 'x' and 'y'."
-            logger.error(error_message)
-            return {'algorithmBW': algo_bw, 'algorithmBCS': None, 'error': error_message}
+        if not coordinates_list_of_dicts or not isinstance(coordinates_list_of_dicts, list):
+            logger.info("No coordinates provided or not in list format.")
+            return {'algorithmBW': None, 'algorithmBCS': None}
 
-    if len(flat_coordinates) == 28: # Expect 14 points * 2 coordinates each
-        logger.info(f"Sending {len(flat_coordinates)} coordinates to prediction API: {PREDICTION_API_URL}")
         try:
-            payload = {"values": flat_coordinates}
-            response = requests.post(PREDICTION_API_URL, json=payload, timeout=10) # 10 second timeout
-            response.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
-            
-            prediction_data = response.json()
-            algo_bcs = prediction_data.get('bcs')
-            algo_bw = prediction_data.get('bw')
-
-            if algo_bcs is None or algo_bw is None:
-                error_message = "Prediction API response missing 'bcs' or 'bw' key."
-                logger.error(f"{error_message} Response: {prediction_data}")
-                algo_bcs = None # Ensure they are None if keys are missing
-                algo_bw = None
-            else:
-                # Ensure they are floats if present
-                algo_bcs = float(algo_bcs) if algo_bcs is not None else None
-                algo_bw = float(algo_bw) if algo_bw is not None else None
-                logger.info(f"Successfully received prediction from API: BCS={algo_bcs}, BW={algo_bw}")
+            flat_coordinates = coordinates_array(coordinates_list_of_dicts).tolist()
+        except ValueError as e:
+            error_message = str(e)
+            logger.warning(error_message)
+            return {'algorithmBW': None, 'algorithmBCS': None, 'error': error_message}
 
-        except requests.exceptions.HTTPError as e:
-            error_message = f"Prediction API returned an error: {e.response.status_code} - {e.response.text}"
-            logger.error(error_message)
-        except requests.exceptions.RequestException as e: # Catches connection errors, timeouts, etc.
-            error_message = f"Error calling prediction API: {e}"
-            logger.error(error_message)
-        except (json.JSONDecodeError, ValueError) as e: # Error parsing JSON or converting to float
-            error_message = f"Error processing prediction API response: {e}"
+    logger.info(f"Sending {len(flat_coordinates)} coordinates to the '{prediction_engine.name}' prediction backend")
+    try:
+        # Raises an HTTPError for bad responses (4XX or 5XX), same as a direct requests.post
+        prediction_data = prediction_cache.get_or_compute(
+            flat_coordinates,
+            prediction_engine.predict,
+            cacheable=_is_complete_prediction
+        )
+    except Exception as e:
+        error_message = _prediction_error_message(e)
+        if isinstance(e, requests.exceptions.RequestException):
             logger.error(error_message)
-        except Exception as e:
-            error_message = f"Unexpected error during prediction API call: {e}"
+        else:
             logger.exception(error_message) # Use logger.exception to include stack trace
-    elif len(flat_coordinates) > 0:
-        error_message = f"Expected 28 coordinate values (14 pairs), but received {len(flat_coordinates)} from {len(coordinates_list_of_dicts)} points."
-        logger.warning(error_message)
-    else: # flat_coordinates is empty, meaning coordinates_list_of_dicts was empty or malformed early
-        logger.info("No valid coordinates to process for BCS.")
+        return {'algorithmBW': None, 'algorithmBCS': None, 'error': error_message}
 
-    result = {'algorithmBW': algo_bw, 'algorithmBCS': algo_bcs}
-    if error_message:
-        result['error'] = error_message
+    return _prediction_result(prediction_data)
 
-    return result
+
+def forward_coordinates_many(coordinate_sets):
+    """
+    Batch variant of forward_coordinates() for many measures at once. Each item is a
+    list of {'x', 'y'} dicts or an array of the 28 values (see forward_coordinates()).
+    Cached coordinate sets are answered from the prediction cache; the remaining distinct
+    sets are scored with a single predict_many() call on the prediction backend.
+    Returns one forward_coordinates()-style result per input, in order.
+    """
+    results = [None] * len(coordinate_sets)
+    to_score = {}  # cache key -> (flat coordinates, [indexes])
+
+    for index, coordinates in enumerate(coordinate_sets):
+        if isinstance(coordinates, np.ndarray):
+            flat_coordinates = coordinates_values(coordinates)
+        elif not coordinates or not isinstance(coordinates, list):
+            results[index] = {'algorithmBW': None, 'algorithmBCS': None}
+            continue
+        else:
+            try:
+                flat_coordinates = coordinates_array(coordinates).tolist()
+            except ValueError as e:
+                results[index] = {'algorithmBW': None, 'algorithmBCS': None, 'error': str(e)}
+                continue
+
+        cached = prediction_cache.get(flat_coordinates)
+        if cached is not None:
+            results[index] = _prediction_result(cached)
+            continue
+        key = prediction_cache.make_key(flat_coordinates)
+        to_score.setdefault(key, (flat_coordinates, []))[1].append(index)
+
+    if to_score:
+        pending = list(to_score.values())
+        logger.info(f"Scoring {len(pending)} distinct coordinate sets with the '{prediction_engine.name}' prediction backend")
+        try:
+            predictions = prediction_engine.predict_many([flat for flat, _ in pending])
+        except Exception as e:
+            error_message = _prediction_error_message(e)
+            logger.error(f"Batch scoring of {len(pending)} coordinate sets failed: {error_message}")
+            predictions = [None] * len(pending)
+            for _, indexes in pending:
+                for index in indexes:
+                    results[index] = {'algorithmBW': None, 'algorithmBCS': None, 'error': error_message}
+        else:
+            for (flat_coordinates, indexes), prediction_data in zip(pending, predictions):
+                if _is_complete_prediction(prediction_data):
+                    prediction_cache.put(flat_coordinates, prediction_data)
+                for index in indexes:
+                    results[index] = _prediction_result(prediction_data)
+
+    return results
+
+
+def _prediction_fields(results):
+    """
+    Maps forward_coordinates() output to the Measure prediction columns.
+    On error BW is kept if the API produced it and BCS is cleared.
+    """
+    if results.get('error'):
+        return {
+            'algorithmBW': results.get('algorithmBW'),
+            'algorithmBCS': None,
+            'predictionStatus': 'failed',
+            'predictionError': results['error'][:255],
+            'modelVersion': None,
+        }
+    return {
+        'algorithmBW': results.get('algorithmBW'),
+        'algorithmBCS': results.get('algorithmBCS'),
+        'predictionStatus': 'done',
+        'predictionError': None,
+        'modelVersion': str(current_app.config.get('PREDICTION_MODEL_VERSION', prediction_cache.model_version)),
+    }
+
+
+def _is_async_scoring_requested():
+    """Async scoring is chosen per request ('async' query arg or form field), defaulting to MEASURE_ASYNC_SCORING."""
+    default = 'true' if current_app.config.get('MEASURE_ASYNC_SCORING', False) else 'false'
+    value = request.args.get('async', request.form.get('async', default))
+    return str(value).lower() == 'true'
+
+
+def _score_pending_measure(measure_id):
+    """
+    Scores a measure committed with predictionStatus 'pending' and stores the results.
+    The row is only updated while still pending, so a synchronous re-score from a PUT
+    that finished in the meantime is never overwritten. If the job itself fails (e.g. a
+    database error), the row is marked 'failed' instead of staying pending; rows left
+    pending by a restart are picked up by rescore-measures.
+    """
+    try:
+        measure = Measure.query.get(measure_id)
+        if not measure or measure.predictionStatus != 'pending':
+            logger.info(f"Measure {measure_id} is no longer pending a prediction; skipping background scoring.")
+            return
+
+        # The JSON column holds the values the client sent; the packed column is float32
+        results = forward_coordinates(measure.coordinates)
+        if results.get('error'):
+            logger.error(f"Background coordinate processing failed for measure {measure_id}: {results['error']}")
+
+        updated_rows = Measure.query.filter_by(id=measure_id, predictionStatus='pending')\
+                                    .update(_prediction_fields(results), synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        try:
+            Measure.query.filter_by(id=measure_id, predictionStatus='pending')\
+                         .update(_prediction_fields({'error': f"Background scoring failed: {e}"}), synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Could not mark measure {measure_id} as failed; it stays pending until rescore-measures.")
+        raise
+    trend_cache.invalidate(measure.horseId)
+    logger.info(f"Background scoring of measure {measure_id} finished ({updated_rows} row updated).")
+
+
+def _score_pending_measure_inline(measure_id):
+    """
+    _score_pending_measure() on the request thread, used when the scoring pool is full.
+    The measure is already committed, so a failure is logged instead of raised: the row
+    is marked 'failed' (or stays pending for rescore-measures) and the request still
+    succeeds, so a client retrying on an error does not create a duplicate measure.
+    Returns whether scoring finished.
+    """
+    try:
+        _score_pending_measure(measure_id)
+    except Exception:
+        logger.exception(f"Inline scoring of measure {measure_id} failed.")
+        return False
+    return True
 
 
 
 @measures_bp.route('/measure', methods=['POST'])
 @jwt_required()
+@upload_limit('MEASURE_UPLOAD_MAX_BYTES')
 def add_measure():
     """
     Adds a new measure. Expects multipart/form-data.
@@ -286,6 +454,7 @@ def add_measure():
             veterinarianId=measure_veterinarian_id, # Use the determined ID
             appointmentId=appointment_id,
             coordinates=coordinates,
+            coordinatesPacked=pack_coordinates(coordinates),
             userBW=user_bw,
             userBCS=user_bcs,
 
@@ -294,12 +463,11 @@ def add_measure():
         db.session.flush()
 
 
-        saved_picture_filename = None
-        algo_bw = None
-        algo_bcs = None
-
-
-        if coordinates:
+        if coordinates and _is_async_scoring_requested():
+            # Scored by the background pool once the row is committed
+            measure.predictionStatus = 'pending'
+            measure.predictionQueuedAt = datetime.utcnow()
+        elif coordinates:
             try:
                 results = forward_coordinates(coordinates)
                 if results.get('error'):
@@ -308,20 +476,16 @@ def add_measure():
                     # For now, allow saving without BCS, but log the error.
                     # If coordinates were provided with the intent of calculation, client might expect an error.
                     # Consider: raise BadRequest(f"Coordinate processing error: {results['error']}")
-                    algo_bw = results.get('algorithmBW') # BW might still be generated
-                    algo_bcs = None
-                else:
-                    algo_bw = results.get('algorithmBW')
-                    algo_bcs = results.get('algorithmBCS')
-                measure.algorithmBW = algo_bw
-                measure.algorithmBCS = algo_bcs
+                for field, value in _prediction_fields(results).items():
+                    setattr(measure, field, value)
             except Exception as e:
                 logger.error(f"Failed to process coordinates for measure {measure.id}: {e}")
 
+        picture_upload = None
         if picture_file:
             try:
-                saved_picture_filename = _save_measure_image_from_filestorage(picture_file, measure.id, horse_id)
-                measure.picturePath = saved_picture_filename
+                # picturePath is set by the transcoding pool once the WEBP is ready
+                picture_upload = _queue_measure_image_upload(picture_file, measure.id, horse_id)
             except ValueError as e:
                  db.session.rollback()
                  raise BadRequest(str(e))
@@ -331,35 +495,272 @@ def add_measure():
                  raise Exception("Failed to process measure image.")
 
 
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            if picture_upload is not None:
+                discard_media_uploads([picture_upload])
+            raise
+        trend_cache.invalidate(horse_id)
+        if picture_upload is not None:
+            start_media_uploads([picture_upload])
+            db.session.refresh(measure)
         logger.info(f"Measure {measure.id} created successfully.")
 
+        measure_response = {
+            "idMeasure": measure.id,
+            "horseId": measure.horseId,
+            "date": measure.date.isoformat(),
+            "veterinarianId": measure.veterinarianId,
+            "appointmentId": measure.appointmentId,
+            "coordinates": measure.coordinates,
+            "userBW": measure.userBW,
+            "userBCS": measure.userBCS,
+            "algorithmBW": measure.algorithmBW,
+            "algorithmBCS": measure.algorithmBCS,
+            "predictionStatus": measure.predictionStatus,
+            "favorite": measure.favorite,
+            "picturePath": _get_measure_image_url(measure.picturePath)
+        }
+
+        scoring_queued = False
+        if measure.predictionStatus == 'pending':
+            try:
+                measure_scoring_pool.submit(_score_pending_measure, measure.id)
+                scoring_queued = True
+            except PoolFull as e:
+                logger.warning(f"{e} Scoring measure {measure.id} inline.")
+                scored = _score_pending_measure_inline(measure.id)
+                try:
+                    db.session.refresh(measure)
+                    measure_response.update(algorithmBW=measure.algorithmBW, algorithmBCS=measure.algorithmBCS,
+                                            predictionStatus=measure.predictionStatus)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception(f"Could not reload measure {measure.id} after inline scoring.")
+                # Left pending (database unavailable): answered like a queued measure
+                scoring_queued = not scored and measure_response["predictionStatus"] == 'pending'
+
+        response_body = {
+            "message": "Measure added, prediction pending" if scoring_queued else "Measure added successfully",
+            "measure": measure_response
+        }
+        if picture_upload is not None:
+            response_body["pictureUpload"] = _picture_upload_response(picture_upload)
+
+        if scoring_queued:
+            status_url = url_for('measures.get_measure_prediction_status', measure_id=measure.id, _external=True)
+            response_body["predictionStatusUrl"] = status_url
+            return jsonify(response_body), 202, {"Location": status_url}
+        return jsonify(response_body), 201
+
+    except (BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge) as e:
+        db.session.rollback()
+        logger.warning(f"Client error adding measure: {e}")
+        return jsonify({"error": str(e)}), e.code if hasattr(e, 'code') else 400
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Server error adding measure.")
+        return jsonify({"error": "An unexpected server error occurred"}), 500
+
+def _parse_bulk_measure_record(record, requesting_vet_id):
+    """
+    Validates one NDJSON record of POST /measures/bulk and returns the Measure column values.
+    Accepts the same fields as POST /measure; 'coordinates' may be a list or a JSON string.
+    Raises ValueError with a client-facing message.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Each line must be a JSON object.")
 
-        return jsonify({
-            "message": "Measure added successfully",
-            "measure": {
-                "idMeasure": measure.id,
-                "horseId": measure.horseId,
-                "date": measure.date.isoformat(),
-                "veterinarianId": measure.veterinarianId,
-                "appointmentId": measure.appointmentId,
-                "coordinates": measure.coordinates,
-                "userBW": measure.userBW,
-                "userBCS": measure.userBCS,
-                "algorithmBW": measure.algorithmBW,
-                "algorithmBCS": measure.algorithmBCS,
-                "favorite": measure.favorite,
-                "picturePath": _get_measure_image_url(measure.picturePath)
+    try:
+        horse_id = int(record['horseId'])
+    except KeyError:
+        raise ValueError("'horseId' is required.")
+    except (ValueError, TypeError):
+        raise ValueError("Invalid 'horseId'.")
+
+    date_str = record.get('date')
+    if not date_str or not isinstance(date_str, str):
+        raise ValueError("'date' is required.")
+    try:
+        measure_date = datetime.fromisoformat(date_str)
+    except ValueError:
+        try:
+            measure_date = datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f"Invalid 'date': {date_str}")
+
+    if record.get('veterinarianId') is not None:
+        try:
+            measure_vet_id = int(record['veterinarianId'])
+        except (ValueError, TypeError):
+            raise ValueError("Invalid veterinarianId format for the measure.")
+        if measure_vet_id != requesting_vet_id:
+            raise ValueError("Measure's veterinarianId, if provided, must match the authenticated veterinarian.")
+
+    def optional_int(field):
+        value = record.get(field)
+        if value is None or value == '':
+            return None
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid '{field}'.")
+
+    coordinates = record.get('coordinates')
+    if isinstance(coordinates, str):
+        try:
+            coordinates = json.loads(coordinates) if coordinates else None
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid 'coordinates' format: {e}")
+    if coordinates is not None and not isinstance(coordinates, list):
+        raise ValueError("Invalid 'coordinates' format: must be a list of objects.")
+
+    return {
+        'horseId': horse_id,
+        'date': measure_date,
+        'veterinarianId': requesting_vet_id,
+        'appointmentId': optional_int('appointmentId'),
+        'coordinates': coordinates or None,
+        'coordinatesPacked': pack_coordinates(coordinates),
+        'userBW': optional_int('userBW'),
+        'userBCS': optional_int('userBCS'),
+        'favorite': str(record.get('favorite', 'false')).lower() == 'true',
+    }
+
+
+@measures_bp.route('/measures/bulk', methods=['POST'])
+@jwt_required()
+@upload_limit('MEASURES_BULK_MAX_BYTES')
+def add_measures_bulk():
+    """
+    Adds many measures at once. Expects application/x-ndjson: one JSON object per line
+    with the fields of POST /measure ('horseId', 'date', optional 'veterinarianId',
+    'appointmentId', 'coordinates', 'userBW', 'userBCS', 'favorite'). Pictures are not
+    accepted here; upload them afterwards with PUT /measure/<id>.
+
+    Horse access and appointments are checked with one query each for the whole body,
+    all coordinate sets are scored together and rows are inserted in batches of
+    MEASURES_BULK_INSERT_BATCH in a single transaction. Invalid lines are reported
+    per line and do not stop the others.
+    """
+    try:
+        content_type = (request.content_type or '').lower()
+        if 'application/x-ndjson' not in content_type and 'application/jsonl' not in content_type:
+            raise UnsupportedMediaType("Content-Type must be application/x-ndjson.")
+
+        requesting_vet_id_str = get_jwt_identity()
+        try:
+            requesting_vet_id = int(requesting_vet_id_str)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid identity type in JWT token for add_measures_bulk: {requesting_vet_id_str}")
+            return jsonify({"error": "Invalid user identity in token"}), 401
+
+        requesting_veterinarian = Veterinarian.query.get(requesting_vet_id)
+        if not requesting_veterinarian:
+            logger.warning(f"Veterinarian with ID {requesting_vet_id} from token not found (in add_measures_bulk).")
+            return jsonify({"error": "Authenticated veterinarian not found"}), 404
+
+        max_records = int(current_app.config.get('MEASURES_BULK_MAX_RECORDS', 5000))
+        insert_batch_size = max(1, int(current_app.config.get('MEASURES_BULK_INSERT_BATCH', 500)))
+
+        # Parse line by line from the request stream instead of loading the whole body as one JSON document.
+        results = {}  # line number -> per-record result
+        parsed = []  # (line number, column values)
+        for line_number, raw_line in enumerate(request.stream, start=1):
+            if not raw_line.strip():
+                continue
+            if len(results) + len(parsed) >= max_records:
+                raise BadRequest(f"Too many records; at most {max_records} measures per request.")
+            try:
+                parsed.append((line_number, _parse_bulk_measure_record(json.loads(raw_line), requesting_vet_id)))
+            except (ValueError, UnicodeDecodeError) as e:  # JSONDecodeError is a ValueError
+                results[line_number] = {"line": line_number, "status": "error", "error": str(e)}
+
+        if not parsed and not results:
+            raise BadRequest("Request body is empty; expected one JSON measure per line.")
+
+        # One query for every referenced horse, with the owning vet's hospital for the access check
+        horse_ids = {values['horseId'] for _, values in parsed}
+        horse_access = {}
+        if horse_ids:
+            rows = db.session.query(Horse.id, Horse.veterinarianId, Veterinarian.hospitalId)\
+                             .outerjoin(Veterinarian, Horse.veterinarianId == Veterinarian.id)\
+                             .filter(Horse.id.in_(horse_ids)).all()
+            for horse_id, owner_vet_id, owner_hospital_id in rows:
+                horse_access[horse_id] = owner_vet_id == requesting_vet_id or (
+                    requesting_veterinarian.hospitalId is not None and owner_hospital_id == requesting_veterinarian.hospitalId)
+
+        appointment_ids = {values['appointmentId'] for _, values in parsed if values['appointmentId']}
+        existing_appointment_ids = set()
+        if appointment_ids:
+            existing_appointment_ids = {row[0] for row in db.session.query(Appointment.id)
+                                                                     .filter(Appointment.id.in_(appointment_ids)).all()}
+
+        accepted = []
+        for line_number, values in parsed:
+            error = None
+            if values['horseId'] not in horse_access:
+                error = f"Horse with id {values['horseId']} not found."
+            elif not horse_access[values['horseId']]:
+                error = f"You do not have permission to add measures for horse {values['horseId']}."
+            elif values['appointmentId'] and values['appointmentId'] not in existing_appointment_ids:
+                error = f"Appointment with id {values['appointmentId']} not found."
+            if error:
+                results[line_number] = {"line": line_number, "status": "error", "error": error}
+            else:
+                accepted.append((line_number, values))
+
+        if len(accepted) < len(parsed):
+            logger.warning(f"Veterinarian {requesting_vet_id} bulk upload: {len(parsed) - len(accepted)} records rejected by access checks.")
+
+        # Score every coordinate set in as few backend calls as possible, with the values the client sent
+        to_score = [(index, values['coordinates']) for index, (_, values) in enumerate(accepted) if values['coordinates']]
+        predictions = dict(zip((index for index, _ in to_score),
+                               forward_coordinates_many([coordinates for _, coordinates in to_score])))
+
+        measures = []
+        for index, (line_number, values) in enumerate(accepted):
+            measure = Measure(**values)
+            if index in predictions:
+                for field, value in _prediction_fields(predictions[index]).items():
+                    setattr(measure, field, value)
+            measures.append((line_number, measure))
+
+        for start in range(0, len(measures), insert_batch_size):
+            db.session.add_all([measure for _, measure in measures[start:start + insert_batch_size]])
+            db.session.flush()
+        # Read before commit(): it expires every instance, and each row would be reloaded with its own SELECT
+        created = [(line_number, measure.id, measure.horseId, measure.algorithmBW, measure.algorithmBCS, measure.predictionStatus)
+                   for line_number, measure in measures]
+        db.session.commit()
+        trend_cache.invalidate(*{horse_id for _, _, horse_id, _, _, _ in created})
+
+        for line_number, measure_id, _, algorithm_bw, algorithm_bcs, prediction_status in created:
+            results[line_number] = {
+                "line": line_number,
+                "status": "created",
+                "idMeasure": measure_id,
+                "algorithmBW": algorithm_bw,
+                "algorithmBCS": algorithm_bcs,
+                "predictionStatus": prediction_status,
             }
-        }), 201
 
-    except (BadRequest, NotFound, UnsupportedMediaType) as e:
+        failed = len(results) - len(measures)
+        logger.info(f"Bulk upload by veterinarian {requesting_vet_id}: {len(measures)} measures created, {failed} rejected.")
+        return jsonify({
+            "created": len(measures),
+            "failed": failed,
+            "results": [results[line_number] for line_number in sorted(results)]
+        }), 200
+
+    except (BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge) as e:
         db.session.rollback()
-        logger.warning(f"Client error adding measure: {e}")
+        logger.warning(f"Client error in bulk measure upload: {e}")
         return jsonify({"error": str(e)}), e.code if hasattr(e, 'code') else 400
     except Exception as e:
         db.session.rollback()
-        logger.exception("Server error adding measure.")
+        logger.exception("Server error in bulk measure upload.")
         return jsonify({"error": "An unexpected server error occurred"}), 500
 
 @measures_bp.route('/measures', methods=['GET'])
@@ -368,6 +769,7 @@ def get_measures():
     """
     Gets a list of measures for horses accessible to the requesting veterinarian.
     A horse is accessible if it's assigned to the vet or to any vet in the vet's hospital.
+    With 'limit' (and 'cursor' from the previous page) returns {"items", "next_cursor"}.
     """
     try:
         requesting_vet_id_str = get_jwt_identity()
@@ -395,24 +797,22 @@ def get_measures():
             own_horses_query = Horse.query.filter_by(veterinarianId=requesting_vet_id).with_entities(Horse.id)
             accessible_horse_ids.update(h[0] for h in own_horses_query.all())
 
-        measures = Measure.query.filter(Measure.horseId.in_(list(accessible_horse_ids))).order_by(Measure.date.desc()).all()
-        measures_list = [{
-            'id': measure.id,
-            'horseId': measure.horseId,
-            'date': measure.date.isoformat(),
-            'veterinarianId': measure.veterinarianId,
-            'appointmentId': measure.appointmentId,
-            'coordinates': measure.coordinates,
-            'userBW': measure.userBW,
-            'userBCS': measure.userBCS,
-            'algorithmBW': measure.algorithmBW,
-            'algorithmBCS': measure.algorithmBCS,
-            'favorite': measure.favorite,
-            'picturePath': _get_measure_image_url(measure.picturePath)
-        } for measure in measures]
+        fields = MEASURE_FIELDS.parse(MEASURE_LIST_FIELDS)
+        query = Measure.query.filter(Measure.horseId.in_(list(accessible_horse_ids)))\
+                             .options(*MEASURE_FIELDS.load_options(fields, Measure.date))
+        page = page_request()
+        if page:
+            measures, next_cursor = paginate(query, [(Measure.date, True), (Measure.id, True)], page, 'measures')
+        else:
+            measures = query.order_by(Measure.date.desc()).all()
+        measures_list = [MEASURE_FIELDS.serialize(measure, fields) for measure in measures]
 
+        if page:
+            return jsonify(page_response(measures_list, next_cursor)), 200
         return jsonify(measures_list), 200
 
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.exception(f"Server error getting measures for veterinarian {requesting_vet_id_str}.")
         return jsonify({"error": "An unexpected server error occurred"}), 500
@@ -451,25 +851,18 @@ def get_measures_by_horse(horse_id):
             # Obscure the reason for denial by returning 404, as if the horse wasn't found for this vet.
             return jsonify({"error": f"Horse with id {horse_id} not found."}), 404
 
-        measures = Measure.query.filter_by(horseId=horse_id).order_by(Measure.date.desc()).all()
+        fields = MEASURE_FIELDS.parse(MEASURE_LIST_FIELDS)
+        measures = Measure.query.filter_by(horseId=horse_id)\
+                                .options(*MEASURE_FIELDS.load_options(fields))\
+                                .order_by(Measure.date.desc())\
+                                .all()
 
-        measures_list = [{
-            'id': measure.id,
-            'horseId': measure.horseId,
-            'date': measure.date.isoformat(),
-            'veterinarianId': measure.veterinarianId,
-            'appointmentId': measure.appointmentId,
-            'coordinates': measure.coordinates,
-            'userBW': measure.userBW,
-            'userBCS': measure.userBCS,
-            'algorithmBW': measure.algorithmBW,
-            'algorithmBCS': measure.algorithmBCS,
-            'favorite': measure.favorite,
-            'picturePath': _get_measure_image_url(measure.picturePath)
-        } for measure in measures]
+        measures_list = [MEASURE_FIELDS.serialize(measure, fields) for measure in measures]
 
         return jsonify(measures_list), 200
 
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e:
          logger.warning(f"Not found error in get_measures_by_horse (horse_id: {horse_id}, requester: {requesting_vet_id_str}): {e}")
          return jsonify({"error": str(e)}), 404
@@ -519,25 +912,18 @@ def get_measures_by_appointment(appointment_id):
             # Obscure the reason for denial
             return jsonify({"error": f"Appointment with id {appointment_id} not found."}), 404
 
-        measures = Measure.query.filter_by(appointmentId=appointment_id).order_by(Measure.date.desc()).all()
+        fields = MEASURE_FIELDS.parse(MEASURE_LIST_FIELDS)
+        measures = Measure.query.filter_by(appointmentId=appointment_id)\
+                                .options(*MEASURE_FIELDS.load_options(fields))\
+                                .order_by(Measure.date.desc())\
+                                .all()
 
-        measures_list = [{
-            'id': measure.id,
-            'horseId': measure.horseId,
-            'date': measure.date.isoformat(),
-            'veterinarianId': measure.veterinarianId,
-            'appointmentId': measure.appointmentId,
-            'coordinates': measure.coordinates,
-            'userBW': measure.userBW,
-            'userBCS': measure.userBCS,
-            'algorithmBW': measure.algorithmBW,
-            'algorithmBCS': measure.algorithmBCS,
-            'favorite': measure.favorite,
-            'picturePath': _get_measure_image_url(measure.picturePath)
-        } for measure in measures]
+        measures_list = [MEASURE_FIELDS.serialize(measure, fields) for measure in measures]
 
         return jsonify(measures_list), 200
 
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
     except NotFound as e:
          logger.warning(f"Not found error in get_measures_by_appointment (appointment_id: {appointment_id}, requester: {requesting_vet_id_str}): {e}")
          return jsonify({"error": str(e)}), 404
@@ -566,7 +952,9 @@ def get_measure_by_id(measure_id):
             logger.warning(f"Veterinarian with ID {requesting_vet_id} from token not found (in get_measure_by_id).")
             return jsonify({"error": "Authenticated veterinarian not found"}), 404
 
-        measure = Measure.query.get_or_404(measure_id, description=f"Measure with id {measure_id} not found.")
+        fields = MEASURE_FIELDS.parse()
+        measure = Measure.query.options(*MEASURE_FIELDS.load_options(fields, Measure.horseId))\
+                               .get_or_404(measure_id, description=f"Measure with id {measure_id} not found.")
         
         horse = Horse.query.get(measure.horseId)
         if not horse:
@@ -584,31 +972,80 @@ def get_measure_by_id(measure_id):
             logger.warning(f"Veterinarian {requesting_vet_id} attempt to access measure {measure_id} (horse {horse.id}) without permission.")
             return jsonify({"error": f"Measure with id {measure_id} not found."}), 404
 
+        return jsonify(MEASURE_FIELDS.serialize(measure, fields)), 200
+    except BadRequest as e:
+        return jsonify({"error": str(e)}), 400
+    except NotFound as e:
+        logger.warning(f"Not found error in get_measure_by_id (measure_id: {measure_id}, requester: {requesting_vet_id_str}): {e}")
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        logger.exception(f"Server error getting measure {measure_id} (requester: {requesting_vet_id_str}).")
+        return jsonify({"error": "An unexpected server error occurred"}), 500
+
+
+
+@measures_bp.route('/measure/<int:measure_id>/prediction-status', methods=['GET'])
+@jwt_required()
+def get_measure_prediction_status(measure_id):
+    """
+    Reports the scoring progress of a measure: 'pending', 'done', 'failed',
+    or 'not_requested' when the measure has no coordinates to score.
+    """
+    requesting_vet_id_str = None
+    try:
+        requesting_vet_id_str = get_jwt_identity()
+        try:
+            requesting_vet_id = int(requesting_vet_id_str)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid identity type in JWT token for get_measure_prediction_status: {requesting_vet_id_str}")
+            return jsonify({"error": "Invalid user identity in token"}), 401
+
+        requesting_veterinarian = Veterinarian.query.get(requesting_vet_id)
+        if not requesting_veterinarian:
+            logger.warning(f"Veterinarian with ID {requesting_vet_id} from token not found (in get_measure_prediction_status).")
+            return jsonify({"error": "Authenticated veterinarian not found"}), 404
+
+        measure = Measure.query.get_or_404(measure_id, description=f"Measure with id {measure_id} not found.")
+
+        horse = Horse.query.get(measure.horseId)
+        if not horse:
+            return jsonify({"error": "Associated horse not found for this measure."}), 404
+
+        can_access_horse = False
+        if horse.veterinarianId == requesting_vet_id:
+            can_access_horse = True
+        elif requesting_veterinarian.hospitalId is not None and horse.veterinarian and horse.veterinarian.hospitalId == requesting_veterinarian.hospitalId:
+            can_access_horse = True
+
+        if not can_access_horse:
+            logger.warning(f"Veterinarian {requesting_vet_id} attempt to access prediction status of measure {measure_id} (horse {horse.id}) without permission.")
+            return jsonify({"error": f"Measure with id {measure_id} not found."}), 404
+
+        status = measure.predictionStatus
+        if status is None:
+            # Measures scored before status tracking existed, or without coordinates
+            status = 'done' if measure.algorithmBW is not None or measure.algorithmBCS is not None else 'not_requested'
+
         return jsonify({
             'id': measure.id,
-            'horseId': measure.horseId,
-            'date': measure.date.isoformat(),
-            'veterinarianId': measure.veterinarianId,
-            'appointmentId': measure.appointmentId,
-            'coordinates': measure.coordinates,
-            'userBW': measure.userBW,
-            'userBCS': measure.userBCS,
+            'predictionStatus': status,
             'algorithmBW': measure.algorithmBW,
             'algorithmBCS': measure.algorithmBCS,
-            'favorite': measure.favorite,
-            'picturePath': _get_measure_image_url(measure.picturePath)
+            'modelVersion': measure.modelVersion,
+            'error': measure.predictionError
         }), 200
     except NotFound as e:
-        logger.warning(f"Not found error in get_measure_by_id (measure_id: {measure_id}, requester: {requesting_vet_id_str}): {e}")
+        logger.warning(f"Not found error in get_measure_prediction_status (measure_id: {measure_id}, requester: {requesting_vet_id_str}): {e}")
         return jsonify({"error": str(e)}), 404
     except Exception as e:
-        logger.exception(f"Server error getting measure {measure_id} (requester: {requesting_vet_id_str}).")
+        logger.exception(f"Server error getting prediction status of measure {measure_id} (requester: {requesting_vet_id_str}).")
         return jsonify({"error": "An unexpected server error occurred"}), 500
 
 
 
 @measures_bp.route('/measure/<int:measure_id>', methods=['PUT'])
 @jwt_required()
+@upload_limit('MEASURE_UPLOAD_MAX_BYTES')
 def update_measure(measure_id):
     """
     Updates an existing measure identified by ID in URL.
@@ -773,14 +1210,24 @@ def update_measure(measure_id):
 
 
 
-            if json.dumps(measure.coordinates) != json.dumps(new_coordinates):
-                measure.coordinates = new_coordinates
+            new_packed = pack_coordinates(new_coordinates)
+            if new_packed is not None and measure.coordinatesPacked is not None:
+                coordinates_updated = coordinates_changed(measure.coordinatesPacked, new_packed)
+            else:
+                # Invalid or legacy (never packed) coordinates
+                coordinates_updated = json.dumps(measure.coordinates) != json.dumps(new_coordinates)
+
+            if coordinates_updated:
+                measure.set_coordinates(new_coordinates)
                 updated = True
                 if new_coordinates:
                     recalculate_algo = True
                 else:
                     measure.algorithmBW = None
                     measure.algorithmBCS = None
+                    measure.predictionStatus = None
+                    measure.predictionError = None
+                    measure.modelVersion = None
 
 
         if 'favorite' in request.form:
@@ -798,12 +1245,9 @@ def update_measure(measure_id):
                 if results.get('error'):
                     logger.error(f"Coordinate processing failed during update for measure {measure_id}: {results['error']}")
                     # Similar to add_measure, decide on error handling.
-                    # For now, log and potentially clear/keep old values.
-                    measure.algorithmBW = results.get('algorithmBW') # Update BW if available
-                    measure.algorithmBCS = None # Clear BCS if calculation failed
-                else:
-                    measure.algorithmBW = results.get('algorithmBW')
-                    measure.algorithmBCS = results.get('algorithmBCS')
+                    # For now, log, keep BW if available and clear BCS.
+                for field, value in _prediction_fields(results).items():
+                    setattr(measure, field, value)
                 updated = True # Mark as updated if algo values changed or were recalculated
             except Exception as e:
                 logger.error(f"Failed to re-process coordinates for measure {measure_id}: {e}")
@@ -813,17 +1257,17 @@ def update_measure(measure_id):
         remove_flag = request.form.get('remove_picture', 'false').lower() == 'true'
         old_picture_filename = measure.picturePath
 
+        picture_upload = None
         if picture_file:
             try:
-                new_filename = _save_measure_image_from_filestorage(picture_file, measure.id, measure.horseId)
-                measure.picturePath = new_filename
+                # The old picture stays until the new one is transcoded; the pool then switches and deletes it
+                picture_upload = _queue_measure_image_upload(picture_file, measure.id, measure.horseId)
                 updated = True
-
-                _delete_measure_image(old_picture_filename)
             except ValueError as e:
                 raise BadRequest(str(e))
 
         elif remove_flag:
+            cancel_media_uploads('measure', measure.id, 'picturePath')
             if old_picture_filename:
                 if _delete_measure_image(old_picture_filename):
                     measure.picturePath = None
@@ -842,10 +1286,19 @@ def update_measure(measure_id):
                  return jsonify({"message": "No relevant update fields provided."}), 400
 
 
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            if picture_upload is not None:
+                discard_media_uploads([picture_upload])
+            raise
+        trend_cache.invalidate(current_horse.id, measure.horseId)
+        if picture_upload is not None:
+            start_media_uploads([picture_upload])
+            db.session.refresh(measure)
         logger.info(f"Measure {measure_id} updated.")
 
-        return jsonify({
+        response_body = {
             'id': measure.id,
             'horseId': measure.horseId,
             'date': measure.date.isoformat(),
@@ -858,9 +1311,12 @@ def update_measure(measure_id):
             'algorithmBCS': measure.algorithmBCS,
             'favorite': measure.favorite,
             'picturePath': _get_measure_image_url(measure.picturePath)
-        }), 200
+        }
+        if picture_upload is not None:
+            response_body['pictureUpload'] = _picture_upload_response(picture_upload)
+        return jsonify(response_body), 200
 
-    except (NotFound, BadRequest, UnsupportedMediaType) as e:
+    except (NotFound, BadRequest, UnsupportedMediaType, RequestEntityTooLarge) as e:
          db.session.rollback()
          logger.warning(f"Client error updating measure {measure_id} (requester: {requesting_vet_id_str}): {e}")
          return jsonify({"error": str(e)}), e.code if hasattr(e, 'code') else 400
@@ -905,8 +1361,10 @@ def delete_measure(measure_id):
 
         picture_filename_to_delete = measure.picturePath
 
+        cancel_media_uploads('measure', measure.id)
         db.session.delete(measure)
         db.session.commit()
+        trend_cache.invalidate(horse.id)
         logger.info(f"Measure {measure_id} deleted from database.")
 
 
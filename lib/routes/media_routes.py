@@ -0,0 +1,220 @@
+import logging
+from flask import Blueprint, jsonify, redirect, request, url_for
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from werkzeug.exceptions import BadRequest, NotFound
+from werkzeug.utils import secure_filename
+
+from lib.media.profiles import encoding_profile
+from lib.media.storage import DirectUploadsUnsupported
+from lib.media.uploads import (MEDIA_KINDS, OWNER_MODELS, complete_direct_upload, create_direct_upload,
+                               media_upload_status, start_media_uploads)
+from lib.media.variants import VARIANT_SIZES, ensure_variant
+from lib.models import Horse, MediaUpload, Measure, Veterinarian, db
+
+media_bp = Blueprint('media', __name__)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _owner_horse(owner_type, owner_id):
+    """The horse a picture owner is (or whose measure it is), or None."""
+    if owner_type == 'horse':
+        return Horse.query.get(owner_id)
+    if owner_type == 'measure':
+        measure = Measure.query.get(owner_id)
+        return Horse.query.get(measure.horseId) if measure else None
+    return None
+
+
+def _upload_horse(upload):
+    """The horse an upload belongs to (directly, or through its measure), or None."""
+    return _owner_horse(upload.ownerType, upload.ownerId)
+
+
+def _can_access_horse(requesting_veterinarian, horse):
+    """Own horses, and horses of vets of the same hospital."""
+    if horse is None:
+        return False
+    if horse.veterinarianId == requesting_veterinarian.id:
+        return True
+    return requesting_veterinarian.hospitalId is not None and horse.veterinarian is not None \
+        and horse.veterinarian.hospitalId == requesting_veterinarian.hospitalId
+
+
+def _direct_upload_response(upload):
+    state = media_upload_status(upload)
+    state["ownerType"] = upload.ownerType
+    state["ownerId"] = upload.ownerId
+    state["statusUrl"] = url_for('media.get_media_upload_status', upload_id=upload.id, _external=True)
+    state["completeUrl"] = url_for('media.complete_media_upload', upload_id=upload.id, _external=True)
+    return state
+
+
+@media_bp.route('/media/uploads/<int:upload_id>', methods=['GET'])
+@jwt_required()
+def get_media_upload_status(upload_id):
+    """
+    Reports the state of a picture upload: 'pending' while it is transcoded, then 'ready'
+    (with the picture URL), 'failed' (with the error), or 'cancelled' when it was replaced
+    or removed before it finished.
+    """
+    requesting_vet_id_str = None
+    try:
+        requesting_vet_id_str = get_jwt_identity()
+        try:
+            requesting_vet_id = int(requesting_vet_id_str)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid identity type in JWT token for get_media_upload_status: {requesting_vet_id_str}")
+            return jsonify({"error": "Invalid user identity in token"}), 401
+
+        requesting_veterinarian = Veterinarian.query.get(requesting_vet_id)
+        if not requesting_veterinarian:
+            logger.warning(f"Veterinarian with ID {requesting_vet_id} from token not found (in get_media_upload_status).")
+            return jsonify({"error": "Authenticated veterinarian not found"}), 404
+
+        upload = MediaUpload.query.get_or_404(upload_id, description=f"Upload with id {upload_id} not found.")
+
+        if not _can_access_horse(requesting_veterinarian, _upload_horse(upload)):
+            logger.warning(f"Veterinarian {requesting_vet_id} attempt to access upload {upload_id} without permission.")
+            return jsonify({"error": f"Upload with id {upload_id} not found."}), 404
+
+        state = media_upload_status(upload)
+        state["ownerType"] = upload.ownerType
+        state["ownerId"] = upload.ownerId
+        return jsonify(state), 200
+    except NotFound as e:
+        logger.warning(f"Not found error in get_media_upload_status (upload_id: {upload_id}, requester: {requesting_vet_id_str}): {e}")
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        logger.exception(f"Server error getting upload {upload_id} (requester: {requesting_vet_id_str}).")
+        return jsonify({"error": "An unexpected server error occurred"}), 500
+
+
+@media_bp.route('/media/uploads', methods=['POST'])
+@jwt_required()
+def create_media_upload():
+    """
+    Starts a direct upload of a horse or measure picture: returns a pre-signed form the
+    client posts the file to (straight to storage, not through this server), then the
+    client calls completeUrl. Needs the 's3' media storage backend.
+    Fields (form or JSON): 'ownerType' ('horse' or 'measure'), 'ownerId', 'field'
+    (picture column, e.g. 'profilePicturePath' or 'picturePath') and 'contentType'.
+    """
+    requesting_vet_id_str = None
+    try:
+        requesting_vet_id_str = get_jwt_identity()
+        try:
+            requesting_vet_id = int(requesting_vet_id_str)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid identity type in JWT token for create_media_upload: {requesting_vet_id_str}")
+            return jsonify({"error": "Invalid user identity in token"}), 401
+
+        requesting_veterinarian = Veterinarian.query.get(requesting_vet_id)
+        if not requesting_veterinarian:
+            logger.warning(f"Veterinarian with ID {requesting_vet_id} from token not found (in create_media_upload).")
+            return jsonify({"error": "Authenticated veterinarian not found"}), 404
+
+        data = request.get_json(silent=True) or request.form
+        owner_type = data.get('ownerType')
+        field = data.get('field')
+        content_type = data.get('contentType')
+        if owner_type not in OWNER_MODELS:
+            raise BadRequest(f"'ownerType' must be one of: {', '.join(OWNER_MODELS)}.")
+        if not field or not content_type:
+            raise BadRequest("'field' and 'contentType' are required.")
+        try:
+            owner_id = int(data.get('ownerId'))
+        except (ValueError, TypeError):
+            raise BadRequest("Invalid 'ownerId' format. Must be an integer.")
+
+        if not _can_access_horse(requesting_veterinarian, _owner_horse(owner_type, owner_id)):
+            logger.warning(f"Veterinarian {requesting_vet_id} attempt to upload to {owner_type} {owner_id} without permission.")
+            return jsonify({"error": f"{owner_type.capitalize()} with id {owner_id} not found."}), 404
+
+        try:
+            upload, form = create_direct_upload(owner_type, owner_id, field, content_type)
+        except DirectUploadsUnsupported as e:
+            return jsonify({"error": str(e)}), 501
+        except ValueError as e:
+            raise BadRequest(str(e))
+        db.session.commit()
+
+        state = _direct_upload_response(upload)
+        state["uploadForm"] = form
+        return jsonify(state), 201
+    except BadRequest as e:
+        db.session.rollback()
+        logger.warning(f"Client error in create_media_upload (requester: {requesting_vet_id_str}): {e}")
+        return jsonify({"error": str(e)}), e.code
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Server error creating a direct upload (requester: {requesting_vet_id_str}).")
+        return jsonify({"error": "An unexpected server error occurred"}), 500
+
+
+@media_bp.route('/media/uploads/<int:upload_id>/complete', methods=['POST'])
+@jwt_required()
+def complete_media_upload(upload_id):
+    """
+    Called by the client once the file of a direct upload is in storage: queues its
+    transcoding and answers with the upload state ('pending', or already 'ready').
+    409 when the file is not there yet or the upload is no longer awaiting it.
+    """
+    requesting_vet_id_str = None
+    try:
+        requesting_vet_id_str = get_jwt_identity()
+        try:
+            requesting_vet_id = int(requesting_vet_id_str)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid identity type in JWT token for complete_media_upload: {requesting_vet_id_str}")
+            return jsonify({"error": "Invalid user identity in token"}), 401
+
+        requesting_veterinarian = Veterinarian.query.get(requesting_vet_id)
+        if not requesting_veterinarian:
+            logger.warning(f"Veterinarian with ID {requesting_vet_id} from token not found (in complete_media_upload).")
+            return jsonify({"error": "Authenticated veterinarian not found"}), 404
+
+        upload = MediaUpload.query.get_or_404(upload_id, description=f"Upload with id {upload_id} not found.")
+        if not _can_access_horse(requesting_veterinarian, _upload_horse(upload)):
+            logger.warning(f"Veterinarian {requesting_vet_id} attempt to complete upload {upload_id} without permission.")
+            return jsonify({"error": f"Upload with id {upload_id} not found."}), 404
+
+        try:
+            complete_direct_upload(upload)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 409
+        db.session.commit()
+        start_media_uploads([upload])
+        return jsonify(_direct_upload_response(upload)), 202
+    except NotFound as e:
+        logger.warning(f"Not found error in complete_media_upload (upload_id: {upload_id}, requester: {requesting_vet_id_str}): {e}")
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Server error completing upload {upload_id} (requester: {requesting_vet_id_str}).")
+        return jsonify({"error": "An unexpected server error occurred"}), 500
+
+
+@media_bp.route('/media/<kind>/<int:size>/<filename>', methods=['GET'])
+def get_image_variant(kind, size, filename):
+    """
+    Generates a missing downscaled variant of a stored picture (pictures saved before
+    variants existed) and redirects to its static URL. Like the static pictures
+    themselves, this needs no token; it only ever works on existing originals.
+    """
+    media_kind = MEDIA_KINDS.get(kind)
+    if media_kind is None or size not in VARIANT_SIZES or secure_filename(filename) != filename:
+        return jsonify({"error": "Image not found."}), 404
+    try:
+        variant = ensure_variant(media_kind.prefix, filename, size, encoding_profile(kind))
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found."}), 404
+    except ValueError as e:
+        logger.warning(f"Cannot generate {size}px variant of {kind} image {filename}: {e}")
+        return jsonify({"error": str(e)}), 422
+    except Exception as e:
+        logger.exception(f"Server error generating {size}px variant of {kind} image {filename}.")
+        return jsonify({"error": "An unexpected server error occurred"}), 500
+    return redirect(media_kind.url(variant))
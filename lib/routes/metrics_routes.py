@@ -0,0 +1,49 @@
+import logging
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required
+from lib.prediction.cache import prediction_cache
+from lib.prediction.client import prediction_client
+from lib.prediction.dispatcher import prediction_dispatcher
+from lib.prediction.engine import prediction_engine
+from lib.media.serving import media_server
+from lib.media.uploads import encode_pool, transcode_pool
+from lib.xray.cache import xray_cache
+from lib.xray.dispatcher import xray_detector
+from lib.xray.references import xray_references
+from lib.workers import measure_scoring_pool
+
+metrics_bp = Blueprint('metrics', __name__)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@metrics_bp.route('/metrics/prediction', methods=['GET'])
+@jwt_required()
+def prediction_metrics():
+    """
+    Reports the prediction cache counters (hits, misses, coalesced, evictions, ...)
+    the dispatcher batching counters, the HTTP client's circuit breaker state and
+    latency percentiles, and the background scoring pool counters.
+    """
+    return jsonify({
+        "backend": prediction_engine.name,
+        "cache": prediction_cache.stats(),
+        "dispatcher": prediction_dispatcher.stats(),
+        "client": prediction_client.stats(),
+        "async_scoring": measure_scoring_pool.stats()
+    }), 200
+
+
+@metrics_bp.route('/metrics/media', methods=['GET'])
+@jwt_required()
+def media_metrics():
+    """Reports the image transcoding and encoding pool counters, the static media serving counters, the reference X-rays, the X-ray detector and its result cache."""
+    return jsonify({
+        "transcoding": transcode_pool.stats(),
+        "encoding": encode_pool.stats(),
+        "serving": media_server.stats(),
+        "xray_references": xray_references.stats(),
+        "xray_detector": xray_detector.stats(),
+        "xray_cache": xray_cache.stats()
+    }), 200
@@ -1,5 +1,4 @@
 import base64
-import io
 import logging
 import os
 import random
@@ -7,11 +6,16 @@ import uuid
 import json
 from datetime import datetime
 import requests
-from flask import Blueprint, jsonify, request, url_for
+from flask import Blueprint, current_app, jsonify, request, url_for
 from flask_jwt_extended import jwt_required
+from lib.media.streaming import upload_limit, upload_sha256, verify_upload_image
+from lib.media.uploads import spool_upload
 from lib.models import Horse
-from PIL import Image, UnidentifiedImageError 
-from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType, InternalServerError
+from lib.xray.cache import xray_cache
+from lib.xray.dispatcher import DetectionFailed, DetectorBusy, xray_detector
+from lib.xray.references import landmarks_response, xray_references
+from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge, InternalServerError, \
+    ServiceUnavailable, UnprocessableEntity
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
@@ -72,17 +76,86 @@ def _delete_xray_image(filename):
         return False
 
 
+def _verify_picture(picture_file):
+    try:
+        # Checked in place on the (spooled) upload stream; nothing is copied into memory
+        verify_upload_image(picture_file.stream)
+    except ValueError as img_err:
+        logger.warning(f"Invalid image uploaded: {img_err}")
+        raise BadRequest("Invalid or corrupted image file provided.")
+
+
+def _run_detector(picture_file, reference):
+    """
+    Verifies the uploaded radiograph and runs the landmark detector on it (spooled to
+    disk for the detection processes and removed afterwards).
+    """
+    _verify_picture(picture_file)
+    try:
+        spool_path, _ = spool_upload(picture_file)
+    except ValueError:
+        raise BadRequest("Invalid or corrupted image file provided.")
+    try:
+        return xray_detector.detect(spool_path, reference)
+    except (DetectorBusy, TimeoutError) as e:
+        logger.warning(f"X-ray detector unavailable: {e}")
+        raise ServiceUnavailable("The X-ray detector is busy. Try again shortly.")
+    except DetectionFailed as e:
+        logger.warning(f"X-ray detection failed: {e}")
+        raise UnprocessableEntity("The X-ray image could not be analysed.")
+    finally:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+
+
+def _cache_headers(source):
+    """X-Xray-Cache: memory, disk, coalesced or miss; X-Xray-Cache-Hit-Rate: of this worker so far."""
+    if source is None:
+        return {}
+    return {"X-Xray-Cache": source, "X-Xray-Cache-Hit-Rate": f"{xray_cache.hit_rate():.4f}"}
+
+
+def _detect_landmarks(picture_file, reference):
+    """
+    The 'detectedLandmarks' of the response, in the upload's pixels, and where they came
+    from ('memory', 'disk', 'coalesced' or 'miss'). A radiograph already analysed with the
+    same detector and reference is answered from the result cache by the hash taken while
+    the upload was received: no verification, decoding or inference.
+    Returns (None, None) when detection is switched off.
+    """
+    if not xray_detector.enabled:
+        _verify_picture(picture_file)
+        return None, None
+    key = xray_cache.make_key(upload_sha256(picture_file.stream), xray_detector.version, reference.etag)
+    detected, source = xray_cache.get_or_compute(key, lambda: _run_detector(picture_file, reference))
+
+    descriptions = {point["label"]: point["description"] for point in reference.landmarks.values()}
+    points = [dict(point, description=descriptions.get(point["label"])) for point in detected["landmarks"]]
+    return {
+        "detector": xray_detector.backend,
+        "detectorVersion": xray_detector.version,
+        "imageWidth": detected["width"],
+        "imageHeight": detected["height"],
+        "confidence": detected["confidence"],
+        "coordinates_data": landmarks_response(points),
+    }, source
+
+
 
 
 
 @xray_bp.route('/xray', methods=['POST'])
 @jwt_required()
+@upload_limit('XRAY_UPLOAD_MAX_BYTES')
 def process_xray_and_return_image():
     """
-    Receives an X-ray image and horseId, processes it (placeholder),
-    and returns the URL of a specific picture ('XRay_Random.png') from the server,
-    along with coordinates for its corners (inset by 10px).
-    The received image is NOT saved.
+    Receives an X-ray image and horseId and returns the URL of the reference X-ray
+    (XRAY_REFERENCE_IMAGE) with its landmarks, plus the landmarks the detector found
+    on the received image ('detectedLandmarks', null with XRAY_DETECTOR_BACKEND=none).
+    The received image is NOT saved; it is only spooled while the detector reads it.
+    Results are cached by the image's SHA-256 (headers X-Xray-Cache, X-Xray-Cache-Hit-Rate).
     Expects multipart/form-data.
     Required form field: 'horseId'.
     Required file upload: 'picture'.
@@ -102,15 +175,6 @@ def process_xray_and_return_image():
             raise BadRequest("Missing 'picture' file upload.")
         if not picture_file.filename:
              raise BadRequest("Received file upload has no filename.")
-        try:
-            temp_stream = io.BytesIO(picture_file.stream.read())
-            picture_file.stream.seek(0)
-            with Image.open(temp_stream) as img:
-                img.verify() 
-            temp_stream.seek(0) 
-        except (UnidentifiedImageError, Exception) as img_err: 
-            logger.warning(f"Invalid image uploaded: {img_err}")
-            raise BadRequest("Invalid or corrupted image file provided.")
 
         # Validate horseId
         try:
@@ -125,75 +189,40 @@ def process_xray_and_return_image():
         logger.info(f"Received xray image '{secure_filename(picture_file.filename)}' for horse {horse_id}. Processing without saving.")
 
         # --- Process and Prepare Response ---
-        selected_filename = "XRay_Random.png"
-        target_file_path = os.path.join(xray_PicturesFolder, selected_filename)
-
-        # Check if the target static image exists
-        if not os.path.isfile(target_file_path):
+        # Dimensions, landmarks and URL come from the in-memory registry (loaded at startup)
+        selected_filename = current_app.config.get('XRAY_REFERENCE_IMAGE', 'XRay_Random.png')
+        reference = xray_references.get(selected_filename)
+        if reference is None:
             logger.error(f"Target image file '{selected_filename}' not found in {xray_PicturesFolder}.")
             # Use InternalServerError as this is a server configuration issue
             raise InternalServerError(f"Required reference image '{selected_filename}' not found on server.")
 
-        # Get dimensions of the target image to calculate coordinates
-        try:
-            with Image.open(target_file_path) as img:
-                width, height = img.size
-        except (FileNotFoundError, UnidentifiedImageError, Exception) as img_err:
-             logger.error(f"Could not open or read target image '{selected_filename}': {img_err}")
-             raise InternalServerError(f"Failed to read reference image '{selected_filename}' on server.")
-
-
-        # Define the coordinates based on image dimensions (inset by 10px)
-        inset = 10
-        logger.warning(f"Image '{selected_filename}' dimensions ({width}x{height}) are too small for the requested inset ({inset}px). Using edge coordinates.")
-        if width <= 2 * inset or height <= 2 * inset:
-            tl_x, tl_y = 0, 0
-            tr_x, tr_y = width, 0
-            bl_x, bl_y = 0, height
-            br_x, br_y = width, height
-        else:
-            tl_x, tl_y = inset, inset
-            tr_x, tr_y = width - inset, inset
-            bl_x, bl_y = inset, height - inset
-            br_x, br_y = width - inset, height - inset
-
-        """ coordinates_data = {
-            "Top Left": {"x": tl_x, "y": tl_y, "description": "Top-left corner inset"},
-            "Top Right": {"x": tr_x, "y": tr_y, "description": "Top-right corner inset"},
-            "Bottom Left": {"x": bl_x, "y": bl_y, "description": "Bottom-left corner inset"},
-            "Bottom Right": {"x": br_x, "y": br_y, "description": "Bottom-right corner inset"},
-        } """
-        
-        coordinates_data = {
-            "391,52": {"x": 391, "y": 52, "label": "Terceiro osso metacarpiano", "description": "Location of Terceiro osso metacarpiano"},
-            "321,141": {"x": 321, "y": 141, "label": "Segundo osso metacarpiano", "description": "Location of Segundo osso metacarpiano"},
-            "444,95": {"x": 444, "y": 95, "label": "Quarto osso metacarpiano", "description": "Location of Quarto osso metacarpiano"},
-            "352,332": {"x": 352, "y": 332, "label": "Ossos sesamoides proximais", "description": "Location of Ossos sesamoides proximais"}, 
-            "455,335": {"x": 455, "y": 335, "label": "Ossos sesamoides proximais", "description": "Location of Ossos sesamoides proximais"},
-            "409,621": {"x": 409, "y": 621, "label": "Falange proximal (P1)", "description": "Location of Falange proximal (P1)"},
-            "413,903": {"x": 413, "y": 903, "label": "Falange média (P2)", "description": "Location of Falange média (P2)"},
-        }
-
-        # Generate URL for the target image
-        output_image_url = _get_xray_image_url(selected_filename)
-        if not output_image_url:
-             # Logged in _get_xray_image_url, raise server error
-             raise InternalServerError("Failed to generate URL for the target image.")
-
-        logger.info(f"Coordinates '{coordinates_data}' for horse {horse_id}.")
+        coordinates_data = reference.landmarks
+        output_image_url = xray_references.url(reference)
+        detected_landmarks, cache_source = _detect_landmarks(picture_file, reference)
+
+        logger.info(f"Returning {len(coordinates_data)} landmarks of '{selected_filename}' for horse {horse_id}"
+                    + (f", confidence {detected_landmarks['confidence']}." if detected_landmarks else "."))
 
         # --- Return Success Response ---
         return jsonify({
             "message": "Xray processed.",
             "horseId": horse_id,
             "returnedImageUrl": output_image_url,
-            "coordinates_data": coordinates_data # Changed key name for clarity
-        }), 200
+            "returnedImageEtag": reference.etag,
+            "coordinates_data": coordinates_data, # Changed key name for clarity
+            "detectedLandmarks": detected_landmarks
+        }), 200, _cache_headers(cache_source)
 
     # --- Error Handling ---
-    except (BadRequest, NotFound, UnsupportedMediaType) as e:
+    except (BadRequest, NotFound, UnsupportedMediaType, RequestEntityTooLarge) as e:
         logger.warning(f"Client error processing xray: {e}")
         return jsonify({"error": str(e.description if hasattr(e, 'description') else e)}), e.code if hasattr(e, 'code') else 400
+    except (UnprocessableEntity, ServiceUnavailable) as e:
+        response = jsonify({"error": e.description})
+        if e.code == 503:
+            response.headers['Retry-After'] = '1'
+        return response, e.code
     except InternalServerError as e:
          # Logged where raised
          return jsonify({"error": str(e.description if hasattr(e, 'description') else e)}), e.code if hasattr(e, 'code') else 500
@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from lib.models import Measure, db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SERIES = ('userBW', 'algorithmBW', 'userBCS', 'algorithmBCS')
+DELTAS = {'bw': ('userBW', 'algorithmBW'), 'bcs': ('userBCS', 'algorithmBCS')}
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of at most
+    `threshold` points of (x, y) that keep the visual shape of the series; the first
+    and last points are always kept. x must be sorted.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = a = 0
+    for i in range(threshold - 2):
+        start = int(np.floor(i * every)) + 1
+        end = int(np.floor((i + 1) * every)) + 1
+        next_start, next_end = end, min(int(np.floor((i + 2) * every)) + 1, n)
+        if next_start >= next_end:  # last bucket: the average point is the final point
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        else:
+            avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def _rolling_mean(values, window):
+    """Trailing mean over the last `window` values (fewer at the start of the series)."""
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(0, ends - window)
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+def _slope_per_day(days, values):
+    if len(values) < 2 or np.ptp(days) == 0:
+        return None
+    return float(np.polyfit(days, values, 1)[0])
+
+
+def _series_summary(dates, days, values, window, max_points):
+    mask = ~np.isnan(values)
+    days, values = days[mask], values[mask]
+    dates = dates[mask]
+    if values.size == 0:
+        return {"count": 0, "mean": None, "last": None, "slopePerDay": None, "points": []}
+
+    rolling = _rolling_mean(values, window)
+    keep = lttb_indices(days, values, max_points)
+    slope = _slope_per_day(days, values)
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 3),
+        "last": float(values[-1]),
+        "slopePerDay": round(slope, 5) + 0.0 if slope is not None else None,
+        "points": [{"date": dates[i].isoformat(), "value": float(values[i]), "rollingMean": round(float(rolling[i]), 3)}
+                   for i in keep]
+    }
+
+
+def _delta_summary(dates, days, user, algorithm, max_points):
+    delta = user - algorithm
+    mask = ~np.isnan(delta)
+    days, delta, dates = days[mask], delta[mask], dates[mask]
+    if delta.size == 0:
+        return {"count": 0, "mean": None, "meanAbs": None, "points": []}
+    keep = lttb_indices(days, delta, max_points)
+    return {
+        "count": int(delta.size),
+        "mean": round(float(delta.mean()), 3),
+        "meanAbs": round(float(np.abs(delta).mean()), 3),
+        "points": [{"date": dates[i].isoformat(), "value": float(delta[i])} for i in keep]
+    }
+
+
+def compute_horse_trends(horse_id, window=5, max_points=200):
+    """
+    Builds the BW/BCS trend series of a horse from its measures, oldest first.
+    Only the date and the four score columns are read (no coordinates or pictures).
+    """
+    rows = db.session.query(Measure.date, *(getattr(Measure, name) for name in SERIES))\
+                     .filter(Measure.horseId == horse_id)\
+                     .order_by(Measure.date, Measure.id)\
+                     .all()
+
+    result = {"horseId": horse_id, "count": len(rows), "window": window, "maxPoints": max_points,
+              "firstDate": None, "lastDate": None,
+              "series": {}, "deltas": {}}
+    dates = np.array([row[0] for row in rows], dtype=object)
+    seconds = np.array([row[0] for row in rows], dtype='datetime64[s]').astype(np.int64)
+    days = (seconds - seconds[:1].min(initial=0)) / 86400.0
+    # None (not measured / not scored) becomes NaN and is dropped per series
+    columns = {name: np.array([row[i + 1] for row in rows], dtype=np.float64) for i, name in enumerate(SERIES)}
+
+    if rows:
+        result["firstDate"] = dates[0].isoformat()
+        result["lastDate"] = dates[-1].isoformat()
+    for name in SERIES:
+        result["series"][name] = _series_summary(dates, days, columns[name], window, max_points)
+    for name, (user_name, algorithm_name) in DELTAS.items():
+        result["deltas"][name] = _delta_summary(dates, days, columns[user_name], columns[algorithm_name], max_points)
+    return result
+
+
+class TrendCache:
+    """
+    Per-horse cache of computed trends, keyed by (window, max_points) within a horse;
+    each horse keeps its TRENDS_CACHE_MAX_PARAMS_PER_HORSE most recently used parameter
+    sets, so arbitrary query parameters cannot grow it. Entries are dropped explicitly when one of the horse's measures changes; the TTL
+    bounds staleness for changes made by other worker processes.
+    """
+
+    def __init__(self, app=None):
+        self.max_horses = 1024
+        self.ttl_seconds = 300.0
+        self.max_params_per_horse = 4
+        self._lock = threading.Lock()
+        self._horses = OrderedDict()  # horse_id -> OrderedDict {(window, max_points): (expires_at, result)}
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._generation = 0  # bumped by invalidate(), so a result computed meanwhile is not stored
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_horses = max(1, int(app.config.get('TRENDS_CACHE_MAX_HORSES', self.max_horses)))
+        self.ttl_seconds = float(app.config.get('TRENDS_CACHE_TTL_SECONDS', self.ttl_seconds))
+        self.max_params_per_horse = max(1, int(app.config.get('TRENDS_CACHE_MAX_PARAMS_PER_HORSE', self.max_params_per_horse)))
+        self.clear()
+        app.extensions['trend_cache'] = self
+
+    def get_or_compute(self, horse_id, window, max_points):
+        params = (window, max_points)
+        with self._lock:
+            entries = self._horses.get(horse_id)
+            entry = entries.get(params) if entries is not None else None
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    entries.move_to_end(params)
+                    self._horses.move_to_end(horse_id)
+                    self._counters["hits"] += 1
+                    return entry[1]
+                del entries[params]
+            self._counters["misses"] += 1
+            generation = self._generation
+
+        result = compute_horse_trends(horse_id, window=window, max_points=max_points)
+
+        with self._lock:
+            if generation != self._generation:
+                return result
+            entries = self._horses.setdefault(horse_id, OrderedDict())
+            entries[params] = (time.monotonic() + self.ttl_seconds, result)
+            entries.move_to_end(params)
+            while len(entries) > self.max_params_per_horse:
+                entries.popitem(last=False)
+            self._horses.move_to_end(horse_id)
+            while len(self._horses) > self.max_horses:
+                self._horses.popitem(last=False)
+        return result
+
+    def invalidate(self, *horse_ids):
+        """Drops the cached trends of these horses (call after their measures change)."""
+        with self._lock:
+            self._generation += 1
+            for horse_id in horse_ids:
+                if self._horses.pop(horse_id, None) is not None:
+                    self._counters["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._horses.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["horses"] = len(self._horses)
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["max_params_per_horse"] = self.max_params_per_horse
+        return stats
+
+
+trend_cache = TrendCache()
@@ -0,0 +1,195 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from lib.models import db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PoolFull(Exception):
+    """Raised by AppContextPool.submit when the pending-job limit is reached."""
+
+
+class AppContextPool:
+    """
+    Bounded background thread pool whose jobs run inside the Flask application
+    context, with their own database session that is removed after each job.
+
+    Worker count and queue bound are read from the config keys
+    f"{config_prefix}_WORKERS" and f"{config_prefix}_MAX_PENDING".
+    """
+
+    def __init__(self, name, config_prefix, workers=4, max_pending=256):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+    def init_app(self, app):
+        self._app = app
+        self.workers = max(1, int(app.config.get(f'{self.config_prefix}_WORKERS', self.workers)))
+        self.max_pending = max(1, int(app.config.get(f'{self.config_prefix}_MAX_PENDING', self.max_pending)))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        app.extensions[self.name] = self
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules fn(*args, **kwargs) in the app context. Raises PoolFull instead of
+        queueing without bound, so callers can fall back to doing the work inline.
+        """
+        if self._app is None:
+            raise RuntimeError(f"Worker pool '{self.name}' used before init_app().")
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PoolFull(f"Worker pool '{self.name}' has {self.max_pending} jobs pending.")
+        try:
+            future = self._get_executor().submit(self._run, fn, args, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats["submitted"] += 1
+        return future
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["workers"] = self.workers
+        stats["max_pending"] = self.max_pending
+        return stats
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self):
+        pid = os.getpid()
+        with self._lock:
+            # Threads do not survive a fork, so each worker process gets its own executor.
+            if self._executor is None or self._pid != pid:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+                self._pid = pid
+            return self._executor
+
+    def _run(self, fn, args, kwargs):
+        try:
+            with self._app.app_context():
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception:
+                    db.session.rollback()
+                    raise
+                finally:
+                    db.session.remove()
+            with self._lock:
+                self._stats["completed"] += 1
+            return result
+        except Exception:
+            logger.exception(f"Background job {getattr(fn, '__name__', fn)} failed in pool '{self.name}'.")
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        finally:
+            self._slots.release()
+
+
+class ProcessPool:
+    """
+    Shared pool of worker processes for CPU-bound work that would otherwise hold the GIL
+    (image decoding and encoding), so several jobs really run at once. Jobs are plain
+    module-level functions of picklable arguments; they get no app context or database.
+
+    Processes are started by a fork server that has already imported `preload` modules,
+    so a new worker is a cheap fork of a clean, single-threaded process. The process count
+    is read from f"{config_prefix}_PROCESSES"; 0 runs every job in the calling thread.
+    """
+
+    def __init__(self, name, config_prefix, processes=0, preload=()):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.processes = processes
+        self.preload = list(preload)
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "inline": 0, "restarts": 0}
+
+    def init_app(self, app):
+        self.processes = max(0, int(app.config.get(f'{self.config_prefix}_PROCESSES', self.processes)))
+        app.extensions[self.name] = self
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) in a worker process; returns a Future (already done when running inline)."""
+        if self.processes == 0:
+            return self._run_inline(fn, args)
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); the executor is unusable, start a new one
+            logger.warning(f"Process pool '{self.name}' was broken; restarting it.")
+            with self._lock:
+                self._executor = None
+                self._stats["restarts"] += 1
+            future = self._get_executor().submit(fn, *args)
+        future.add_done_callback(self._count)
+        with self._lock:
+            self._stats["submitted"] += 1
+        return future
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["processes"] = self.processes
+        return stats
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run_inline(self, fn, args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        with self._lock:
+            self._stats["inline"] += 1
+        return future
+
+    def _count(self, future):
+        with self._lock:
+            self._stats["failed" if future.cancelled() or future.exception() else "completed"] += 1
+
+    def _get_executor(self):
+        pid = os.getpid()
+        with self._lock:
+            # A forked web worker must not share its parent's pool
+            if self._executor is None or self._pid != pid:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                if context.get_start_method() == 'forkserver':
+                    context.set_forkserver_preload(['__main__'] + self.preload)
+                self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+                self._pid = pid
+            return self._executor
+
+
+measure_scoring_pool = AppContextPool('measure-scoring', 'PREDICTION_ASYNC')
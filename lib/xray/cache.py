@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class XrayResultCache:
+    """
+    Landmark detection results keyed by the SHA-256 of the uploaded radiograph, the
+    detector version and the reference X-ray's ETag, so a re-submitted image is answered
+    without decoding or inference, and a new detector or reference never serves old results.
+
+    Two tiers: an LRU in memory (XRAY_CACHE_MAX_ENTRIES) and, with XRAY_CACHE_FOLDER set,
+    one JSON file per result on disk (XRAY_CACHE_DISK_MAX_ENTRIES, oldest used evicted
+    first), which survives restarts and is shared by the workers of one server. A disk
+    hit is promoted to memory. Concurrent lookups of the same key wait for the detection
+    already running (single-flight). Failed detections are never cached.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_entries = 1024
+        self.folder = None
+        self.disk_max_entries = 50000
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> result
+        self._disk_index = OrderedDict()  # file name -> None, least recently used first
+        self._in_flight = {}  # key -> Future
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0,
+                          "disk_evictions": 0, "disk_errors": 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the cache settings from the Flask config and indexes the disk tier."""
+        self.enabled = app.config.get('XRAY_CACHE_ENABLED', self.enabled)
+        self.max_entries = max(1, int(app.config.get('XRAY_CACHE_MAX_ENTRIES', self.max_entries)))
+        self.folder = app.config.get('XRAY_CACHE_FOLDER') or None
+        self.disk_max_entries = max(1, int(app.config.get('XRAY_CACHE_DISK_MAX_ENTRIES', self.disk_max_entries)))
+        with self._lock:
+            self._entries.clear()
+            self._disk_index = self._scan_folder() if self.enabled and self.folder else OrderedDict()
+            evicted = self._evict_disk()
+        self._remove_files(evicted)
+        app.extensions['xray_cache'] = self
+        logger.info(f"X-ray result cache {'enabled' if self.enabled else 'disabled'}: {self.max_entries} in memory"
+                    + (f", {len(self._disk_index)}/{self.disk_max_entries} on disk in {self.folder}." if self.folder else "."))
+
+    @staticmethod
+    def make_key(upload_hash, detector_version, reference_etag):
+        return (upload_hash, detector_version, reference_etag)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns (result, source) with source 'memory', 'disk', 'coalesced' or 'miss'; on a
+        miss compute() is called once for every concurrent caller with the same key.
+        """
+        if not self.enabled:
+            return compute(), 'miss'
+
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return result, 'memory'
+            leader_future = self._in_flight.get(key)
+            if leader_future is None:
+                future = Future()
+                self._in_flight[key] = future
+
+        if leader_future is not None:
+            result = leader_future.result()
+            with self._lock:
+                self._counters["coalesced"] += 1
+            return result, 'coalesced'
+
+        try:
+            result = self._read_disk(key)
+            source = 'disk'
+            if result is None:
+                source = 'miss'
+                result = compute()
+                self._write_disk(key, result)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                self._counters["misses"] += 1
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._counters["disk_hits" if source == 'disk' else "misses"] += 1
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+        future.set_result(result)
+        return result, source
+
+    def hit_rate(self):
+        with self._lock:
+            return self._hit_rate(self._counters)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+            stats["disk_size"] = len(self._disk_index)
+            stats["in_flight"] = len(self._in_flight)
+            stats["hit_rate"] = self._hit_rate(self._counters)
+        stats["max_entries"] = self.max_entries
+        stats["disk_max_entries"] = self.disk_max_entries if self.folder else 0
+        stats["enabled"] = self.enabled
+        return stats
+
+    @staticmethod
+    def _hit_rate(counters):
+        hits = counters["memory_hits"] + counters["disk_hits"] + counters["coalesced"]
+        lookups = hits + counters["misses"]
+        return round(hits / lookups, 4) if lookups else 0.0
+
+    @staticmethod
+    def _file_name(key):
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest() + '.json'
+
+    def _scan_folder(self):
+        # Caller holds self._lock. Most recently used (mtime) last.
+        os.makedirs(self.folder, exist_ok=True)
+        entries = []
+        with os.scandir(self.folder) as found:
+            for entry in found:
+                if entry.is_file() and entry.name.endswith('.json'):
+                    entries.append((entry.stat().st_mtime_ns, entry.name))
+        return OrderedDict((name, None) for _, name in sorted(entries))
+
+    def _read_disk(self, key):
+        if not self.folder:
+            return None
+        name = self._file_name(key)
+        path = os.path.join(self.folder, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # recently used: evicted last
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable X-ray cache entry {path}: {e}")
+            with self._lock:
+                self._counters["disk_errors"] += 1
+            return None
+        if tuple(entry.get('key') or ()) != key:
+            return None
+        with self._lock:
+            self._disk_index[name] = None
+            self._disk_index.move_to_end(name)
+        return entry.get('result')
+
+    def _write_disk(self, key, result):
+        if not self.folder:
+            return
+        name = self._file_name(key)
+        path = os.path.join(self.folder, name)
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump({"key": list(key), "result": result}, f)
+            os.replace(temporary, path)  # readers in other workers never see a partial file
+        except OSError as e:
+            logger.warning(f"Could not write X-ray cache entry {path}: {e}")
+            with self._lock:
+                self._counters["disk_errors"] += 1
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_index[name] = None
+            self._disk_index.move_to_end(name)
+            evicted = self._evict_disk()
+        self._remove_files(evicted)
+
+    def _evict_disk(self):
+        # Caller holds self._lock. Returns the file names to remove.
+        evicted = []
+        while len(self._disk_index) > self.disk_max_entries:
+            evicted.append(self._disk_index.popitem(last=False)[0])
+        self._counters["disk_evictions"] += len(evicted)
+        return evicted
+
+    def _remove_files(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass  # already evicted by another worker
+            except OSError as e:
+                logger.warning(f"Could not remove X-ray cache entry {name}: {e}")
+
+
+xray_cache = XrayResultCache()
@@ -0,0 +1,206 @@
+import importlib
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from lib.media.images import load_image, open_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A reference X-ray as the detectors see it: its grayscale pixels (float32, 0-1) at the
+# detection size, its landmark points (k, 2) on those pixels, and the landmark labels
+DetectionReference = namedtuple('DetectionReference', ['image', 'points', 'labels'])
+
+# Bins of the intensity histogram the bone threshold is picked from
+HISTOGRAM_BINS = 64
+# Points of the reference bone mask checked after alignment, for the confidence
+CONFIDENCE_GRID = 32
+
+
+def otsu_thresholds(images, valid):
+    """
+    Per-image Otsu threshold of a (n, H, W) stack in [0, 1], over the `valid` pixels only
+    (the padding of smaller images is left out). One bincount for the whole batch.
+    """
+    n = images.shape[0]
+    bins = np.minimum((images * HISTOGRAM_BINS).astype(np.int64), HISTOGRAM_BINS - 1)
+    bins += (np.arange(n) * HISTOGRAM_BINS)[:, None, None]
+    hist = np.bincount(bins[valid], minlength=n * HISTOGRAM_BINS).reshape(n, HISTOGRAM_BINS).astype(np.float64)
+    centers = (np.arange(HISTOGRAM_BINS) + 0.5) / HISTOGRAM_BINS
+    weight_below = np.cumsum(hist, axis=1)
+    mass_below = np.cumsum(hist * centers, axis=1)
+    total, mass = weight_below[:, -1:], mass_below[:, -1:]
+    weight_above = total - weight_below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_below = mass_below / weight_below
+        mean_above = (mass - mass_below) / weight_above
+        between = weight_below * weight_above * (mean_below - mean_above) ** 2
+    between = np.nan_to_num(between)
+    return (np.argmax(between, axis=1) + 1) / HISTOGRAM_BINS
+
+
+def mask_frames(masks):
+    """
+    Centroid (n, 2), principal axes (n, 2, 2; columns major then minor) and standard
+    deviations along them (n, 2) of a stack of binary masks. The sign of each axis is
+    fixed by the skew of the mask along it, so the same anatomy gets the same frame
+    whatever its position, size, rotation or mirroring. Empty masks get NaNs.
+    """
+    n, height, width = masks.shape
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float64)
+    weights = masks.astype(np.float64)
+    area = weights.sum(axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cx = (weights * xs).sum(axis=(1, 2)) / area
+        cy = (weights * ys).sum(axis=(1, 2)) / area
+        dx = xs[None] - cx[:, None, None]
+        dy = ys[None] - cy[:, None, None]
+        cov = np.empty((n, 2, 2))
+        cov[:, 0, 0] = (weights * dx * dx).sum(axis=(1, 2)) / area
+        cov[:, 0, 1] = cov[:, 1, 0] = (weights * dx * dy).sum(axis=(1, 2)) / area
+        cov[:, 1, 1] = (weights * dy * dy).sum(axis=(1, 2)) / area
+    cov = np.nan_to_num(cov)
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    axes = eigenvectors[:, :, ::-1].copy()  # largest variance first
+    stds = np.sqrt(np.maximum(eigenvalues[:, ::-1], 0))
+    for axis in range(2):
+        projection = dx * axes[:, 0, axis][:, None, None] + dy * axes[:, 1, axis][:, None, None]
+        skew = (weights * projection ** 3).sum(axis=(1, 2))
+        axes[:, :, axis] *= np.where(skew < 0, -1.0, 1.0)[:, None]
+    centroids = np.stack([cx, cy], axis=1)
+    empty = area == 0
+    centroids[empty] = np.nan
+    return centroids, axes, stds
+
+
+def stack_images(images):
+    """Pads 2-D images of different sizes into one (n, H, W) stack, with the mask of real pixels."""
+    height = max(img.shape[0] for img in images)
+    width = max(img.shape[1] for img in images)
+    stack = np.zeros((len(images), height, width), dtype=np.float32)
+    valid = np.zeros(stack.shape, dtype=bool)
+    for i, img in enumerate(images):
+        stack[i, :img.shape[0], :img.shape[1]] = img
+        valid[i, :img.shape[0], :img.shape[1]] = True
+    return stack, valid
+
+
+class ReferenceLandmarkDetector:
+    """
+    Deterministic classical detector, numpy only, so the pipeline runs and can be
+    benchmarked on a CPU-only box without a trained model. Bone is segmented by an Otsu
+    threshold; the mask's centroid, principal axes and spread define a frame, and the
+    reference landmarks are carried from the reference X-ray's frame to the upload's.
+    This aligns position, scale, rotation and mirroring of the same view; it does not
+    model anatomy. The confidence is the share of reference bone that lands on bone.
+    A whole batch is one set of array operations.
+    """
+
+    name = 'reference'
+
+    def detect_batch(self, images, reference):
+        """images: 2-D float32 arrays in [0, 1]. Returns [(points (k, 2), confidence)] in image pixels."""
+        stack, valid = stack_images([reference.image] + list(images))
+        thresholds = otsu_thresholds(stack, valid)
+        masks = (stack > thresholds[:, None, None]) & valid
+        centroids, axes, stds = mask_frames(masks)
+
+        ref_centroid, ref_axes, ref_stds = centroids[0], axes[0], np.where(stds[0] > 0, stds[0], 1.0)
+        # Landmarks and a grid of reference bone pixels, in the reference's normalized frame
+        local_points = ((reference.points - ref_centroid) @ ref_axes) / ref_stds
+        ys, xs = np.nonzero(masks[0])
+        step = max(1, len(xs) // (CONFIDENCE_GRID * CONFIDENCE_GRID))
+        bone = np.stack([xs[::step], ys[::step]], axis=1).astype(np.float64)
+        local_bone = ((bone - ref_centroid) @ ref_axes) / ref_stds
+
+        results = []
+        for i in range(1, stack.shape[0]):
+            if np.isnan(centroids[i]).any() or np.isnan(ref_centroid).any():
+                results.append((np.full(reference.points.shape, np.nan), 0.0))
+                continue
+            to_image = axes[i] * stds[i]  # local -> image offsets: axes scaled by spread
+            points = centroids[i] + local_points @ to_image.T
+            mapped = np.rint(centroids[i] + local_bone @ to_image.T).astype(np.int64)
+            height, width = images[i - 1].shape
+            inside = (mapped[:, 0] >= 0) & (mapped[:, 0] < width) & (mapped[:, 1] >= 0) & (mapped[:, 1] < height)
+            hits = masks[i, mapped[inside, 1], mapped[inside, 0]].sum() if len(mapped) else 0
+            confidence = float(hits) / len(mapped) if len(mapped) else 0.0
+            points[:, 0] = points[:, 0].clip(0, width - 1)
+            points[:, 1] = points[:, 1].clip(0, height - 1)
+            results.append((points, confidence))
+        return results
+
+
+def load_backend(spec):
+    """'reference', or 'package.module:factory' for another detector (called with no arguments)."""
+    if spec == 'reference':
+        return ReferenceLandmarkDetector()
+    module_name, _, attribute = spec.partition(':')
+    if not attribute:
+        raise ValueError(f"Unknown XRAY_DETECTOR_BACKEND '{spec}'. Use 'reference', 'none' or 'module:factory'.")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+def grayscale(img):
+    return np.asarray(img.convert('L'), dtype=np.float32) / 255.0
+
+
+# Per worker process: backends by spec, and references by (path, signature, max_dimension)
+_backends = {}
+_references = {}
+
+
+def _detection_reference(reference, max_dimension, max_pixels):
+    path, signature, landmarks = reference
+    cache_key = (path, signature, max_dimension)
+    prepared = _references.get(cache_key)
+    if prepared is None:
+        with open_image(path, max_pixels=max_pixels) as header:
+            original_width = header.width
+        with load_image(path, max_size=max_dimension, max_pixels=max_pixels) as img:
+            image = grayscale(img)
+        scale = image.shape[1] / original_width
+        points = np.array([[point['x'], point['y']] for point in landmarks], dtype=np.float64).reshape(-1, 2) * scale
+        prepared = DetectionReference(image, points, [point['label'] for point in landmarks])
+        _references.clear()  # one reference in use at a time; a changed file replaces it
+        _references[cache_key] = prepared
+    return prepared
+
+
+def run_detection_batch(backend_spec, paths, reference, max_dimension, max_pixels):
+    """
+    Detects the landmarks of a batch of uploaded radiographs (spooled files) with one
+    backend call. Runs in the detection pool's worker processes, without an app context.
+    `reference` is (path, signature, landmarks) of the reference X-ray.
+    Returns, per path, ('ok', {width, height, confidence, landmarks}) with landmarks in the
+    upload's own pixels, or ('error', message) when that upload could not be read.
+    """
+    backend = _backends.get(backend_spec)
+    if backend is None:
+        backend = _backends[backend_spec] = load_backend(backend_spec)
+    prepared = _detection_reference(reference, max_dimension, max_pixels)
+
+    outcomes = [None] * len(paths)
+    images, sizes, positions = [], [], []
+    for i, path in enumerate(paths):
+        try:
+            with open_image(path, max_pixels=max_pixels) as header:
+                size = header.size
+            with load_image(path, max_size=max_dimension, max_pixels=max_pixels) as img:
+                images.append(grayscale(img))
+            sizes.append(size)
+            positions.append(i)
+        except (OSError, ValueError) as e:
+            outcomes[i] = ('error', str(e))
+
+    if images:
+        for position, image, size, (points, confidence) in zip(positions, images, sizes,
+                                                                backend.detect_batch(images, prepared)):
+            scale = size[0] / image.shape[1]
+            landmarks = [{"label": label, "x": int(round(x * scale)), "y": int(round(y * scale))}
+                         for label, (x, y) in zip(prepared.labels, points) if not (np.isnan(x) or np.isnan(y))]
+            outcomes[position] = ('ok', {"width": size[0], "height": size[1], "confidence": round(confidence, 3),
+                                         "landmarks": landmarks})
+    return outcomes
@@ -0,0 +1,237 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from lib.media.images import DEFAULT_MAX_PIXELS
+from lib.workers import ProcessPool
+from lib.xray.detector import run_detection_batch
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DetectorBusy(Exception):
+    """Raised when XRAY_DETECT_MAX_PENDING radiographs are already waiting for the detector."""
+
+
+class DetectionFailed(ValueError):
+    """Raised when the detector could not read an uploaded radiograph."""
+
+
+class DetectionDispatcher:
+    """
+    Runs X-ray landmark detection off the request threads. Requests wait in a bounded
+    queue; a collector thread takes up to XRAY_DETECT_BATCH_MAX_SIZE of them (lingering
+    XRAY_DETECT_BATCH_LINGER_MS for more) and hands each batch to the detection process
+    pool as one job, so the backend sees whole batches and the CPU-heavy work never holds
+    the web workers' GIL. At most one batch per worker process (plus one) is handed over at
+    a time; beyond that requests stay queued, and once the queue is full new ones get
+    DetectorBusy at once instead of piling up.
+
+    The backend is XRAY_DETECTOR_BACKEND: 'reference' (lib.xray.detector.ReferenceLandmarkDetector),
+    'module:factory' for another detector, or 'none' to switch detection off.
+    """
+
+    def __init__(self, app=None):
+        self.backend = 'reference'
+        self.backend_version = "1"
+        self.max_dimension = 512
+        self.max_pending = 32
+        self.max_batch_size = 8
+        self.linger_seconds = 0.01
+        self.timeout_seconds = 30.0
+        self.max_pixels = DEFAULT_MAX_PIXELS
+        self.pool = ProcessPool('xray-detect', 'XRAY_DETECT', processes=1, preload=['lib.xray.detector'])
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._collector = None
+        self._in_flight = None
+        self._pid = None
+        self._stats = {"requests": 0, "rejected": 0, "batches": 0, "largest_batch": 0, "errors": 0, "timeouts": 0}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.backend = app.config.get('XRAY_DETECTOR_BACKEND', self.backend) or 'none'
+        self.backend_version = str(app.config.get('XRAY_DETECTOR_VERSION', self.backend_version))
+        self.max_dimension = int(app.config.get('XRAY_DETECT_MAX_DIMENSION', self.max_dimension))
+        self.max_pending = max(1, int(app.config.get('XRAY_DETECT_MAX_PENDING', self.max_pending)))
+        self.max_batch_size = max(1, int(app.config.get('XRAY_DETECT_BATCH_MAX_SIZE', self.max_batch_size)))
+        self.linger_seconds = max(0.0, float(app.config.get('XRAY_DETECT_BATCH_LINGER_MS', self.linger_seconds * 1000)) / 1000.0)
+        self.timeout_seconds = float(app.config.get('XRAY_DETECT_TIMEOUT_SECONDS', self.timeout_seconds))
+        self.max_pixels = int(app.config.get('MEDIA_MAX_IMAGE_PIXELS', self.max_pixels))
+        self.pool.init_app(app)
+        app.extensions['xray_detector'] = self
+        logger.info(f"X-ray detector: {self.backend}, {self.pool.processes} processes, batch size {self.max_batch_size}, "
+                    f"linger {self.linger_seconds * 1000:.1f}ms, {self.max_pending} pending at most.")
+
+    @property
+    def enabled(self):
+        return self.backend != 'none'
+
+    @property
+    def version(self):
+        """Identifies what the results depend on, e.g. 'reference-v1-512px' (see XrayResultCache)."""
+        return f"{self.backend}-v{self.backend_version}-{self.max_dimension}px"
+
+    def submit(self, path, reference):
+        """
+        Queues the radiograph at `path` for detection against a ReferenceAsset. Returns a
+        Future resolving to {width, height, confidence, landmarks: [{label, x, y}]}.
+        Raises DetectorBusy when the queue is full.
+        """
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((path, reference, future))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise DetectorBusy(f"{self.max_pending} X-rays are already waiting for the detector.")
+        return future
+
+    def detect(self, path, reference):
+        """Blocking variant of submit(). Raises DetectorBusy, DetectionFailed or TimeoutError."""
+        future = self.submit(path, reference)
+        try:
+            return future.result(timeout=self.timeout_seconds)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backend"] = self.backend
+        stats["version"] = self.version
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        stats["max_pending"] = self.max_pending
+        stats["max_batch_size"] = self.max_batch_size
+        stats["linger_ms"] = self.linger_seconds * 1000
+        stats["pool"] = self.pool.stats()
+        return stats
+
+    def shutdown(self):
+        """Stops the collector thread and the worker processes. Queued requests are failed."""
+        with self._lock:
+            collector, pending = self._collector, self._queue
+            self._collector = self._queue = None
+            self._pid = None
+        if pending is not None:
+            # Not put(): the queue may be full; the collector also checks for a replaced queue
+            try:
+                pending.put_nowait(None)
+            except queue.Full:
+                pass
+        if collector is not None and collector.is_alive():
+            collector.join(timeout=1)
+        self.pool.shutdown(wait=False)
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._collector is not None and self._pid == pid:
+            return
+        with self._lock:
+            # After a fork (e.g. gunicorn workers) the parent's threads do not exist in the child.
+            if self._collector is not None and self._pid == pid:
+                return
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._in_flight = threading.BoundedSemaphore(max(1, self.pool.processes) + 1)
+            self._collector = threading.Thread(
+                target=self._collect, args=(self._queue, self._in_flight),
+                name="xray-detect-dispatcher", daemon=True
+            )
+            self._pid = pid
+            self._collector.start()
+
+    def _collect(self, pending, in_flight):
+        while self._queue is pending:
+            try:
+                item = pending.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.linger_seconds
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            # Waiting requests whose caller gave up are dropped; one job per reference X-ray
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[1].name, item[1].signature), []).append(item)
+            for group in groups.values():
+                # Back-pressure: while the pool is busy, requests wait here and the queue fills up
+                in_flight.acquire()
+                self._send(group, in_flight)
+            if stop:
+                break
+
+        # Fail anything still queued once the dispatcher is shut down.
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[2].set_running_or_notify_cancel():
+                item[2].set_exception(RuntimeError("X-ray detector was shut down."))
+
+    def _send(self, group, in_flight):
+        reference = group[0][1]
+        landmarks = [{"x": point["x"], "y": point["y"], "label": point["label"]} for point in reference.landmarks.values()]
+        try:
+            job = self.pool.submit(run_detection_batch, self.backend, [path for path, _, _ in group],
+                                   (reference.path, reference.signature, landmarks), self.max_dimension, self.max_pixels)
+        except Exception as e:
+            in_flight.release()
+            self._fail(group, e)
+            return
+        job.add_done_callback(lambda done: self._resolve(group, done, in_flight))
+
+    def _resolve(self, group, job, in_flight):
+        in_flight.release()
+        try:
+            outcomes = job.result()
+        except Exception as e:
+            self._fail(group, e)
+            return
+        with self._lock:
+            self._stats["requests"] += len(group)
+            self._stats["batches"] += 1
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(group))
+        for (path, _, future), (status, value) in zip(group, outcomes):
+            if status == 'ok':
+                future.set_result(value)
+            else:
+                with self._lock:
+                    self._stats["errors"] += 1
+                future.set_exception(DetectionFailed(value))
+
+    def _fail(self, group, error):
+        logger.error(f"X-ray detection batch of {len(group)} failed: {error}")
+        with self._lock:
+            self._stats["errors"] += len(group)
+        for _, _, future in group:
+            future.set_exception(error)
+
+
+xray_detector = DetectionDispatcher()
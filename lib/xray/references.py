@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import threading
+import time
+from collections import namedtuple
+
+from flask import url_for
+
+from lib.media.images import read_dimensions
+from lib.media.serving import media_server
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REFERENCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# Landmarks of '<name>.png' are read from '<name>.landmarks.json' next to it:
+# [{"x": 391, "y": 52, "label": "...", "description": "..." (optional)}, ...]
+LANDMARKS_SUFFIX = '.landmarks.json'
+
+# A reference X-ray loaded in memory: its static key ('xray/<name>'), dimensions, strong
+# ETag (sha256 of the file), landmarks as returned by POST /xray, and the file
+# signatures (mtime_ns, size) of the image and its landmarks used to notice changes
+ReferenceAsset = namedtuple('ReferenceAsset', ['name', 'key', 'path', 'width', 'height', 'etag', 'landmarks',
+                                               'signature'])
+
+
+def landmarks_response(landmarks):
+    """'coordinates_data' of the response: '<x>,<y>' -> {x, y, label, description}."""
+    return {
+        f"{point['x']},{point['y']}": {
+            "x": point['x'],
+            "y": point['y'],
+            "label": point['label'],
+            "description": point.get('description') or f"Location of {point['label']}",
+        }
+        for point in landmarks
+    }
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ReferenceRegistry:
+    """
+    The reference X-rays under <static>/xray, loaded once: dimensions from the header,
+    the SHA-256 ETag and the landmark set (from the '.landmarks.json' sidecar). POST /xray
+    answers from here with no file access or decoding.
+
+    The folder is re-scanned at most every XRAY_REFERENCE_RELOAD_SECONDS (on the next
+    lookup); only images or landmark files whose mtime or size changed are loaded again,
+    so an asset can be replaced without a restart. 0 disables the re-scan.
+    """
+
+    def __init__(self, app=None):
+        self.folder = None
+        self.reload_seconds = 30.0
+        self._lock = threading.Lock()
+        self._assets = {}  # name -> ReferenceAsset
+        self._checked_at = 0.0
+        self._counters = {"lookups": 0, "loads": 0, "reloads": 0, "load_errors": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = os.path.join(app.static_folder, 'xray')
+        os.makedirs(self.folder, exist_ok=True)
+        self.reload_seconds = float(app.config.get('XRAY_REFERENCE_RELOAD_SECONDS', self.reload_seconds))
+        with self._lock:
+            self._assets = {}
+        self.refresh()
+        app.extensions['xray_references'] = self
+        logger.info(f"Loaded {len(self._assets)} reference X-rays from {self.folder}")
+
+    def get(self, name):
+        """The loaded asset `name`, or None when there is no such (readable) image."""
+        if self.reload_seconds > 0 and time.monotonic() - self._checked_at > self.reload_seconds:
+            self.refresh()
+        with self._lock:
+            self._counters["lookups"] += 1
+            return self._assets.get(name)
+
+    def url(self, asset):
+        """Absolute static URL of an asset for the current request's host."""
+        return url_for('static', filename=asset.key, _external=True)
+
+    def refresh(self):
+        """Loads new and changed assets and forgets deleted ones: one scandir and a stat per file; only changed files are read."""
+        self._checked_at = time.monotonic()
+        found = {}
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(REFERENCE_EXTENSIONS):
+                        found[entry.name] = entry.path
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            current = dict(self._assets)
+        assets = {}
+        for name, path in found.items():
+            signature = (_signature(path), _signature(self._landmarks_path(path)))
+            asset = current.get(name)
+            if asset is None or asset.signature != signature:
+                asset = self._load(name, path, signature, reloading=asset is not None)
+            if asset is not None:
+                assets[name] = asset
+
+        with self._lock:
+            self._assets = assets
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["assets"] = sorted(self._assets)
+        return stats
+
+    @staticmethod
+    def _landmarks_path(path):
+        return os.path.splitext(path)[0] + LANDMARKS_SUFFIX
+
+    def _load(self, name, path, signature, reloading=False):
+        try:
+            width, height = read_dimensions(path)
+            with open(path, 'rb') as f:
+                etag = hashlib.file_digest(f, 'sha256').hexdigest()
+            landmarks = self._read_landmarks(self._landmarks_path(path), name, width, height)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load reference X-ray {path}: {e}")
+            with self._lock:
+                self._counters["load_errors"] += 1
+            return None
+        with self._lock:
+            self._counters["reloads" if reloading else "loads"] += 1
+        if reloading:
+            logger.info(f"Reference X-ray {name} changed; reloaded.")
+        # Served from the static folder: the ETag of its responses is this same hash
+        media_server.prime_etag(path, signature[0][0], signature[0][1], etag)
+        return ReferenceAsset(name, posixpath.join('xray', name), path, width, height, etag,
+                              landmarks_response(landmarks), signature)
+
+    @staticmethod
+    def _read_landmarks(path, name, width, height):
+        try:
+            with open(path, encoding='utf-8') as f:
+                landmarks = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"Reference X-ray {name} has no {os.path.basename(path)}; it has no landmarks.")
+            return []
+        for point in landmarks:
+            if not isinstance(point, dict) or 'label' not in point or \
+                    not isinstance(point.get('x'), (int, float)) or not isinstance(point.get('y'), (int, float)):
+                raise ValueError(f"Invalid landmark in {path}: {point!r} (needs numeric 'x', 'y' and a 'label').")
+            if not (0 <= point['x'] <= width and 0 <= point['y'] <= height):
+                logger.warning(f"Landmark {point['label']} ({point['x']},{point['y']}) is outside {name} ({width}x{height}).")
+        return landmarks
+
+
+xray_references = ReferenceRegistry()